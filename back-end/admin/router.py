@@ -2,28 +2,32 @@ from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Body
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+import asyncio
 import logging
-from firebase_admin import auth, firestore
+from firebase_admin import auth
 from datetime import datetime
 import os
 from ingest import create_embeddings, load_documents, split_documents, create_vectorstore
-from langchain_chroma import Chroma
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import io
-from pypdf import PdfReader
-from unstructured.partition.auto import partition
 import json
+from syllabus_sections import split_documents_by_section
+from course_facts import update_course_facts
+from index_store import current_index_dir
+from dedup import (
+    CONTENT_HASH_FIELD, COURSE_FIELDS, SIGNATURE_FIELD, NearDuplicateIndex, content_hash, course_info,
+    decode_signature, deduplicate_chunks, encode_signature, get_shared_courses, get_shared_sources,
+    minhash_signature
+)
+from database import invalidate_user, start_user_deletion
+from database import aio
 from phantich import collect_user_questions, analyze_user_questions, visualize_top_questions
 from collections import Counter
-import matplotlib.pyplot as plt
-import numpy as np
 
 router = APIRouter()
 security = HTTPBearer()
 
 # Constants
-CHROMA_DB_DIRECTORY = "./chroma_db"
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
@@ -52,12 +56,15 @@ async def verify_admin(credentials: HTTPAuthorizationCredentials = Depends(secur
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def get_vectorstore():
+def get_vectorstore(embeddings=None):
     """Get or create vectorstore instance"""
-    embeddings = create_embeddings()
-    if os.path.exists(CHROMA_DB_DIRECTORY):
+    from langchain_chroma import Chroma
+    if embeddings is None:
+        embeddings = create_embeddings()
+    index_dir = current_index_dir()
+    if os.path.exists(index_dir):
         return Chroma(
-            persist_directory=CHROMA_DB_DIRECTORY,
+            persist_directory=index_dir,
             embedding_function=embeddings
         )
     else:
@@ -67,7 +74,7 @@ def clean_metadata(metadata: Dict[str, Any]) -> Dict[str, str]:
     """Clean and convert metadata to string values"""
     cleaned = {}
     for key, value in metadata.items():
-        if key == '_type':
+        if key in ('_type', SIGNATURE_FIELD, CONTENT_HASH_FIELD):
             continue
         try:
             if isinstance(value, (dict, list)):
@@ -111,6 +118,76 @@ def prepare_document_info(doc: Any, meta: Dict[str, Any], doc_id: Optional[str]
             "metadata": {}
         }
 
+def build_dedup_index(vectorstore):
+    """
+    Tạo chỉ mục near-duplicate từ các đoạn đã có trong vectorstore.
+
+    Chữ ký MinHash và hash nội dung được đọc từ metadata, không tính lại cho toàn
+    bộ vectorstore. Đoạn cũ chưa có được tính một lần và lưu lại vào metadata.
+    """
+    index = NearDuplicateIndex()
+    metadata_by_id = {}
+    missing = []
+    existing = vectorstore.get(include=["metadatas"])
+    for doc_id, meta in zip(existing.get("ids", []), existing.get("metadatas", [])):
+        meta = meta or {}
+        metadata_by_id[doc_id] = meta
+        signature = decode_signature(meta.get(SIGNATURE_FIELD))
+        if signature is None or not meta.get(CONTENT_HASH_FIELD):
+            missing.append(doc_id)
+        else:
+            index.add(doc_id, signature, meta[CONTENT_HASH_FIELD])
+    if missing:
+        legacy = vectorstore.get(ids=missing, include=["documents"])
+        backfill_ids, backfill_metadatas = [], []
+        for doc_id, text in zip(legacy.get("ids", []), legacy.get("documents", [])):
+            if not text:
+                continue
+            signature = minhash_signature(text)
+            content = content_hash(text)
+            index.add(doc_id, signature, content)
+            meta = dict(
+                metadata_by_id[doc_id], **{SIGNATURE_FIELD: encode_signature(signature), CONTENT_HASH_FIELD: content}
+            )
+            metadata_by_id[doc_id] = meta
+            backfill_ids.append(doc_id)
+            backfill_metadatas.append(meta)
+        if backfill_ids:
+            vectorstore._collection.update(ids=backfill_ids, metadatas=backfill_metadatas)
+            logging.info(f"Saved MinHash signatures and content hashes for {len(backfill_ids)} existing chunks")
+    return index, metadata_by_id
+
+def unlink_source(vectorstore, source: str):
+    """Gỡ một nguồn khỏi các đoạn dùng chung, chuyển quyền sở hữu sang nguồn còn lại"""
+    existing = vectorstore.get(include=["metadatas"])
+    update_ids, update_metadatas = [], []
+    for doc_id, meta in zip(existing.get("ids", []), existing.get("metadatas", [])):
+        if not meta or "shared_sources" not in meta:
+            continue
+        sources = get_shared_sources(meta)
+        if source not in sources or len(sources) < 2:
+            continue
+        sources = [s for s in sources if s != source]
+        courses = get_shared_courses(meta)
+        meta = dict(meta)
+        if meta.get("source") == source:
+            # Nguồn sở hữu bị gỡ: mã/tên học phần chuyển sang nguồn còn lại
+            for field in COURSE_FIELDS:
+                meta.pop(field, None)
+            owner = next((c for c in courses if c.get("source") == sources[0]), {})
+            meta.update(course_info(owner))
+        meta["source"] = sources[0]
+        meta["shared_sources"] = json.dumps(sources, ensure_ascii=False)
+        meta["shared_courses"] = json.dumps(
+            [c for c in courses if c.get("source") not in (source, sources[0])], ensure_ascii=False
+        )
+        meta["duplicate_count"] = len(sources) - 1
+        update_ids.append(doc_id)
+        update_metadatas.append(meta)
+    if update_ids:
+        vectorstore._collection.update(ids=update_ids, metadatas=update_metadatas)
+    return len(update_ids)
+
 @router.get("/users")
 async def get_users(token: dict = Depends(verify_admin)):
     """Get list of users (admin only)"""
@@ -157,7 +234,12 @@ async def delete_user(uid: str, token: dict = Depends(verify_admin)):
     """Delete user (admin only)"""
     try:
         auth.delete_user(uid)
-        return {"status": "success", "message": "User deleted successfully"}
+        invalidate_user(uid=uid)
+        # Xóa dữ liệu Firestore của tài khoản (gồm document user) ở luồng nền
+        job = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: start_user_deletion(uid, delete_account=True)
+        )
+        return {"status": "success", "message": "User deleted successfully", "job": job}
     except Exception as e:
         logging.error(f"Error deleting user: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -223,6 +305,8 @@ async def delete_document(source: str, token: dict = Depends(verify_admin)):
             raise HTTPException(status_code=400, detail="No source file specified")
             
         vectorstore = get_vectorstore()
+        # Đoạn dùng chung vẫn được giữ lại cho các đề cương khác
+        unlink_source(vectorstore, source)
         vectorstore._collection.delete(where={"source": source})
         
         return {"status": "success", "message": "Document deleted successfully"}
@@ -254,7 +338,9 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
             
         logging.info(f"Processing file: {filename} (safe name: {safe_filename})")
         
-        vectorstore = get_vectorstore()
+        # Dùng chung một model embedding (có cache) cho cả request
+        embeddings = create_embeddings()
+        vectorstore = get_vectorstore(embeddings)
         existing_docs = vectorstore.get(where={"source": safe_filename})
         if existing_docs and len(existing_docs['ids']) > 0:
             raise HTTPException(
@@ -265,6 +351,7 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
         text = None
         if filename.lower().endswith('.pdf'):
             try:
+                from pypdf import PdfReader
                 content = await file.read()
                 pdf_file = io.BytesIO(content)
                 pdf_reader = PdfReader(pdf_file)
@@ -294,6 +381,7 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
                 )
         elif filename.lower().endswith(('.doc', '.docx')):
             try:
+                from unstructured.partition.auto import partition
                 elements = partition(file=file.file)
                 text = "\n".join([str(el) for el in elements])
                 
@@ -341,8 +429,6 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
                 detail=f"File {filename} is empty or contains no valid text content."
             )
         
-        embeddings = create_embeddings()
-        
         documents = [Document(
             page_content=text,
             metadata={"source": safe_filename}
@@ -352,25 +438,10 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
             chunk_size = min(CHUNK_SIZE, 1000)
             chunk_overlap = min(CHUNK_OVERLAP, 100)
             
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap,
-                length_function=len,
-                is_separator_regex=False,
-                separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
-            )
-            
-            text_parts = [text[i:i+50000] for i in range(0, len(text), 50000)]
-            chunks = []
-            
-            for part in text_parts:
-                part_chunks = text_splitter.split_text(part)
-                for chunk in part_chunks:
-                    if chunk.strip():
-                        chunks.append(Document(
-                            page_content=chunk.strip(),
-                            metadata={"source": safe_filename}
-                        ))
+            # Chia theo mục đề cương (mục tiêu, đánh giá, giáo trình, rubric...) trước khi chia nhỏ
+            chunks = split_documents_by_section(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            for chunk in chunks:
+                chunk.page_content = chunk.page_content.strip()
             
             chunks = [chunk for chunk in chunks if chunk.page_content.strip()]
                 
@@ -394,6 +465,25 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
                 status_code=400,
                 detail=f"Cannot split content of file {filename}. File may be empty or contain no valid text content."
             )
+
+        # Cập nhật bảng thông tin môn học (số tín chỉ, mã môn...) cho câu hỏi trả lời nhanh
+        try:
+            update_course_facts(documents)
+        except Exception as e:
+            logging.error(f"Error updating course facts for file {filename}: {str(e)}")
+
+        # Các đoạn trùng nội dung với dữ liệu đã có chỉ được liên kết thêm nguồn, không lưu lại
+        existing_index, existing_metadata = build_dedup_index(vectorstore)
+        chunks, updated_metadata, dedup_stats = deduplicate_chunks(chunks, existing_index, existing_metadata)
+        if updated_metadata:
+            vectorstore._collection.update(
+                ids=list(updated_metadata.keys()),
+                metadatas=list(updated_metadata.values())
+            )
+        logging.info(
+            f"Dedup {safe_filename}: {dedup_stats['duplicate_chunks']}/{dedup_stats['total_chunks']} "
+            f"đoạn trùng (tỉ lệ {dedup_stats['dedup_ratio'] * 100:.1f}%)"
+        )
         
         try:
             logging.info(f"Attempting to add {len(chunks)} chunks to Chroma for file {safe_filename}")
@@ -407,17 +497,33 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
                     "total_chunks": len(chunks),
                     "chunk_size": len(chunk.page_content)
                 }
+                for key in (
+                    "shared_sources", "shared_courses", "duplicate_count", "section", "section_title",
+                    "course_code", "course_name", SIGNATURE_FIELD, CONTENT_HASH_FIELD
+                ):
+                    if key in chunk.metadata:
+                        metadata[key] = chunk.metadata[key]
                 metadatas_list.append(metadata)
                 texts_list.append(chunk.page_content)
             
-            if not chunks or not metadatas_list:
+            if not chunks:
+                # Toàn bộ nội dung đã có sẵn, chỉ cần liên kết nguồn ở bước dedup
+                return {
+                    "status": "success",
+                    "message": f"File {filename} uploaded successfully",
+                    "chunks": 0,
+                    "dedup": dedup_stats,
+                    "embedding_cache": embeddings.cache_stats() if hasattr(embeddings, "cache_stats") else None
+                }
+
+            if not metadatas_list:
                 raise Exception("No data to add to Chroma")
                 
             if len(chunks) != len(metadatas_list):
                 logging.error(f"Mismatch between chunks ({len(chunks)}) and metadatas ({len(metadatas_list)}) length for file {safe_filename}")
                 raise Exception("Internal error: Number of text chunks and metadata do not match.")
             
-            vectorstore = get_vectorstore()
+            vectorstore = get_vectorstore(embeddings)
             
             batch_size = 10
             for i in range(0, len(texts_list), batch_size):
@@ -435,8 +541,9 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
                     try:
                         if "index out of range" in str(batch_error).lower():
                             logging.info("Attempting to recover by creating new vectorstore...")
+                            from langchain_chroma import Chroma
                             vectorstore = Chroma(
-                                persist_directory=CHROMA_DB_DIRECTORY,
+                                persist_directory=current_index_dir(),
                                 embedding_function=embeddings
                             )
                             vectorstore.add_texts(
@@ -451,6 +558,8 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
                         continue
             
             logging.info(f"Successfully added all chunks to Chroma for file {safe_filename}")
+            if hasattr(embeddings, "format_report"):
+                logging.info(embeddings.format_report())
         except Exception as e:
             logging.error(f"Error adding texts to Chroma for file {filename} (safe name: {safe_filename}): {str(e)}")
             raise HTTPException(
@@ -461,7 +570,9 @@ async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify
         return {
             "status": "success",
             "message": f"File {filename} uploaded successfully",
-            "chunks": len(chunks)
+            "chunks": len(chunks),
+            "dedup": dedup_stats,
+            "embedding_cache": embeddings.cache_stats() if hasattr(embeddings, "cache_stats") else None
         }
         
     except HTTPException as he:
@@ -492,6 +603,11 @@ async def add_urls(urls: List[str] = Body(...), token: dict = Depends(verify_adm
         vectorstore = create_vectorstore(chunks, embeddings)
         if not vectorstore:
             raise HTTPException(status_code=500, detail="Cannot create new vectorstore")
+
+        try:
+            update_course_facts(documents)
+        except Exception as e:
+            logging.error(f"Error updating course facts: {str(e)}")
             
         return {"message": f"Successfully added {len(urls)} URLs"}
         
@@ -503,15 +619,12 @@ async def add_urls(urls: List[str] = Body(...), token: dict = Depends(verify_adm
 async def get_feedbacks(token: dict = Depends(verify_admin)):
     """Get all feedbacks (admin only)"""
     try:
-        db = firestore.client()
-        feedbacks_ref = db.collection('feedbacks')
-        feedbacks = feedbacks_ref.stream()
+        feedbacks = await aio.list_feedbacks()
         
         feedback_list = []
-        for feedback in feedbacks:
-            feedback_data = feedback.to_dict()
+        for feedback_data in feedbacks:
             feedback_list.append({
-                "id": feedback.id,
+                "id": feedback_data["id"],
                 "user_email": feedback_data.get("user_email", ""),
                 "message": feedback_data.get("message", ""),
                 "status": feedback_data.get("status", "pending"),
@@ -527,13 +640,7 @@ async def get_feedbacks(token: dict = Depends(verify_admin)):
 async def update_feedback_status(feedback_id: str, status: FeedbackStatus, token: dict = Depends(verify_admin)):
     """Update feedback status (admin only)"""
     try:
-        db = firestore.client()
-        feedback_ref = db.collection('feedbacks').document(feedback_id)
-        
-        feedback_ref.update({
-            "status": status.status,
-            "updated_at": datetime.now().isoformat()
-        })
+        await aio.update_feedback(feedback_id, status.status)
         
         return {"status": "success", "message": "Feedback status updated successfully"}
     except Exception as e:
@@ -544,16 +651,9 @@ async def update_feedback_status(feedback_id: str, status: FeedbackStatus, token
 async def delete_feedback(feedback_id: str, token: dict = Depends(verify_admin)):
     """Delete a feedback (admin only)"""
     try:
-        db = firestore.client()
-        feedback_ref = db.collection('feedbacks').document(feedback_id)
-        
-        # Check if feedback exists
-        feedback_doc = feedback_ref.get()
-        if not feedback_doc.exists:
+        # Delete the feedback (if it exists)
+        if not await aio.delete_feedback(feedback_id):
             raise HTTPException(status_code=404, detail="Feedback not found")
-            
-        # Delete the feedback
-        feedback_ref.delete()
         
         return {"status": "success", "message": "Feedback deleted successfully"}
     except Exception as e:
@@ -593,6 +693,9 @@ async def get_analysis(token: dict = Depends(verify_admin)):
         # Reverse the order to display from highest to lowest from top to bottom
         # Sort the data in ascending order based on count for correct barh plotting
         sorted_data = sorted(zip(questions, counts), key=lambda x: x[1])
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
         questions = [q for q, c in sorted_data]
         counts = [c for q, c in sorted_data]
         
@@ -0,0 +1,157 @@
+"""
+Benchmark nhận diện ý định: quét tuyến tính các danh sách từ khóa (cách cũ) so với
+automaton Aho–Corasick một lượt (chatbot.intents).
+
+Chạy từ thư mục back-end: python benchmarks/bench_intents.py [--repeat 200]
+
+Cả hai cách cùng trả lời: có phải lời chào không, câu hỏi có từ khóa mục đề cương
+không và thuộc mục nào, có nêu môn học mới không và tên/mã môn là gì. In ra thời
+gian trung bình mỗi câu hỏi và số câu hai cách cho kết quả khác nhau.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+from chatbot.intents import SPECIAL_KEYWORDS, SPECIAL_SUBJECTS, intent_matcher  # noqa: E402
+from chatbot.router import extract_last_subject, extract_subject  # noqa: E402
+from loadtest.corpus import build_questions  # noqa: E402
+from syllabus_sections import SUBJECT_CODE_PATTERN, detect_section  # noqa: E402
+
+SUBJECT_NAME_PATTERN = re.compile(r"môn ([\w\sÀ-ỹ\-]+)", re.IGNORECASE)
+
+EXTRA_QUESTIONS = [
+    "xin chào", "chào bạn", "hello", "giáo trình", "số tín chỉ", "rubric đánh giá",
+    "Cầu lông có mấy tín chỉ?", "mình muốn học môn leo núi thể thao", "môn này bắt buộc hay tự chọn?",
+    "Cho mình xem đề cương môn Lập trình Python nâng cao", "Đề cương môn 71ITSE31003 gồm những gì?",
+    "Khoa có những môn tự chọn nào?", "điểm qua môn", "tài liệu tham khảo môn Cơ sở dữ liệu",
+]
+
+
+def legacy_extract_subject(content):
+    content = content.strip().lower()
+    if content in SPECIAL_KEYWORDS:
+        return None
+    code_match = SUBJECT_CODE_PATTERN.search(content)
+    if code_match:
+        return code_match.group(0)
+    name_match = SUBJECT_NAME_PATTERN.search(content)
+    if name_match:
+        subject = name_match.group(1).strip()
+        if subject and not any(kw in subject.lower() for kw in SPECIAL_KEYWORDS):
+            return subject.split(".")[0].strip()
+    for s in SPECIAL_SUBJECTS:
+        if s in content:
+            return s.capitalize()
+    return None
+
+
+def legacy_is_subject_switch(question):
+    if re.search(r"\b\d{2}[A-Z]{2,}[A-Z0-9]*\d{3,}\b", question, re.IGNORECASE):
+        return True
+    return "môn" in question.lower()
+
+
+def legacy_extract_last_subject(chat_history):
+    for chat_turn in reversed(chat_history):
+        for msg in reversed(chat_turn.get("messages", [])):
+            if msg.get("role") != "user":
+                continue
+            subject = legacy_extract_subject(msg.get("content", ""))
+            if subject:
+                return subject
+    return None
+
+
+def legacy(question, greeting_keywords):
+    """Các bước stream_answer làm trước đây cho một câu hỏi"""
+    if question.lower().strip() in greeting_keywords:
+        return True, False, None, False, None
+    question_lower = question.lower().strip()
+    has_keyword = any(kw in question_lower for kw in SPECIAL_KEYWORDS)
+    section, subject = None, None
+    if has_keyword:
+        section = detect_section(question_lower)
+        if legacy_is_subject_switch(question):
+            subject = legacy_extract_subject(question)
+    switch = legacy_is_subject_switch(question)
+    shared_subject = legacy_extract_subject(question) if switch else None
+    return False, has_keyword, section, switch, subject or shared_subject
+
+
+def single_pass(question):
+    # Câu hỏi mới nên không đi qua cache kết quả
+    match = intent_matcher._scan(question)
+    if match.greeting:
+        return True, False, None, False, None
+    subject = extract_subject(question, match) if match.subject_switch else None
+    return False, bool(match.keywords), match.section, match.subject_switch, subject
+
+
+def build_history(questions, turns=5):
+    """Lịch sử 5 lượt hỏi-đáp, môn học nằm ở lượt cũ nhất (trường hợp phải duyệt hết)"""
+    history = [{"messages": [{"role": "user", "content": questions[0]}, {"role": "assistant", "content": "..."}]}]
+    for question in ["giáo trình", "đánh giá", "mục tiêu", "nội dung chi tiết"][:turns - 1]:
+        history.append({"messages": [{"role": "user", "content": question}, {"role": "assistant", "content": "..."}]})
+    return history
+
+
+def timed(fn, questions, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for question in questions:
+            fn(question)
+    return (time.perf_counter() - started) / (repeat * len(questions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--courses", type=int, default=12)
+    args = parser.parse_args()
+
+    with open("data/greetings.json", "r", encoding="utf-8") as f:
+        greeting_keywords = json.load(f).get("greeting_keywords", [])
+    questions = build_questions(args.courses) + EXTRA_QUESTIONS
+    print(f"{len(questions)} câu hỏi, lặp {args.repeat} lần\n")
+    print("Nhận diện một câu hỏi (các bước đầu của stream_answer):")
+
+    legacy_seconds = timed(lambda q: legacy(q, greeting_keywords), questions, args.repeat)
+    new_seconds = timed(single_pass, questions, args.repeat)
+    print(f"  quét tuyến tính  {legacy_seconds * 1e6:8.1f} µs/câu")
+    print(f"  Aho–Corasick     {new_seconds * 1e6:8.1f} µs/câu  (x{legacy_seconds / new_seconds:.1f})")
+
+    # Lịch sử được quét lại ở mỗi lượt hỏi nên kết quả nằm sẵn trong cache
+    histories = [build_history([q]) for q in questions if extract_subject(q)]
+    legacy_seconds = timed(legacy_extract_last_subject, histories, args.repeat)
+    new_seconds = timed(extract_last_subject, histories, args.repeat)
+    print(f"\nextract_last_subject (5 lượt lịch sử, {len(histories)} hội thoại):")
+    print(f"  quét tuyến tính  {legacy_seconds * 1e6:8.1f} µs/lần")
+    print(f"  Aho–Corasick     {new_seconds * 1e6:8.1f} µs/lần  (x{legacy_seconds / new_seconds:.1f})")
+
+    started = time.perf_counter()
+    intent_matcher._refresh(force=True)
+    print(f"\nBiên dịch lại automaton: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    differences = []
+    mismatched_histories = sum(
+        1 for history in histories if legacy_extract_last_subject(history) != extract_last_subject(history)
+    )
+    for question in questions:
+        old, new = legacy(question, greeting_keywords), single_pass(question)
+        if old != new and question not in [d[0] for d in differences]:
+            differences.append((question, old, new))
+    print(f"\nKết quả khác cách cũ: {len(differences)}/{len(set(questions))} câu, "
+          f"{mismatched_histories}/{len(histories)} hội thoại")
+    for question, old, new in differences:
+        print(f"  {question!r}\n    cũ: {old}\n    mới: {new}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark framing SSE của câu trả lời: từng token (cách cũ) so với gộp frame (chatbot.sse).
+
+Chạy từ thư mục back-end: python benchmarks/bench_sse.py [--tokens-per-second 40]
+
+In ra số frame, số byte mỗi câu trả lời, thời gian encode và tốc độ frame/giây
+khi encode không giới hạn tốc độ, cùng số frame/byte khi token đến với tốc độ
+giống Ollama trên CPU.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.sse import FlushPolicy, coalesce_text, sse_event, split_text  # noqa: E402
+
+SAMPLE_ANSWER = (
+    "Môn Kiểm thử tự động (71ITSE31003) có 3 tín chỉ. Đánh giá và cho điểm gồm: "
+    "điểm quá trình chiếm 50% (bài tập cá nhân, bài tập nhóm, chuyên cần) và điểm thi "
+    "cuối kỳ chiếm 50%. Sinh viên cần đạt tối thiểu 4/10 để qua môn. Giáo trình chính là "
+    "tài liệu do giảng viên biên soạn, kèm các tài liệu tham khảo về Selenium và kiểm thử "
+    "hiệu năng. Bạn có muốn biết thêm thông tin về mục tiêu, nội dung, tài liệu tham khảo, "
+    "phương thức đánh giá, nhiệm vụ sinh viên, số tín chỉ môn học hoặc các vấn đề khác liên "
+    "quan đến môn học này hoặc các môn học khác tại Khoa Công nghệ Thông Tin trường đại học "
+    "Văn Lang không? Hãy nói cho tôi biết nhé!"
+) * 3
+
+
+def tokenize(text, size=4):
+    """Chia câu trả lời thành token ~4 ký tự như tokenizer của LLM"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def legacy_frame(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def token_stream(tokens, tokens_per_second):
+    delay = 1 / tokens_per_second if tokens_per_second > 0 else 0
+    for token in tokens:
+        if delay:
+            await asyncio.sleep(delay)
+        yield token
+
+
+async def run_legacy(tokens, tokens_per_second):
+    frames = []
+    async for token in token_stream(tokens, tokens_per_second):
+        frames.append(legacy_frame({"type": "chunk", "text": token}))
+    frames.append(legacy_frame({"type": "complete"}))
+    return frames
+
+
+async def run_coalesced(tokens, tokens_per_second, policy):
+    frames = []
+    async for text in coalesce_text(token_stream(tokens, tokens_per_second), policy):
+        frames.append(sse_event("chunk", text=text))
+    frames.append(sse_event("complete"))
+    return frames
+
+
+def legacy_greeting(greeting):
+    frames = []
+    for word in greeting.split():
+        for char in word:
+            frames.append(legacy_frame({"type": "chunk", "text": char}))
+        frames.append(legacy_frame({"type": "chunk", "text": " "}))
+    frames.append(legacy_frame({"type": "complete"}))
+    # Cách cũ ngủ 1 ms mỗi ký tự và 2 ms mỗi từ
+    sleep_seconds = sum(len(w) * 0.001 + 0.002 for w in greeting.split())
+    return frames, sleep_seconds
+
+
+def measure(name, frames, elapsed):
+    size = sum(len(f.encode("utf-8")) for f in frames)
+    print(f"  {name:<12} {len(frames):6d} frame  {size:8d} byte  {elapsed * 1000:8.1f} ms")
+    return len(frames), size
+
+
+def encode_throughput(tokens, policy, repeat):
+    """Frame/giây và token/giây khi encode không chờ LLM"""
+    started = time.perf_counter()
+    legacy_frames = 0
+    for _ in range(repeat):
+        for token in tokens:
+            legacy_frame({"type": "chunk", "text": token})
+            legacy_frames += 1
+    legacy_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    new_frames = 0
+    for _ in range(repeat):
+        for text in split_text("".join(tokens), policy):
+            sse_event("chunk", text=text)
+            new_frames += 1
+    new_elapsed = time.perf_counter() - started
+    return (
+        legacy_frames / legacy_elapsed, len(tokens) * repeat / legacy_elapsed,
+        new_frames / new_elapsed, len(tokens) * repeat / new_elapsed
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens-per-second", type=float, default=40)
+    parser.add_argument("--flush-ms", type=float, default=50)
+    parser.add_argument("--flush-bytes", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    policy = FlushPolicy(max_delay=args.flush_ms / 1000, max_bytes=args.flush_bytes)
+    tokens = tokenize(SAMPLE_ANSWER)
+    print(f"Câu trả lời mẫu: {len(SAMPLE_ANSWER)} ký tự, {len(tokens)} token, "
+          f"{args.tokens_per_second:g} token/s, flush {args.flush_ms:g} ms / {args.flush_bytes} byte\n")
+
+    print("Câu trả lời từ LLM:")
+    started = time.perf_counter()
+    legacy = measure("per-token", await run_legacy(tokens, args.tokens_per_second), time.perf_counter() - started)
+    started = time.perf_counter()
+    new = measure("coalesced", await run_coalesced(tokens, args.tokens_per_second, policy), time.perf_counter() - started)
+    print(f"  => giảm {100 * (1 - new[0] / legacy[0]):.1f}% frame, {100 * (1 - new[1] / legacy[1]):.1f}% byte")
+
+    greeting = SAMPLE_ANSWER[:200]
+    print("\nLời chào:")
+    frames, sleep_seconds = legacy_greeting(greeting)
+    measure("per-char", frames, sleep_seconds)
+    started = time.perf_counter()
+    greeting_frames = [sse_event("chunk", text=t) for t in split_text(greeting, policy)] + [sse_event("complete")]
+    measure("coalesced", greeting_frames, time.perf_counter() - started)
+
+    legacy_fps, legacy_tps, new_fps, new_tps = encode_throughput(tokens, policy, args.repeat)
+    print("\nEncode (không chờ LLM):")
+    print(f"  per-token    {legacy_fps:12,.0f} frame/s  {legacy_tps:12,.0f} token/s")
+    print(f"  coalesced    {new_fps:12,.0f} frame/s  {new_tps:12,.0f} token/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
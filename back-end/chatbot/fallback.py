@@ -0,0 +1,113 @@
+"""
+Câu trả lời trích xuất (không dùng LLM) khi Ollama quá tải, chậm hoặc lỗi.
+
+Lúc đó các chunk liên quan đã được truy xuất xong, nên thay vì chỉ báo lỗi, bot
+trả về các câu trong đề cương khớp nhiều nhất với câu hỏi: nhóm theo mục đề
+cương/nguồn, in đậm các từ khớp và ghi rõ nguồn. Chất lượng thấp hơn câu trả
+lời của LLM nhưng vẫn đúng nội dung và trả về gần như ngay lập tức.
+"""
+import os
+import re
+from collections import Counter
+
+from syllabus_sections import SECTION_TITLES, fold_accents
+
+# Tắt hẳn chế độ trả lời trích xuất bằng LLM_FALLBACK_ENABLED=0
+LLM_FALLBACK_ENABLED = os.getenv("LLM_FALLBACK_ENABLED", "1") == "1"
+# Chưa nhận được token đầu tiên sau thời gian này (gồm cả thời gian xếp hàng) thì trả lời trích xuất
+LLM_TTFT_SLO_SECONDS = float(os.getenv("LLM_TTFT_SLO_SECONDS", "25"))
+
+MAX_GROUPS = 3
+SENTENCES_PER_GROUP = 3
+
+FALLBACK_NOTICE = {
+    "overload": "Hệ thống đang quá tải nên mình trích dẫn trực tiếp nội dung liên quan trong đề cương:",
+    "slo": "Câu trả lời đang mất nhiều thời gian hơn bình thường nên mình trích dẫn trực tiếp nội dung liên quan trong đề cương:",
+    "llm_error": "Mô hình trả lời đang tạm thời gián đoạn nên mình trích dẫn trực tiếp nội dung liên quan trong đề cương:",
+}
+NO_CONTEXT_ANSWER = (
+    "Hệ thống đang quá tải và mình chưa tìm thấy nội dung phù hợp trong đề cương. "
+    "Bạn vui lòng thử lại sau ít phút nhé."
+)
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[\.\!\?;])\s+|\n+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Từ quá phổ biến, không dùng để chấm điểm câu
+_STOPWORDS = {
+    "mon", "hoc", "cua", "la", "gi", "nhu", "the", "nao", "va", "cho", "em", "minh",
+    "ban", "toi", "co", "khong", "ve", "trong", "cac", "nhung", "duoc", "o",
+}
+
+fallback_counters = Counter()
+
+
+def _terms(text: str) -> set:
+    return {w for w in _WORD_RE.findall(fold_accents(text)) if len(w) > 1 and w not in _STOPWORDS}
+
+
+def _score_sentence(sentence: str, query_terms: set) -> float:
+    terms = _terms(sentence)
+    if not terms:
+        return 0.0
+    return len(terms & query_terms) / (len(terms) ** 0.5)
+
+
+def _highlight(sentence: str, query_terms: set) -> str:
+    """In đậm các từ khớp với câu hỏi (so khớp không dấu)"""
+    def bold(match):
+        word = match.group(0)
+        return f"**{word}**" if fold_accents(word) in query_terms else word
+    # Gộp các từ in đậm liền nhau thành một cụm
+    return _WORD_RE.sub(bold, sentence).replace("** **", " ")
+
+
+def _group_title(metadata: dict) -> str:
+    section = metadata.get("section")
+    title = metadata.get("section_title") or SECTION_TITLES.get(section, "")
+    course = metadata.get("course_name") or metadata.get("course_code") or metadata.get("name") or ""
+    return " – ".join(part for part in (title, course) if part) or "Nội dung liên quan"
+
+
+def _source_label(metadata: dict) -> str:
+    label = metadata.get("name") or os.path.basename(str(metadata.get("source", ""))) or "đề cương"
+    page = metadata.get("page")
+    return f"{label}, trang {page + 1 if isinstance(page, int) else page}" if page not in (None, "") else label
+
+
+def build_extractive_answer(question: str, docs, reason: str = "overload") -> str:
+    """Ghép câu trả lời markdown từ các câu khớp nhất trong các chunk đã truy xuất"""
+    if not docs:
+        return NO_CONTEXT_ANSWER
+    query_terms = _terms(question)
+
+    # Nhóm các chunk theo (mục đề cương, nguồn), giữ thứ tự xếp hạng của retrieval
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("section"), doc.metadata.get("source"))
+        group = groups.setdefault(key, {"rank": rank, "metadata": doc.metadata, "sentences": []})
+        for sentence in _SENTENCE_SPLIT_RE.split(doc.page_content):
+            sentence = " ".join(sentence.split())
+            if len(sentence) >= 8:
+                group["sentences"].append((_score_sentence(sentence, query_terms), len(group["sentences"]), sentence))
+
+    parts = [FALLBACK_NOTICE.get(reason, FALLBACK_NOTICE["overload"])]
+    for group in sorted(groups.values(), key=lambda g: g["rank"])[:MAX_GROUPS]:
+        best = sorted(group["sentences"], key=lambda s: -s[0])[:SENTENCES_PER_GROUP]
+        if not best:
+            continue
+        # Giữ thứ tự câu như trong đề cương cho dễ đọc
+        lines = [f"- {_highlight(sentence, query_terms)}" for _, _, sentence in sorted(best, key=lambda s: s[1])]
+        parts.append(
+            f"### {_group_title(group['metadata'])}\n" + "\n".join(lines) + f"\n\n_Nguồn: {_source_label(group['metadata'])}_"
+        )
+    if len(parts) == 1:
+        return NO_CONTEXT_ANSWER
+    return "\n\n".join(parts)
+
+
+def record_fallback(reason: str):
+    fallback_counters[reason] += 1
+
+
+def fallback_stats() -> dict:
+    return {"enabled": LLM_FALLBACK_ENABLED, "ttft_slo_seconds": LLM_TTFT_SLO_SECONDS, **dict(fallback_counters)}
@@ -0,0 +1,261 @@
+"""
+Nhận diện ý định của câu hỏi trong một lượt quét.
+
+Trước đây mỗi request quét tuyến tính nhiều danh sách từ khóa (lời chào, từ khóa
+mục đề cương, tên môn thể chất) và chạy lại regex mã môn ở nhiều hàm. Ở đây mọi
+từ khóa được biên dịch một lần thành automaton Aho–Corasick trên dãy từ của văn
+bản đã bỏ dấu (chạy theo từ thay vì theo ký tự: ít bước hơn và tự khớp đúng ranh
+giới từ), nên một lượt quét câu hỏi trả về cùng lúc: lời chào, từ khóa/mục đề
+cương, tên môn học và mã môn. Từ khóa lấy từ data/greetings.json và data/mon_tu_chon.json,
+tự biên dịch lại khi các file này thay đổi.
+"""
+import json
+import logging
+import os
+import random
+import string
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from course_facts import extract_elective_facts
+from syllabus_sections import SUBJECT_CODE_PATTERN, SYLLABUS_SECTIONS, fold_accents
+
+GREETINGS_PATH = os.getenv("GREETINGS_PATH", "data/greetings.json")
+ELECTIVES_PATH = os.getenv("ELECTIVES_PATH", "data/mon_tu_chon.json")
+# Khoảng thời gian tối thiểu giữa hai lần kiểm tra file dữ liệu có thay đổi
+INTENTS_RELOAD_SECONDS = float(os.getenv("INTENTS_RELOAD_SECONDS", "5"))
+# Kết quả nhận diện được nhớ theo nội dung: lịch sử hội thoại của một người được
+# quét lại ở mỗi lượt hỏi (extract_last_subject) nhưng hầu như không đổi
+INTENTS_CACHE_SIZE = int(os.getenv("INTENTS_CACHE_SIZE", "4096"))
+
+# Các từ khóa đặc biệt để nhận diện câu hỏi ngắn gọn về thông tin môn học
+SPECIAL_KEYWORDS = [
+    "mục tiêu", "nội dung", "tài liệu tham khảo", "phương thức đánh giá", "số tín chỉ",
+    "giáo trình", "chuẩn đầu ra", "nhiệm vụ sinh viên", "rubric", "đánh giá", "cho điểm",
+    "thông tin về học phần", "mô tả", "phương pháp giảng dạy", "nội dung chi tiết",
+    "yêu cầu", "biên soạn", "phụ lục", "rubric đánh giá"
+]
+# Danh sách các môn đặc biệt (có thể mở rộng), nhận diện cả khi không có từ 'môn'
+SPECIAL_SUBJECTS = [
+    "cờ vua", "bóng rổ", "bóng bàn", "bóng chuyền", "bơi lội", "cầu lông", "võ thuật", "golf", "tennis", "futsal", "leo núi", "khiêu vũ", "fitness", "hatha yoga"
+]
+
+DEFAULT_GREETING = "Xin chào! Tôi là Syllasbus-Bot. Tôi có thể giúp gì cho bạn?"
+
+# Dấu câu bị bỏ ở hai đầu mỗi từ ("chỉ?", "(71ITSE31003)")
+_WORD_STRIP = string.punctuation + "…“”‘’–—"
+
+GREETING = "greeting"
+KEYWORD = "keyword"
+SECTION = "section"
+SUBJECT = "subject"
+MON = "mon"
+
+
+class AhoCorasick:
+    """Automaton Aho–Corasick: tìm mọi mẫu xuất hiện trong một dãy ký hiệu (ký tự hoặc từ) trong một lượt quét"""
+
+    def __init__(self, patterns: Iterable[Tuple[Sequence, object]]):
+        self._goto = [{}]
+        self._fail = [0]
+        # Mỗi trạng thái: [(độ dài mẫu, payload)], gồm cả output của các trạng thái fail
+        self._output = [[]]
+        for word, payload in patterns:
+            if word:
+                self._insert(word, payload)
+        self._build()
+
+    def _insert(self, word: Sequence, payload):
+        state = 0
+        for char in word:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(word), payload))
+
+    def _build(self):
+        # Các trạng thái con của gốc giữ fail = 0; duyệt BFS từ chúng
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter(self, text: Sequence):
+        """Sinh (vị trí bắt đầu, vị trí kết thúc, payload) cho mọi lần xuất hiện"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, payload in output[state]:
+                yield end - length, end, payload
+
+
+@dataclass
+class IntentMatch:
+    """Kết quả nhận diện một câu hỏi (dùng chung qua cache, không sửa tại chỗ)"""
+    greeting: bool = False
+    # Câu chỉ gồm đúng một từ khóa ("giáo trình"): câu hỏi nối tiếp, không chứa tên môn
+    keyword_only: bool = False
+    keywords: List[str] = field(default_factory=list)
+    # (khóa mục, từ khóa) theo thứ tự xuất hiện
+    sections: List[Tuple[str, str]] = field(default_factory=list)
+    subjects: List[str] = field(default_factory=list)
+    codes: List[str] = field(default_factory=list)
+    mentions_mon: bool = False
+
+    @property
+    def section(self) -> Optional[str]:
+        """Mục đề cương được hỏi (ưu tiên từ khóa dài nhất), như detect_section"""
+        best_key, best_len = None, 0
+        for key, kw in self.sections:
+            if len(kw) > best_len:
+                best_key, best_len = key, len(kw)
+        return best_key
+
+    @property
+    def subject_switch(self) -> bool:
+        """Câu hỏi có mã môn hoặc từ 'môn', tức có thể đang nêu một môn học mới"""
+        return bool(self.codes) or self.mentions_mon
+
+
+@lru_cache(maxsize=8192)
+def _fold_word(word: str) -> str:
+    # Câu hỏi lặp lại cùng một vốn từ nhỏ, bỏ dấu từng từ một lần rồi dùng lại
+    return fold_accents(word)
+
+
+def tokenize(text: str) -> tuple:
+    """Dãy từ của văn bản đã bỏ dấu, bỏ dấu câu"""
+    words = []
+    for word in (text or "").lower().split():
+        word = word.strip(_WORD_STRIP)
+        if word:
+            words.append(_fold_word(word))
+    return tuple(words)
+
+
+class IntentMatcher:
+    def __init__(self, greetings_path: str = GREETINGS_PATH, electives_path: str = ELECTIVES_PATH):
+        self.paths = (greetings_path, electives_path)
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._checked_at = 0.0
+        self._automaton = AhoCorasick([])
+        self._cache = OrderedDict()
+        self.greeting_messages = []
+        self.reloads = 0
+        self._refresh(force=True)
+
+    def _load_patterns(self):
+        greetings_path, electives_path = self.paths
+        greeting_keywords, greeting_messages = [], []
+        try:
+            with open(greetings_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            greeting_keywords = data.get("greeting_keywords", [])
+            greeting_messages = data.get("greeting_messages", [])
+        except Exception as e:
+            logging.error(f"Error loading greetings: {str(e)}")
+
+        patterns = [(kw, (GREETING, kw)) for kw in greeting_keywords]
+        patterns += [(kw, (KEYWORD, kw)) for kw in SPECIAL_KEYWORDS]
+        patterns += [(kw, (SECTION, (key, kw))) for key, _, _, keywords in SYLLABUS_SECTIONS for kw in keywords]
+        patterns += [(s, (SUBJECT, s.capitalize())) for s in SPECIAL_SUBJECTS]
+        # Tên đầy đủ các môn tự chọn ("Leo núi thể thao") ngoài các tên viết tắt ở trên
+        patterns += [(fact["name"], (SUBJECT, fact["name"])) for fact in extract_elective_facts(electives_path)]
+        patterns.append(("môn", (MON, None)))
+        return [(tokenize(word), payload) for word, payload in patterns], greeting_messages
+
+    def _current_mtimes(self):
+        mtimes = []
+        for path in self.paths:
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < INTENTS_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        mtimes = self._current_mtimes()
+        if not force and mtimes == self._mtimes:
+            return
+        with self._lock:
+            if not force and mtimes == self._mtimes:
+                return
+            patterns, greeting_messages = self._load_patterns()
+            self._automaton = AhoCorasick(patterns)
+            self._cache = OrderedDict()
+            self.greeting_messages = greeting_messages
+            self._mtimes = mtimes
+            self.reloads += 1
+
+    def match(self, text: str) -> IntentMatch:
+        self._refresh()
+        cache = self._cache
+        result = cache.get(text)
+        if result is not None:
+            cache.move_to_end(text)
+            return result
+        result = self._scan(text)
+        cache[text] = result
+        if len(cache) > INTENTS_CACHE_SIZE:
+            cache.popitem(last=False)
+        return result
+
+    def _scan(self, text: str) -> IntentMatch:
+        result = IntentMatch()
+        words = tokenize(text)
+        if not words:
+            return result
+        code = SUBJECT_CODE_PATTERN.search(text or "")
+        if code:
+            result.codes.append(code.group(0).lower())
+
+        subject_hits = []
+        for start, end, (kind, value) in self._automaton.iter(words):
+            # Mẫu phủ cả câu (bỏ qua dấu câu): "chào!", "giáo trình?"
+            whole = start == 0 and end == len(words)
+            if kind == GREETING:
+                result.greeting = result.greeting or whole
+            elif kind == KEYWORD:
+                result.keywords.append(value)
+                result.keyword_only = result.keyword_only or whole
+            elif kind == SECTION:
+                result.sections.append(value)
+            elif kind == SUBJECT:
+                subject_hits.append((-(end - start), start, value))
+            elif kind == MON:
+                result.mentions_mon = True
+        # Tên dài nhất trước ("Leo núi thể thao" thay vì "Leo núi"), cùng độ dài thì tên xuất hiện trước
+        for _, _, value in sorted(subject_hits):
+            if value not in result.subjects:
+                result.subjects.append(value)
+        return result
+
+    def get_greeting_message(self) -> str:
+        self._refresh()
+        return random.choice(self.greeting_messages) if self.greeting_messages else DEFAULT_GREETING
+
+
+intent_matcher = IntentMatcher()
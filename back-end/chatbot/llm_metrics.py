@@ -0,0 +1,103 @@
+"""
+Thống kê thời gian xử lý prompt do Ollama trả về cho mỗi lượt sinh.
+
+Ollama báo `prompt_eval_count` / `prompt_eval_duration` là số token prompt thực
+sự phải tính lại. Khi tiền tố system prompt được tái sử dụng từ KV-cache, hai số
+này giảm mạnh so với độ dài prompt, đó là cách kiểm chứng hiệu quả của việc giữ
+tiền tố prompt cố định.
+"""
+import logging
+import statistics
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Số lượt sinh gần nhất được giữ để tính thống kê
+LLM_METRICS_WINDOW = 500
+_NS_PER_MS = 1_000_000
+
+
+class LLMMetrics:
+    def __init__(self, window: int = LLM_METRICS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.total_generations = 0
+        # Lượt sinh bị huỷ vì client ngắt kết nối và phần tính toán ước tính đã tiết kiệm
+        self.cancelled_generations = 0
+        self.cancelled_while_queued = 0
+        self.tokens_saved = 0.0
+        self.seconds_saved = 0.0
+
+    def record(self, response_metadata: dict, prompt_chars: int = 0, model: str = None) -> dict:
+        """Ghi nhận metadata Ollama trả về ở chunk cuối cùng của stream"""
+        if not response_metadata or ("prompt_eval_count" not in response_metadata and "eval_count" not in response_metadata):
+            return {}
+        sample = {
+            "model": model or response_metadata.get("model"),
+            "prompt_chars": prompt_chars,
+            "prompt_eval_tokens": response_metadata.get("prompt_eval_count", 0) or 0,
+            "prompt_eval_ms": (response_metadata.get("prompt_eval_duration", 0) or 0) / _NS_PER_MS,
+            "eval_tokens": response_metadata.get("eval_count", 0) or 0,
+            "eval_ms": (response_metadata.get("eval_duration", 0) or 0) / _NS_PER_MS,
+            "load_ms": (response_metadata.get("load_duration", 0) or 0) / _NS_PER_MS,
+            "total_ms": (response_metadata.get("total_duration", 0) or 0) / _NS_PER_MS,
+        }
+        self.samples.append(sample)
+        self.total_generations += 1
+        logger.info(
+            f"LLM {sample['model']}: prompt_eval {sample['prompt_eval_tokens']} token / "
+            f"{sample['prompt_eval_ms']:.0f} ms (prompt {prompt_chars} ký tự), "
+            f"eval {sample['eval_tokens']} token / {sample['eval_ms']:.0f} ms"
+        )
+        return sample
+
+    def record_cancelled(self, tokens_generated: int = 0, queued: bool = False):
+        """Ghi nhận một lượt sinh bị huỷ; phần tiết kiệm ước tính theo số token trung bình một câu trả lời"""
+        self.cancelled_generations += 1
+        if queued:
+            self.cancelled_while_queued += 1
+        if not self.samples:
+            return
+        samples = list(self.samples)
+        avg_tokens = statistics.fmean(s["eval_tokens"] for s in samples)
+        eval_ms = sum(s["eval_ms"] for s in samples)
+        remaining = max(avg_tokens - tokens_generated, 0)
+        self.tokens_saved += remaining
+        if eval_ms:
+            self.seconds_saved += remaining / (sum(s["eval_tokens"] for s in samples) / (eval_ms / 1000))
+
+    def cancellation_summary(self) -> dict:
+        return {
+            "cancelled_generations": self.cancelled_generations,
+            "cancelled_while_queued": self.cancelled_while_queued,
+            "estimated_tokens_saved": round(self.tokens_saved),
+            "estimated_seconds_saved": round(self.seconds_saved, 1),
+        }
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"generations": self.total_generations, "window": 0, **self.cancellation_summary()}
+        samples = list(self.samples)
+
+        def avg(key):
+            return round(statistics.fmean(s[key] for s in samples), 1)
+
+        prompt_ms = sorted(s["prompt_eval_ms"] for s in samples)
+        eval_ms = sum(s["eval_ms"] for s in samples)
+        return {
+            "generations": self.total_generations,
+            "window": len(samples),
+            "avg_prompt_chars": avg("prompt_chars"),
+            "avg_prompt_eval_tokens": avg("prompt_eval_tokens"),
+            "avg_prompt_eval_ms": avg("prompt_eval_ms"),
+            "p50_prompt_eval_ms": round(prompt_ms[len(prompt_ms) // 2], 1),
+            "p95_prompt_eval_ms": round(prompt_ms[min(int(len(prompt_ms) * 0.95), len(prompt_ms) - 1)], 1),
+            "avg_eval_tokens": avg("eval_tokens"),
+            "eval_tokens_per_second": round(
+                sum(s["eval_tokens"] for s in samples) / (eval_ms / 1000), 1
+            ) if eval_ms else 0.0,
+            "avg_load_ms": avg("load_ms"),
+            **self.cancellation_summary(),
+        }
+
+
+llm_metrics = LLMMetrics()
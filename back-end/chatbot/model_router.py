@@ -0,0 +1,197 @@
+"""
+Chọn model và endpoint Ollama cho từng lượt sinh.
+
+Câu hỏi nối tiếp ngắn (ví dụ "giáo trình" được ghép tên môn từ lịch sử) hay câu
+hỏi về một mục đề cương với context nhỏ không cần model lớn và câu trả lời dài;
+yêu cầu tổng quan cả đề cương hoặc context lớn thì cần. Bộ định tuyến chọn route
+(model + giới hạn num_predict) theo ý định và kích thước context, rồi chọn
+endpoint ít tải nhất trong pool OLLAMA_ENDPOINTS. Thời gian của từng route được
+ghi lại để tinh chỉnh các ngưỡng.
+"""
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+# Model nhỏ cho câu hỏi ngắn; mặc định dùng chung model lớn (chỉ khác num_predict)
+OLLAMA_SMALL_MODEL = os.getenv("OLLAMA_SMALL_MODEL", OLLAMA_MODEL)
+# Giữ model (và KV-cache của system prompt) trong bộ nhớ giữa các request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Context đủ dài để system prompt + lịch sử + context không bị cắt (cắt sẽ làm mất tiền tố cache)
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+# Danh sách endpoint Ollama, phân tách bằng dấu phẩy. Số lượt sinh đồng thời của bộ
+# điều phối mặc định là GENERATION_SLOTS_PER_ENDPOINT x số endpoint (scheduler.py)
+OLLAMA_ENDPOINTS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("OLLAMA_ENDPOINTS", os.getenv("OLLAMA_HOST", "http://localhost:11434")).split(",")
+    if url.strip()
+]
+if OLLAMA_ENDPOINTS and "://" not in OLLAMA_ENDPOINTS[0]:
+    OLLAMA_ENDPOINTS = [f"http://{url}" for url in OLLAMA_ENDPOINTS]
+
+# Ngưỡng định tuyến
+ROUTER_SMALL_MAX_CONTEXT_CHARS = int(os.getenv("ROUTER_SMALL_MAX_CONTEXT_CHARS", "2500"))
+ROUTER_SMALL_NUM_PREDICT = int(os.getenv("ROUTER_SMALL_NUM_PREDICT", "256"))
+ROUTER_LARGE_NUM_PREDICT = int(os.getenv("ROUTER_LARGE_NUM_PREDICT", "1024"))
+
+# Câu hỏi cần trả lời dài, bao quát cả đề cương
+OVERVIEW_KEYWORDS = [
+    "tổng quan", "toàn bộ", "tất cả", "tóm tắt", "chi tiết", "đề cương", "so sánh", "liệt kê", "giải thích",
+]
+
+ROUTE_STATS_WINDOW = 200
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    model: str
+    num_predict: int
+
+
+SMALL_ROUTE = Route("small", OLLAMA_SMALL_MODEL, ROUTER_SMALL_NUM_PREDICT)
+LARGE_ROUTE = Route("large", OLLAMA_MODEL, ROUTER_LARGE_NUM_PREDICT)
+
+
+def choose_route(question: str, section: Optional[str], follow_up: bool, context_chars: int) -> Route:
+    """
+    Route nhỏ: câu hỏi nối tiếp hoặc hỏi một mục đề cương cụ thể, context nhỏ.
+    Route lớn: yêu cầu tổng quan/so sánh, câu hỏi tự do, hoặc context lớn.
+    """
+    question_lower = question.lower()
+    if any(kw in question_lower for kw in OVERVIEW_KEYWORDS):
+        return LARGE_ROUTE
+    if context_chars > ROUTER_SMALL_MAX_CONTEXT_CHARS:
+        return LARGE_ROUTE
+    if follow_up or section:
+        return SMALL_ROUTE
+    return LARGE_ROUTE
+
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        # Thời gian trung bình một lượt sinh, dùng để phân xử khi số lượt đang chạy bằng nhau
+        self.avg_seconds = 0.0
+
+
+class ModelRouter:
+    def __init__(self, endpoints=None):
+        self.endpoints = [Endpoint(url) for url in (endpoints or OLLAMA_ENDPOINTS)]
+        self._lock = threading.Lock()
+        self._llms = {}
+        self._latency = {}
+
+    def acquire(self) -> Endpoint:
+        """Endpoint đang chạy ít lượt sinh nhất (ưu tiên endpoint nhanh hơn khi bằng nhau)"""
+        with self._lock:
+            endpoint = min(self.endpoints, key=lambda e: (e.in_flight, e.avg_seconds))
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, route: Route, seconds: float, ttft: Optional[float], outcome: str = "ok"):
+        """outcome: ok | failed | cancelled (client ngắt kết nối, không tính là lỗi)"""
+        with self._lock:
+            endpoint.in_flight -= 1
+            if outcome == "ok":
+                endpoint.completed += 1
+                endpoint.avg_seconds = seconds if not endpoint.avg_seconds else 0.8 * endpoint.avg_seconds + 0.2 * seconds
+                samples = self._latency.setdefault(route.name, deque(maxlen=ROUTE_STATS_WINDOW))
+                samples.append((seconds, ttft))
+            elif outcome == "failed":
+                endpoint.failed += 1
+
+    def get_llm(self, route: Route, endpoint: Endpoint):
+        """ChatOllama cho (endpoint, route), tạo ở lần dùng đầu tiên"""
+        key = (endpoint.url, route)
+        llm = self._llms.get(key)
+        if llm is None:
+            from langchain_ollama import ChatOllama
+            llm = ChatOllama(
+                model=route.model,
+                base_url=endpoint.url,
+                temperature=0.01,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+                num_ctx=OLLAMA_NUM_CTX,
+                num_predict=route.num_predict,
+                client_kwargs={"timeout": 30}
+            )
+            self._llms[key] = llm
+        return llm
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {}
+            for name, samples in self._latency.items():
+                durations = sorted(s for s, _ in samples)
+                ttfts = sorted(t for _, t in samples if t is not None)
+                routes[name] = {
+                    "window": len(durations),
+                    "avg_seconds": round(statistics.fmean(durations), 2),
+                    "p95_seconds": round(durations[min(int(len(durations) * 0.95), len(durations) - 1)], 2),
+                    "avg_ttft_seconds": round(statistics.fmean(ttfts), 2) if ttfts else None,
+                }
+            return {
+                "routes": {
+                    route.name: {"model": route.model, "num_predict": route.num_predict, **routes.get(route.name, {})}
+                    for route in (SMALL_ROUTE, LARGE_ROUTE)
+                },
+                "endpoints": [
+                    {
+                        "url": e.url,
+                        "in_flight": e.in_flight,
+                        "completed": e.completed,
+                        "failed": e.failed,
+                        "avg_seconds": round(e.avg_seconds, 2),
+                    }
+                    for e in self.endpoints
+                ],
+                "thresholds": {"small_max_context_chars": ROUTER_SMALL_MAX_CONTEXT_CHARS},
+            }
+
+
+model_router = ModelRouter()
+
+
+class RoutedGeneration:
+    """Giữ endpoint trong suốt một lượt sinh và ghi thời gian vào thống kê route"""
+
+    def __init__(self, route: Route, router: ModelRouter = model_router):
+        self.route = route
+        self.router = router
+        self.endpoint = None
+        self.started = None
+        self.ttft = None
+
+    def __enter__(self):
+        self.endpoint = self.router.acquire()
+        self.started = time.perf_counter()
+        return self
+
+    @property
+    def llm(self):
+        return self.router.get_llm(self.route, self.endpoint)
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, Exception):
+            outcome = "failed"
+        else:
+            outcome = "cancelled"
+        self.router.release(self.endpoint, self.route, time.perf_counter() - self.started, self.ttft, outcome)
+        return False
@@ -1,41 +1,42 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Body
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Body, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 import logging
-from firebase_admin import auth, firestore
 from datetime import datetime
-import os
-from ingest import create_embeddings, load_documents, split_documents, create_vectorstore
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import io
-from pypdf import PdfReader
-from unstructured.partition.auto import partition
-import json
 import asyncio
-from langchain_ollama import OllamaLLM
-from database import save_chat, get_chat_history, archive_chat, unarchive_chat, get_archived_chats
-from phantich import collect_user_questions, analyze_user_questions, visualize_top_questions
-from langchain.prompts import PromptTemplate
+import time
+from dedup import collapse_duplicates, get_shared_sources
+from syllabus_sections import fetch_section_chunks
+from index_store import get_index_manager
+from course_facts import answer_fact, course_fact_table, detect_fact_intents, fact_stats, record_fact_lookup
+from .scheduler import GenerationRejected, generation_scheduler
+from .intents import IntentMatch, intent_matcher
+from .sse import ClientConnection, coalesce_text, split_text, sse_event
+from .singleflight import flight_key, single_flight
+from .llm_metrics import llm_metrics
+from .tracing import CHATBOT_DEBUG_TIMING, RequestTrace
+from .model_router import RoutedGeneration, choose_route, model_router
+from .fallback import LLM_FALLBACK_ENABLED, LLM_TTFT_SLO_SECONDS, build_extractive_answer, fallback_stats, record_fallback
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from database import save_chat, load_session_history, archive_chat, unarchive_chat, get_archived_chats, user_ref_cache
+from database import enqueue_chat, chat_write_queue, session_cache
+from database.session_cache import SESSION_CACHE_ENABLED, VERIFY_VERSION
+from database.pagination import clamp_page_size
 from fastapi.responses import StreamingResponse
-import random
-from collections import Counter
-import matplotlib.pyplot as plt
 import re
 
 router = APIRouter()
 security = HTTPBearer()
 
 # Constants
-CHROMA_DB_DIRECTORY = "./chroma_db"
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
 
-# Prompt template
-SYLLABUS_PROMPT = """
+# System prompt cố định, luôn đứng đầu request để Ollama tái sử dụng KV-cache của tiền tố này.
+# Không đưa nội dung thay đổi theo request (lịch sử, context, thời gian...) vào đây.
+SYSTEM_PROMPT = """
 Hướng dẫn sử dụng Syllasbus-Bot
 
 
@@ -94,207 +95,370 @@ Cấu trúc thông tin môn học cần cung cấp (nếu có):
 Hướng dẫn kết thúc câu trả lời:
 Sau khi trả lời xong, luôn kết thúc bằng câu: "Bạn có muốn biết thêm thông tin về mục tiêu, nội dung, tài liệu tham khảo, phương thức đánh giá, nhiệm vụ sinh viên, số tín chỉ môn học hoặc các vấn đề khác liên quan đến môn học này hoặc các môn học khác tại Khoa Công nghệ Thông Tin trường đại học Văn Lang không? Hãy nói cho tôi biết nhé!"
 
-Lịch sử hội thoại:
-{chat_history}
+Lịch sử hội thoại được cung cấp dưới dạng các tin nhắn trước câu hỏi mới nhất."""
 
-Thông tin từ tài liệu syllabus:
+# Tin nhắn cuối cùng của request: context truy xuất + câu hỏi (phần thay đổi nhiều nhất)
+USER_PROMPT_TEMPLATE = """Thông tin từ tài liệu syllabus:
 {context}
 
 Câu hỏi mới nhất của người dùng: {question}
 
 Trả lời:"""
 
-# Các từ khóa đặc biệt để nhận diện câu hỏi ngắn gọn về thông tin môn học
-SPECIAL_KEYWORDS = [
-    "mục tiêu", "nội dung", "tài liệu tham khảo", "phương thức đánh giá", "số tín chỉ",
-    "giáo trình", "chuẩn đầu ra", "nhiệm vụ sinh viên", "rubric", "đánh giá", "cho điểm",
-    "thông tin về học phần", "mô tả", "phương pháp giảng dạy", "nội dung chi tiết",
-    "yêu cầu", "biên soạn", "phụ lục", "rubric đánh giá"
-]
-
 def get_vectorstore():
-    """Get or create vectorstore instance"""
-    embeddings = create_embeddings()
-    if os.path.exists(CHROMA_DB_DIRECTORY):
-        return Chroma(
-            persist_directory=CHROMA_DB_DIRECTORY,
-            embedding_function=embeddings
-        )
-    else:
-        raise Exception("Chroma database directory not found")
-
-# Initialize LLM
-llm = OllamaLLM(model="llama3.2", timeout=30, temperature=0.01)
-
-# Initialize vectorstore
-try:
-    vectorstore = get_vectorstore()
-except Exception as e:
-    logging.error(f"Error initializing vectorstore: {str(e)}")
-    vectorstore = None
-
-# Load greetings
-def load_greetings():
-    """Load greeting keywords and messages from JSON file"""
-    try:
-        with open("data/greetings.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data.get("greeting_keywords", []), data.get("greeting_messages", [])
-    except Exception as e:
-        logging.error(f"Error loading greetings: {str(e)}")
-        return [], []
+    """Vectorstore của phiên bản index hiện tại (tự đổi khi ingest xong phiên bản mới)"""
+    return get_index_manager().get()
 
-greeting_keywords, greeting_messages = load_greetings()
-
-# Load danh sách môn tự chọn
-try:
-    with open("data/mon_tu_chon.json", "r", encoding="utf-8") as f:
-        mon_tu_chon_data = json.load(f)
-        # Lấy danh sách môn tự chọn từ greeting_messages hoặc tạo trường riêng nếu cần
-        mon_tu_chon_list = mon_tu_chon_data.get("greeting_messages", [])
-except Exception as e:
-    logging.error(f"Error loading mon_tu_chon: {str(e)}")
-    mon_tu_chon_list = []
+# Vectorstore được load trong lifespan của main.py (hoặc ở request đầu tiên)
+index_manager = get_index_manager()
 
 def is_greeting(message: str) -> bool:
     """Check if message is a greeting"""
-    return message.lower().strip() in greeting_keywords
+    return intent_matcher.match(message).greeting
 
 def get_greeting_response() -> str:
     """Get random greeting message"""
-    return random.choice(greeting_messages) if greeting_messages else "Xin chào! Tôi là Syllasbus-Bot. Tôi có thể giúp gì cho bạn?"
+    return intent_matcher.get_greeting_message()
 
 async def stream_greeting(greeting: str):
-    """Stream greeting message with natural typing effect"""
-    words = greeting.split()
-    for word in words:
-        # Type each word with faster speed
-        for char in word:
-            yield f"data: {json.dumps({'type': 'chunk', 'text': char})}\n\n"
-            await asyncio.sleep(0.001)  # Reduced from 0.005 to 0.001
-        # Add space after word
-        yield f"data: {json.dumps({'type': 'chunk', 'text': ' '})}\n\n"
-        # Shorter pause between words
-        await asyncio.sleep(0.002)  # Reduced from 0.01 to 0.002
-    yield f"data: {json.dumps({'type': 'complete'})}\n\n"
+    """Stream greeting message theo các khối lớn, không giả lập gõ từng ký tự"""
+    for text in split_text(greeting):
+        yield sse_event('chunk', text=text)
+    yield sse_event('complete')
+
+async def iter_llm_text(stream, response_metadata: dict = None, progress: dict = None):
+    """Lấy phần text từ các chunk của llm.astream, gom metadata Ollama trả về ở chunk cuối"""
+    async for chunk in stream:
+        if progress is not None:
+            # Mỗi chunk của Ollama tương ứng khoảng một token
+            progress["chunks"] = progress.get("chunks", 0) + 1
+        if isinstance(chunk, str):
+            yield chunk
+        elif isinstance(chunk, dict) and 'text' in chunk:
+            yield chunk['text']
+        else:
+            if response_metadata is not None and getattr(chunk, 'response_metadata', None):
+                response_metadata.update(chunk.response_metadata)
+            if chunk.content:
+                yield chunk.content
+
+# Regex nhận diện tên môn học sau từ 'môn'
+SUBJECT_NAME_PATTERN = re.compile(r"môn ([\w\sÀ-ỹ\-]+)", re.IGNORECASE)
+
+def extract_subject(content: str, match: IntentMatch = None):
+    """Trích xuất tên hoặc mã môn học từ một câu hỏi (match: kết quả intent_matcher nếu đã có)"""
+    content = content.strip().lower()
+    if match is None:
+        match = intent_matcher.match(content)
+    # Nếu content chỉ là từ khóa ngắn thì bỏ qua
+    if match.keyword_only:
+        return None
+    # Ưu tiên tìm mã môn học (ví dụ: 71ITSE31003)
+    if match.codes:
+        return match.codes[0]
+    # Tìm tên môn học sau từ 'môn'
+    name_match = SUBJECT_NAME_PATTERN.search(content) if match.mentions_mon else None
+    if name_match:
+        subject = name_match.group(1).strip()
+        # Từ khóa nằm trong phần sau 'môn' ("môn này giáo trình") thì không phải tên môn;
+        # chỉ cần xét các từ khóa đã tìm thấy trong câu
+        if subject and not any(kw in subject for kw in match.keywords):
+            subject = subject.split(".")[0].strip()
+            return subject
+    # Các môn đặc biệt (không cần từ 'môn'), kể cả khi message chỉ là tên môn
+    if match.subjects:
+        return match.subjects[0]
+    return None
 
 def extract_last_subject(chat_history):
     """Trích xuất tên hoặc mã môn học gần nhất từ lịch sử hội thoại, ưu tiên message gần nhất của user."""
     if not chat_history:
         return None
-    # Danh sách các môn đặc biệt
-    special_subjects = [
-        "cờ vua", "bóng rổ", "bóng bàn", "bóng chuyền", "bơi lội", "cầu lông", "võ thuật", "golf", "tennis", "futsal", "leo núi", "khiêu vũ", "fitness", "hatha yoga"
-    ]
-    # Regex nhận diện mã môn học (ví dụ: 71ITSE31003)
-    subject_code_pattern = re.compile(r"\b\d{2}[A-Z]{2,}[A-Z0-9]*\d{3,}\b", re.IGNORECASE)
-    # Regex nhận diện tên môn học sau từ 'môn'
-    subject_name_pattern = re.compile(r"môn ([\w\sÀ-ỹ\-]+)", re.IGNORECASE)
-
     # Duyệt từ message gần nhất của user
     for chat_turn in reversed(chat_history):
         for msg in reversed(chat_turn.get('messages', [])):
             if msg.get('role') != 'user':
                 continue
-            content = msg.get('content', '').strip().lower()
-            # Nếu content chỉ là từ khóa ngắn thì bỏ qua
-            if content in SPECIAL_KEYWORDS:
+            subject = extract_subject(msg.get('content', ''))
+            if subject:
+                return subject
+    return None
+
+def is_subject_switch(question, match: IntentMatch = None):
+    """Kiểm tra xem câu hỏi có nhắc đến môn học mới không (mã môn học hoặc từ 'môn')"""
+    return (match or intent_matcher.match(question)).subject_switch
+
+def names_other_subject(question: str, match: IntentMatch = None) -> bool:
+    """Câu hỏi có nêu một môn học cụ thể (không phải "môn này", "môn đó")"""
+    subject = extract_subject(question, match)
+    return bool(subject) and not re.match(r"(học\s+)?(này|đó|ấy|kia)\b", subject)
+
+def last_course_in_history(chat_history):
+    """Môn học (trong bảng thông tin môn học) được user nhắc gần nhất trong lịch sử"""
+    for chat_turn in reversed(chat_history or []):
+        for msg in reversed(chat_turn.get('messages', [])):
+            if msg.get('role') != 'user':
                 continue
-            # Ưu tiên tìm mã môn học
-            code_match = subject_code_pattern.search(content)
-            if code_match:
-                return code_match.group(0)
-            # Tìm tên môn học sau từ 'môn'
-            name_match = subject_name_pattern.search(content)
-            if name_match:
-                subject = name_match.group(1).strip()
-                if subject and not any(kw in subject.lower() for kw in SPECIAL_KEYWORDS):
-                    subject = subject.split(".")[0].strip()
-                    return subject
-            # Tìm các môn đặc biệt (không cần từ 'môn')
-            for s in special_subjects:
-                if s in content:
-                    return s.capitalize()
-            # Nếu message chỉ là tên môn học (ví dụ: "bóng rổ", "cờ vua")
-            for s in special_subjects:
-                if content == s:
-                    return s.capitalize()
+            content = msg.get('content', '')
+            course = course_fact_table.match_course(content)
+            if course:
+                return course
+            if extract_subject(content):
+                # Môn gần nhất không có trong bảng: không trả lời theo một môn cũ hơn
+                return None
     return None
 
-def is_subject_switch(question):
-    """Kiểm tra xem câu hỏi có nhắc đến môn học mới không"""
-    # Regex nhận diện mã môn học hoặc từ 'môn'
-    if re.search(r"\b\d{2}[A-Z]{2,}[A-Z0-9]*\d{3,}\b", question, re.IGNORECASE):
-        return True
-    if "môn" in question.lower():
-        return True
-    return False
+async def load_chat_history(email: str = None, limit: int = 5, trace: RequestTrace = None) -> list:
+    """Lấy lịch sử hội thoại (session cache, miss thì đọc Firestore trong executor); lỗi Firestore chỉ làm mất ngữ cảnh hội thoại"""
+    if not email:
+        return []
+    started = time.perf_counter()
+    try:
+        if SESSION_CACHE_ENABLED and not VERIFY_VERSION:
+            # Chế độ sticky: cache hit không cần Firestore lẫn executor
+            cached = session_cache.get(email, limit)
+            if cached is not None:
+                return cached
+        return await asyncio.get_event_loop().run_in_executor(None, load_session_history, email, limit)
+    except Exception as e:
+        logging.error(f"Error retrieving chat history for {email}: {str(e)}")
+        return []
+    finally:
+        if trace is not None:
+            trace.record("history", time.perf_counter() - started)
+
+async def persist_chat(email: str, question: str, answer: str, sources: list):
+    """Đưa lượt hỏi-đáp vào hàng đợi write-behind; hàng đợi tắt hoặc đầy thì ghi trực tiếp trong executor"""
+    if enqueue_chat(email, question, answer, sources):
+        return
+    await asyncio.get_event_loop().run_in_executor(None, save_chat, email, question, answer, sources)
 
 # Xử lý câu hỏi
-async def stream_answer(question: str, email: str = None, chat_history: list = None):
-    """Stream answer to user question"""
+async def stream_answer(question: str, email: str = None, chat_history: list = None, debug: bool = False, request: Request = None):
+    """Stream answer to user question
+
+    Các bước chạy theo đồ thị phụ thuộc thay vì tuần tự: lịch sử hội thoại
+    (Firestore) và retrieval được khởi động cùng lúc; chỉ truy xuất lại khi lịch
+    sử làm thay đổi môn học/câu hỏi dùng để tìm context.
+
+    Client ngắt kết nối giữa chừng thì rời lượt sinh (lượt sinh bị huỷ nếu không
+    còn ai theo dõi) và không lưu câu trả lời dở dang: một câu trả lời cụt trong
+    lịch sử sẽ bị đưa lại vào prompt của các lượt hỏi sau.
+    """
+    trace = RequestTrace(email, question)
+    connection = ClientConnection(request).start()
+    history_task = None
+    context_task = None
+    vectorstore = None
     try:
+        # Lời chào, từ khóa mục đề cương, tên/mã môn học: nhận diện trong một lượt quét
+        intents = intent_matcher.match(question)
+
         # Kiểm tra chào hỏi
-        if is_greeting(question):
+        if intents.greeting:
             greeting = get_greeting_response()
-            full_answer = ""
-            async for chunk in stream_greeting(greeting):
-                if isinstance(chunk, str):
-                    full_answer += chunk
-                yield chunk
+            full_answer = greeting
+            async for frame in stream_greeting(greeting):
+                yield frame
             if email:
-                await asyncio.get_event_loop().run_in_executor(None, save_chat, email, question, full_answer, [])
+                with trace.span("save_chat"):
+                    await persist_chat(email, question, full_answer, [])
+            trace.tag(kind="greeting")
             return
 
-        # --- Xử lý câu hỏi ngắn gọn về thông tin môn học ---
-        question_lower = question.lower().strip()
-        if any(kw in question_lower for kw in SPECIAL_KEYWORDS):
-            # Nếu câu hỏi hiện tại chưa chứa tên/mã môn học
-            if not is_subject_switch(question):
-                subject = extract_last_subject(chat_history)
-                if subject:
-                    # Thêm tên môn học vào câu hỏi cho rõ ngữ cảnh
-                    question = f"{question} của môn {subject}"
-                else:
-                    # Không tìm được môn học, hỏi lại người dùng
-                    yield f"data: {json.dumps({'type': 'chunk', 'text': 'Bạn muốn hỏi về môn học nào? Vui lòng cung cấp tên hoặc mã môn học để mình hỗ trợ chính xác nhé.'})}\n\n"
-                    yield f"data: {json.dumps({'type': 'complete'})}\n\n"
-                    return
+        # Lịch sử hội thoại được tải song song với retrieval
+        if chat_history is None:
+            history_task = asyncio.create_task(load_chat_history(email, trace=trace))
+
+        # Câu hỏi về thông tin cấu trúc của một môn (số tín chỉ, mã môn, bắt buộc/tự chọn...):
+        # trả lời thẳng từ bảng thông tin môn học, không cần retrieval và LLM
+        fact_intents = detect_fact_intents(question)
+        if fact_intents:
+            with trace.span("fact_lookup"):
+                course = course_fact_table.match_course(question)
+            if course is None and history_task is not None and not names_other_subject(question, intents):
+                # Câu hỏi nối tiếp ("số tín chỉ"): môn học lấy từ lịch sử
+                chat_history = await history_task
+                course = last_course_in_history(chat_history)
+            fact_answer = answer_fact(fact_intents, course)
+            record_fact_lookup(fact_intents, fact_answer is not None)
+            if fact_answer:
+                trace.tag(kind="fact", fact=",".join(fact_intents))
+                trace.mark("ttft")
+                for text in split_text(fact_answer):
+                    yield sse_event('chunk', text=text)
+                yield sse_event('complete')
+                source_docs = [{
+                    "content": fact_answer,
+                    "source": course.get('source', ''),
+                    "type": "course_facts",
+                    "name": course.get('name') or course.get('code', ''),
+                }]
+                yield sse_event('sources', sources=source_docs)
+                if email:
+                    with trace.span("save_chat"):
+                        await persist_chat(email, question, fact_answer, source_docs)
+                breakdown = trace.finish()
+                if debug and CHATBOT_DEBUG_TIMING:
+                    yield sse_event('timing', stages_ms=breakdown, tags=trace.tags)
+                return
 
         # --- RAG Process ---
-        # Ensure vectorstore is loaded before proceeding
+        # Giữ phiên bản index cho cả request: nếu index được đổi giữa chừng,
+        # request này vẫn dùng phiên bản cũ đến khi stream xong (trả trong finally)
+        vectorstore = index_manager.acquire_or_none()
         if vectorstore is None:
-            yield f"data: {json.dumps({'type': 'error', 'message': 'Vectorstore chưa sẵn sàng. Vui lòng chạy ingest.py trước.'})}\n\n"
-            yield f"data: {json.dumps({'type': 'complete'})}\n\n"
+            yield sse_event('error', message='Vectorstore chưa sẵn sàng. Vui lòng chạy ingest.py trước.')
+            yield sse_event('complete')
             return
 
-        # Lấy context và trả lời đồng thời
-        context_task = asyncio.create_task(get_context_async(question))
-        
-        # Format chat history for prompt
-        history_text = format_chat_history(chat_history)
-        
+        # --- Xử lý câu hỏi ngắn gọn về thông tin môn học ---
+        subject = None
+        section = None
+        needs_history_subject = False
+        if intents.keywords:
+            section = intents.section
+            if intents.subject_switch:
+                subject = extract_subject(question, intents)
+            else:
+                # Câu hỏi hiện tại chưa chứa tên/mã môn học, phải dựa vào lịch sử
+                needs_history_subject = True
+
+        # Retrieval suy đoán trên câu hỏi gốc, không chờ lịch sử. Với câu hỏi nối
+        # tiếp thiếu tên môn, kết quả trên câu hỏi gốc không bao giờ được dùng
+        # (hoặc truy xuất lại theo môn trong lịch sử, hoặc hỏi lại người dùng)
+        # nên không tốn một lượt search cho nó.
+        if not needs_history_subject:
+            context_task = asyncio.create_task(get_context_async(question, section, subject, vectorstore, trace))
+
+        # Câu hỏi nêu rõ môn học có thể được gộp với câu hỏi giống hệt đang chạy
+        # (single-flight): chỉ khi đó mới bỏ lịch sử riêng của người hỏi (không
+        # chờ Firestore, không lộ hội thoại của người này sang người khác)
+        shared_subject = None
+        if not needs_history_subject and intents.subject_switch:
+            shared_subject = extract_subject(question, intents)
+
+        if history_task is not None and shared_subject is None:
+            chat_history = await history_task
+
+        if needs_history_subject:
+            subject = extract_last_subject(chat_history)
+            if not subject:
+                # Không tìm được môn học, hỏi lại người dùng
+                yield sse_event('chunk', text='Bạn muốn hỏi về môn học nào? Vui lòng cung cấp tên hoặc mã môn học để mình hỗ trợ chính xác nhé.')
+                yield sse_event('complete')
+                return
+            # Thêm tên môn học vào câu hỏi cho rõ ngữ cảnh
+            question = f"{question} của môn {subject}"
+            context_task = asyncio.create_task(get_context_async(question, section, subject, vectorstore, trace))
+
         # Đợi context
         context = await context_task
         context_text = "\n".join([doc.page_content.strip() for doc in context])
-        
+
+        # Câu hỏi giống hệt đang được sinh: theo dõi lượt sinh đó thay vì chạy lượt mới
+        key = flight_key(question, shared_subject, context) if shared_subject else None
+        flight = single_flight.join(key)
+        joined = flight is not None
+        if flight is None and shared_subject is not None and history_task is not None:
+            chat_history = await history_task
+
+        # Lịch sử hội thoại dạng tin nhắn, đặt sau system prompt cố định
+        history_messages = [] if flight is not None else build_history_messages(chat_history)
+        if history_messages:
+            # Prompt có hội thoại riêng của người hỏi: chạy flight riêng, không chia sẻ
+            key = None
+
         # Trả lời
         full_answer = ""
-        prompt_with_history = SYLLABUS_PROMPT.format(
-            context=context_text,
-            question=question,
-            chat_history=history_text
-        )
-        
-        async for chunk in llm.astream(prompt_with_history):
-            if isinstance(chunk, str):
-                full_answer += chunk
-                yield f"data: {json.dumps({'type': 'chunk', 'text': chunk})}\n\n"
-            elif isinstance(chunk, dict) and 'text' in chunk:
-                full_answer += chunk['text']
-                yield f"data: {json.dumps({'type': 'chunk', 'text': chunk['text']})}\n\n"
-
-        yield f"data: {json.dumps({'type': 'complete'})}\n\n"
+        messages = [
+            SystemMessage(content=SYSTEM_PROMPT),
+            *history_messages,
+            HumanMessage(content=USER_PROMPT_TEMPLATE.format(context=context_text, question=question))
+        ]
+        prompt_chars = sum(len(m.content) for m in messages)
+        # Model và giới hạn độ dài trả lời theo ý định câu hỏi và kích thước context
+        route = choose_route(question, section, needs_history_subject, len(context_text))
+        trace.tag(route=route.name)
+
+        ticket = None
+        fallback_reason = None
+        trace.tag(coalesced=flight is not None)
+        if flight is None:
+            if connection.disconnected:
+                trace.tag(disconnected=True)
+                return
+            # Xin lượt sinh từ bộ điều phối, báo vị trí hàng đợi trong lúc chờ
+            try:
+                ticket = generation_scheduler.submit(email)
+            except GenerationRejected as e:
+                # Quá tải thì trả lời trích xuất; giới hạn theo người dùng vẫn từ chối như cũ
+                if e.reason != 'overload' or not LLM_FALLBACK_ENABLED:
+                    yield sse_event('error', message=e.message, reason=e.reason)
+                    yield sse_event('complete')
+                    return
+                fallback_reason = 'overload'
+            else:
+                flight = single_flight.start(key, lambda f: run_generation(f, ticket, messages, prompt_chars, route))
+                # Trả chỗ cả khi task bị huỷ trước khi kịp chạy
+                flight.task.add_done_callback(lambda _: ticket.release(False))
+
+        if flight is not None:
+            generation_started = None
+            # Hạn chót cho token đầu tiên (SLO), tính từ lúc nhận request
+            ttft_deadline = trace.started + LLM_TTFT_SLO_SECONDS
+            subscription = flight.subscribe(connection, reserved=joined)
+            try:
+                while True:
+                    if generation_started is None and LLM_FALLBACK_ENABLED:
+                        next_event = asyncio.wait_for(
+                            subscription.__anext__(), max(ttft_deadline - time.perf_counter(), 0)
+                        )
+                    else:
+                        next_event = subscription.__anext__()
+                    try:
+                        event_type, fields = await next_event
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        # Rời flight (huỷ lượt sinh nếu không còn ai chờ) và trả lời trích xuất
+                        fallback_reason = 'slo'
+                        break
+                    except Exception as e:
+                        if full_answer or not LLM_FALLBACK_ENABLED:
+                            raise
+                        logging.error(f"LLM generation failed, using extractive answer: {str(e)}")
+                        fallback_reason = 'llm_error'
+                        break
+                    if event_type == 'chunk':
+                        if generation_started is None:
+                            trace.mark("ttft")
+                            generation_started = time.perf_counter()
+                        full_answer += fields['text']
+                    yield sse_event(event_type, **fields)
+            finally:
+                # Rời flight ngay cả khi Starlette đóng generator này do ghi frame thất bại
+                await subscription.aclose()
+            if generation_started is not None:
+                trace.record("generation", time.perf_counter() - generation_started)
+            if ticket is not None and ticket.started_at is not None:
+                trace.record("queue", ticket.started_at - ticket.enqueued_at)
+
+        if fallback_reason and not connection.disconnected:
+            # Chế độ suy giảm: trích dẫn trực tiếp các chunk đã truy xuất
+            record_fallback(fallback_reason)
+            trace.tag(fallback=fallback_reason)
+            trace.mark("ttft")
+            full_answer = build_extractive_answer(question, context, fallback_reason)
+            for text in split_text(full_answer):
+                yield sse_event('chunk', text=text)
+
+        if connection.disconnected:
+            # Không lưu câu trả lời dở dang
+            trace.tag(disconnected=True, partial_chars=len(full_answer))
+            return
+
+        yield sse_event('complete')
         
         # Prepare sources with enhanced metadata
         source_docs = []
@@ -305,72 +469,145 @@ async def stream_answer(question: str, email: str = None, chat_history: list = N
                 "type": doc.metadata.get('type', 'unknown'),
                 "name": doc.metadata.get('name', ''),
                 "page": doc.metadata.get('page', ''),
+                "section": doc.metadata.get('section', ''),
                 "chunk_id": doc.metadata.get('chunk_id', ''),
+                "shared_sources": get_shared_sources(doc.metadata),
                 "similarity_score": getattr(doc, 'similarity_score', None)
             }
             source_docs.append(source_info)
             
-        yield f"data: {json.dumps({'type': 'sources', 'sources': source_docs})}\n\n"
+        yield sse_event('sources', sources=source_docs)
 
         if email:
-            await asyncio.get_event_loop().run_in_executor(None, save_chat, email, question, full_answer, source_docs)
+            with trace.span("save_chat"):
+                await persist_chat(email, question, full_answer, source_docs)
+
+        breakdown = trace.finish()
+        if debug and CHATBOT_DEBUG_TIMING:
+            yield sse_event('timing', stages_ms=breakdown, tags=trace.tags)
 
     except Exception as e:
         logging.error(f"Error: {str(e)}")
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-
-async def get_context_async(question: str):
-    """Get context asynchronously without prioritization/filtering, just return top k by similarity score"""
+        yield sse_event('error', message=str(e))
+    finally:
+        # Client ngắt kết nối hoặc trả lời sớm: không để task nền chạy mồ côi
+        for task in (history_task, context_task):
+            if task is not None and not task.done():
+                task.cancel()
+        if vectorstore is not None:
+            index_manager.release(vectorstore)
+        connection.stop()
+        trace.finish()
+
+async def run_generation(flight, ticket, messages: list, prompt_chars: int, route):
+    """Chờ lượt trong hàng đợi rồi sinh câu trả lời, phát sự kiện cho mọi client của flight.
+
+    Bị huỷ (mọi client của flight đã ngắt kết nối) thì đóng stream tới Ollama
+    ngay để nhường chỗ cho người đang xếp hàng.
+    """
+    completed = False
+    progress = {}
+    try:
+        async for position, expected_wait in ticket.wait():
+            flight.publish(
+                'loading',
+                message=f'Đang xếp hàng chờ trả lời (vị trí {position}, khoảng {expected_wait:.0f} giây)...',
+                queue_position=position,
+                expected_wait=expected_wait
+            )
+
+        # Gộp token thành frame theo cửa sổ thời gian/số byte; endpoint ít tải nhất cho model của route
+        response_metadata = {}
+        with RoutedGeneration(route) as generation:
+            async for text in coalesce_text(iter_llm_text(generation.llm.astream(messages), response_metadata, progress)):
+                generation.first_token()
+                flight.publish('chunk', text=text)
+        completed = True
+        llm_metrics.record(response_metadata, prompt_chars, route.model)
+    except asyncio.CancelledError:
+        llm_metrics.record_cancelled(progress.get("chunks", 0), queued=not ticket.granted)
+        logging.info(f"Generation cancelled after {progress.get('chunks', 0)} chunks (client disconnected)")
+        raise
+    finally:
+        ticket.release(completed)
+
+async def get_context_async(question: str, section: str = None, subject: str = None, vectorstore=None, trace: RequestTrace = None):
+    """Get context asynchronously, return top k by similarity score.
+
+    Khi đã biết mục đề cương và môn học, lấy thẳng các chunk của mục đó
+    (không cần similarity search); chỉ fallback khi không có chunk nào khớp.
+    """
     loop = asyncio.get_event_loop()
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    if section and subject:
+        started = time.perf_counter()
+        section_docs = await loop.run_in_executor(
+            None,
+            lambda: fetch_section_chunks(vectorstore, section, subject)
+        )
+        if trace is not None:
+            trace.record("section_lookup", time.perf_counter() - started)
+        if section_docs:
+            return section_docs
+
+    # Lấy dư kết quả để sau khi gộp các đoạn boilerplate trùng vẫn còn đủ 8 đoạn
+    # Tách embedding câu hỏi và search Chroma để đo riêng từng bước
+    # (tương đương similarity_search_with_score)
+    started = time.perf_counter()
+    query_embedding = await loop.run_in_executor(
+        None,
+        lambda: vectorstore.embeddings.embed_query(question.lower().strip())
+    )
+    embedded = time.perf_counter()
     results = await loop.run_in_executor(
         None,
-        lambda: vectorstore.similarity_search_with_score(question.lower().strip(), k=8)
+        lambda: vectorstore.similarity_search_by_vector_with_relevance_scores(query_embedding, k=16)
     )
+    if trace is not None:
+        trace.record("embedding", embedded - started)
+        trace.record("search", time.perf_counter() - embedded)
     # Only return docs with score > 0.7, sorted by score descending
     filtered_results = [doc for doc, score in results if score > 0.7]
-    return filtered_results[:8]
+    return collapse_duplicates(filtered_results)[:8]
 
-def format_chat_history(chat_history: list) -> str:
-    """Format chat history for prompt"""
-    if not chat_history:
-        return "Chưa có lịch sử hội thoại trước đó."
-        
+def sorted_history(chat_history: list) -> list:
+    """Các tin nhắn user/assistant trong lịch sử, cũ nhất trước"""
     history_messages = []
-    for chat_turn in chat_history:
+    for chat_turn in chat_history or []:
         if 'messages' in chat_turn and isinstance(chat_turn['messages'], list):
             history_messages.extend(chat_turn['messages'])
-    
+
+    # Giữ nguyên cách sắp xếp theo timestamp; bỏ qua tin nhắn lỗi/thiếu nội dung
     sorted_history_messages = sorted(history_messages, key=lambda x: x.get('timestamp', ''))
-    
-    history_text = "\n".join([
-        f"[{msg.get('timestamp', '')}] {msg.get('role', 'unknown').capitalize()}: {msg.get('content', '')}"
-        for msg in sorted_history_messages if msg.get('role') in ['user', 'assistant'] and msg.get('content')
-    ])
-    
-    if len(sorted_history_messages) > 2:
-        history_text = "Ngữ cảnh cuộc hội thoại trước đó:\n" + history_text
-        
-    return history_text
+    return [
+        msg for msg in sorted_history_messages
+        if msg.get('role') in ['user', 'assistant'] and msg.get('content')
+    ]
 
-@router.get("/ask_stream")
-async def ask_stream(question: str, email: str = None):
-    global vectorstore
-    if vectorstore is None and not is_greeting(question):
-        try:
-            vectorstore = get_vectorstore()
-        except Exception as e:
-            error_message = {'type': 'error', 'message': 'Vectorstore chưa sẵn sàng. Vui lòng chạy ingest.py trước.'}
-            return StreamingResponse(iter([f"data: {json.dumps(error_message)}\n\n", "data: {\"type\": \"complete\"}\n\n"]), media_type="text/event-stream")
+def build_history_messages(chat_history: list) -> list:
+    """Lịch sử hội thoại dạng chat message.
+
+    Không kèm timestamp để phần lịch sử giữ nguyên giữa các lượt hỏi liên tiếp,
+    giúp Ollama tái sử dụng KV-cache cho cả system prompt lẫn lịch sử.
+    """
+    return [
+        HumanMessage(content=msg['content']) if msg['role'] == 'user' else AIMessage(content=msg['content'])
+        for msg in sorted_history(chat_history)
+    ]
 
-    chat_history = [] # Use a list to store history objects
-    if email:
+@router.get("/ask_stream")
+async def ask_stream(request: Request, question: str, email: str = None, debug: bool = False):
+    if not is_greeting(question):
         try:
-            chat_history = await asyncio.get_event_loop().run_in_executor(None, get_chat_history, email, 5)
+            get_vectorstore()
         except Exception as e:
-            logging.error(f"Error retrieving chat history for {email}: {str(e)}")
-            chat_history = []
+            error_frame = sse_event('error', message='Vectorstore chưa sẵn sàng. Vui lòng chạy ingest.py trước.')
+            return StreamingResponse(iter([error_frame, sse_event('complete')]), media_type="text/event-stream")
 
-    return StreamingResponse(stream_answer(question, email, chat_history), media_type="text/event-stream")
+    # Lịch sử hội thoại được tải bên trong stream, song song với retrieval,
+    # để response bắt đầu ngay mà không chờ Firestore
+    return StreamingResponse(stream_answer(question, email, debug=debug, request=request), media_type="text/event-stream")
 
 class ArchiveChatRequest(BaseModel):
     email: str
@@ -399,22 +636,61 @@ def api_unarchive_chat(data: ArchiveChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/archived_chats")
-def api_get_archived_chats(email: str, limit: int = 100):
+def api_get_archived_chats(email: str, limit: int = None, cursor: str = None):
     try:
-        chats = get_archived_chats(email, limit)
-        return {"success": True, "chats": chats}
+        chats, next_cursor = get_archived_chats(email, clamp_page_size(limit), cursor)
+        return {"success": True, "chats": chats, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/llm_stats")
+def get_llm_stats():
+    """Thống kê prompt-eval (token, thời gian) của các lượt sinh gần nhất"""
+    return {"success": True, "stats": llm_metrics.summary()}
+
+@router.get("/router_stats")
+def get_router_stats():
+    """Route model (nhỏ/lớn), thời gian theo route và tải của từng endpoint Ollama"""
+    return {"success": True, "stats": model_router.stats()}
+
+@router.get("/queue_stats")
+def get_queue_stats():
+    """Trạng thái hàng đợi sinh câu trả lời, các lượt sinh đang được gộp, số lần trả lời trích xuất và trả lời từ bảng"""
+    return {
+        "success": True,
+        "stats": generation_scheduler.stats(),
+        "single_flight": single_flight.stats(),
+        "fallback": fallback_stats(),
+        "course_facts": fact_stats(),
+    }
+
+@router.get("/db_stats")
+def get_db_stats():
+    """Thống kê truy cập Firestore của worker: cache email -> document user, hàng đợi ghi chat, session cache"""
+    return {
+        "success": True,
+        "stats": {
+            "user_ref_cache": user_ref_cache.stats(),
+            "chat_write_queue": chat_write_queue.stats(),
+            "session_cache": session_cache.stats(),
+        },
+    }
+
 @router.get("/metadata_stats")
 def get_metadata_stats():
     """Lấy thống kê metadata của vectorstore"""
     try:
+        vectorstore = index_manager.acquire_or_none()
         if vectorstore is None:
             raise HTTPException(status_code=404, detail="Vectorstore chưa sẵn sàng")
         
         # Lấy tất cả documents để phân tích metadata
-        all_docs = vectorstore.similarity_search("", k=1000)  # Lấy nhiều documents
+        try:
+            all_docs = vectorstore.similarity_search("", k=1000)  # Lấy nhiều documents
+        finally:
+            index_manager.release(vectorstore)
         
         # Thống kê theo loại tài liệu
         type_stats = {}
@@ -459,11 +735,15 @@ def search_by_metadata(
 ):
     """Tìm kiếm documents theo metadata"""
     try:
+        vectorstore = index_manager.acquire_or_none()
         if vectorstore is None:
             raise HTTPException(status_code=404, detail="Vectorstore chưa sẵn sàng")
         
         # Lấy tất cả documents
-        all_docs = vectorstore.similarity_search("", k=1000)
+        try:
+            all_docs = vectorstore.similarity_search("", k=1000)
+        finally:
+            index_manager.release(vectorstore)
         
         # Lọc theo metadata
         filtered_docs = []
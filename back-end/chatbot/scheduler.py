@@ -0,0 +1,191 @@
+"""
+Điều phối các lượt sinh câu trả lời gửi tới Ollama.
+
+Ollama chạy local chỉ phục vụ tốt một số lượt sinh song song; nếu để mọi request
+cùng gọi `astream`, tốc độ token của tất cả đều sụp và request bị timeout. Bộ
+điều phối giới hạn số lượt chạy đồng thời, xếp hàng FIFO (mỗi người dùng chỉ
+được giữ một số chỗ nhất định), báo vị trí hàng đợi cho client và từ chối sớm
+khi thời gian chờ dự kiến vượt ngưỡng.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import Counter, deque
+from typing import Optional
+
+from .model_router import OLLAMA_ENDPOINTS
+
+logger = logging.getLogger(__name__)
+
+# Số lượt sinh song song mà mỗi endpoint Ollama phục vụ tốt (OLLAMA_NUM_PARALLEL của server)
+GENERATION_SLOTS_PER_ENDPOINT = int(os.getenv("GENERATION_SLOTS_PER_ENDPOINT", "2"))
+# Mặc định tăng theo số endpoint trong pool OLLAMA_ENDPOINTS: thêm endpoint là thêm thông lượng
+GENERATION_CONCURRENCY = int(os.getenv(
+    "GENERATION_CONCURRENCY", str(GENERATION_SLOTS_PER_ENDPOINT * max(len(OLLAMA_ENDPOINTS), 1))
+))
+# Số lượt (đang chờ + đang chạy) tối đa của một người dùng
+GENERATION_PER_USER_LIMIT = int(os.getenv("GENERATION_PER_USER_LIMIT", "1"))
+# Từ chối khi thời gian chờ dự kiến vượt ngưỡng này (giây)
+GENERATION_MAX_WAIT_SECONDS = float(os.getenv("GENERATION_MAX_WAIT_SECONDS", "20"))
+# Ước lượng ban đầu cho thời gian một lượt sinh, cập nhật dần theo thực tế
+INITIAL_GENERATION_SECONDS = 8.0
+_EWMA_ALPHA = 0.2
+# Chu kỳ gửi lại vị trí hàng đợi khi không có thay đổi (giữ kết nối SSE)
+QUEUE_HEARTBEAT_SECONDS = 5.0
+
+
+class GenerationRejected(Exception):
+    """Không nhận thêm lượt sinh (quá tải hoặc người dùng đã có câu hỏi đang xử lý)"""
+
+    def __init__(self, message: str, reason: str, expected_wait: float = 0.0):
+        super().__init__(message)
+        self.message = message
+        self.reason = reason
+        self.expected_wait = expected_wait
+
+
+class GenerationTicket:
+    """Một chỗ trong hàng đợi sinh câu trả lời"""
+
+    def __init__(self, scheduler: "GenerationScheduler", user: Optional[str]):
+        self.scheduler = scheduler
+        self.user = user
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self._changed = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """Vị trí trong hàng đợi (1 = sắp được chạy), 0 nếu đã được chạy"""
+        return self.scheduler._position(self)
+
+    def _notify(self):
+        self._changed.set()
+
+    async def wait(self):
+        """Chờ đến lượt; yield (vị trí, thời gian chờ dự kiến) mỗi khi vị trí thay đổi"""
+        last_position = None
+        while not self.granted:
+            position = self.position
+            if position != last_position:
+                last_position = position
+                yield position, self.scheduler.expected_wait(position)
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=QUEUE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                last_position = None
+
+    def release(self, completed: bool = True):
+        """Trả chỗ (idempotent). Gọi trong finally, kể cả khi client ngắt kết nối"""
+        if self.released:
+            return
+        self.released = True
+        self.scheduler._release(self, completed)
+
+
+class GenerationScheduler:
+    def __init__(
+        self,
+        concurrency: int = GENERATION_CONCURRENCY,
+        per_user_limit: int = GENERATION_PER_USER_LIMIT,
+        max_wait_seconds: float = GENERATION_MAX_WAIT_SECONDS
+    ):
+        self.concurrency = max(1, concurrency)
+        self.per_user_limit = per_user_limit
+        self.max_wait_seconds = max_wait_seconds
+        self.running = 0
+        self.avg_generation_seconds = INITIAL_GENERATION_SECONDS
+        self._queue = deque()
+        self._per_user = Counter()
+        self.rejected = Counter()
+
+    def expected_wait(self, position: int) -> float:
+        """Thời gian chờ dự kiến (giây) cho vị trí trong hàng đợi"""
+        if position <= 0:
+            return 0.0
+        # Số "đợt" lượt sinh phải chờ trước khi có chỗ trống
+        waves = math.ceil(position / self.concurrency)
+        return round(waves * self.avg_generation_seconds, 1)
+
+    def submit(self, user: Optional[str] = None) -> GenerationTicket:
+        """Xin một chỗ; ném GenerationRejected nếu phải từ chối ngay"""
+        if user and self.per_user_limit > 0 and self._per_user[user] >= self.per_user_limit:
+            self.rejected["per_user"] += 1
+            raise GenerationRejected(
+                "Bạn đang có câu hỏi khác đang được xử lý. Vui lòng đợi câu trả lời trước hoàn tất rồi hỏi tiếp nhé.",
+                reason="per_user"
+            )
+
+        free_slot = self.running < self.concurrency and not self._queue
+        if not free_slot:
+            wait = self.expected_wait(len(self._queue) + 1)
+            if wait > self.max_wait_seconds:
+                self.rejected["overload"] += 1
+                raise GenerationRejected(
+                    f"Hệ thống đang quá tải (thời gian chờ dự kiến khoảng {wait:.0f} giây). Vui lòng thử lại sau ít phút.",
+                    reason="overload",
+                    expected_wait=wait
+                )
+
+        ticket = GenerationTicket(self, user)
+        if user:
+            self._per_user[user] += 1
+        self._queue.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _position(self, ticket: GenerationTicket) -> int:
+        if ticket.granted:
+            return 0
+        try:
+            return self._queue.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def _dispatch(self):
+        while self._queue and self.running < self.concurrency:
+            ticket = self._queue.popleft()
+            ticket.granted = True
+            ticket.started_at = time.monotonic()
+            self.running += 1
+            ticket._notify()
+        # Các lượt còn chờ được báo để cập nhật vị trí
+        for ticket in self._queue:
+            ticket._notify()
+
+    def _release(self, ticket: GenerationTicket, completed: bool):
+        if ticket.granted:
+            self.running -= 1
+            if completed and ticket.started_at is not None:
+                duration = time.monotonic() - ticket.started_at
+                self.avg_generation_seconds = (
+                    (1 - _EWMA_ALPHA) * self.avg_generation_seconds + _EWMA_ALPHA * duration
+                )
+        else:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                pass
+        if ticket.user:
+            self._per_user[ticket.user] -= 1
+            if self._per_user[ticket.user] <= 0:
+                del self._per_user[ticket.user]
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": len(self._queue),
+            "avg_generation_seconds": round(self.avg_generation_seconds, 2),
+            "max_wait_seconds": self.max_wait_seconds,
+            "rejected": dict(self.rejected)
+        }
+
+
+generation_scheduler = GenerationScheduler()
@@ -0,0 +1,202 @@
+"""
+Gộp các câu hỏi giống hệt nhau đang được xử lý cùng lúc (single-flight).
+
+Khi giảng viên bảo cả lớp "hỏi bot về cách đánh giá môn 71ITSE31003", hàng chục
+câu hỏi giống nhau đến trong vài giây. Thay vì mỗi câu chạy một lượt sinh riêng,
+câu đầu tiên (leader) chạy lượt sinh trong một task nền và phát lại toàn bộ sự
+kiện (vị trí hàng đợi, các đoạn text) cho mọi client đăng ký cùng khóa. Người đến
+sau nhận lại phần đã sinh rồi tiếp tục theo dõi phần còn lại.
+
+Khóa gồm câu hỏi đã chuẩn hoá, môn học đã xác định và dấu vân tay của context,
+nên hai câu hỏi chỉ được gộp khi prompt gửi cho LLM giống hệt nhau.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Optional
+
+from embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def context_fingerprint(docs) -> str:
+    """Dấu vân tay của tập context (thứ tự và nội dung các chunk)"""
+    digest = hashlib.sha1()
+    for doc in docs:
+        digest.update((doc.metadata.get('chunk_id') or '').encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(normalize_text(doc.page_content).encode("utf-8"))
+        digest.update(b"\1")
+    return digest.hexdigest()
+
+
+def flight_key(question: str, subject: Optional[str], docs) -> tuple:
+    return (normalize_text(question).lower(), (subject or "").lower(), context_fingerprint(docs))
+
+
+class Flight:
+    """Một lượt sinh đang chạy; giữ lại các sự kiện đã phát để người đến sau xem lại"""
+
+    def __init__(self, key=None):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        # Người đã join nhưng chưa bắt đầu đọc subscription (vẫn tính là đang theo dõi)
+        self.reserved = 0
+        self.cancelled = False
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event_type: str, **fields):
+        self.events.append((event_type, fields))
+        self._wake()
+
+    def finish(self, error: BaseException = None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        # Đánh thức mọi subscriber đang chờ rồi thay Event mới cho vòng sau
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self, connection=None, reserved: bool = False) -> "Subscription":
+        """Đăng ký theo dõi lượt sinh, trả về async iterator các (event_type, fields).
+
+        reserved=True khi flight có được từ SingleFlight.join(): chỗ giữ của
+        join() được chuyển thành subscriber khi bắt đầu đọc, hoặc được trả lại
+        khi đóng Subscription mà chưa kịp đọc (ví dụ hết hạn TTFT ngay lập tức).
+        """
+        subscription = Subscription(self, reserved)
+        subscription._events = self._stream(subscription, connection)
+        return subscription
+
+    async def _stream(self, subscription: "Subscription", connection=None):
+        """Yield (event_type, fields) từ đầu lượt sinh đến khi kết thúc.
+
+        Khi `connection` (ClientConnection) báo client đã ngắt, subscriber rời
+        flight ngay (kể cả khi đang chờ hàng đợi), không chờ lần ghi frame kế tiếp.
+        """
+        self.subscribers += 1
+        if subscription.reserved:
+            subscription.reserved = False
+            self.reserved -= 1
+        index = 0
+        if connection is not None:
+            connection.on_disconnect(self._wake)
+        try:
+            while connection is None or not connection.disconnected:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                    if connection is not None and connection.disconnected:
+                        return
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            if connection is not None:
+                connection.remove_callback(self._wake)
+            self.subscribers -= 1
+            self._cancel_if_unwatched()
+
+    def _release_reservation(self):
+        """Trả chỗ giữ của một người đã join() nhưng không bao giờ bắt đầu đọc"""
+        self.reserved -= 1
+        self._cancel_if_unwatched()
+
+    def _cancel_if_unwatched(self):
+        # Không còn ai theo dõi: dừng lượt sinh thay vì sinh tiếp cho không ai.
+        # Các subscriber khác của cùng flight vẫn nhận tiếp bình thường.
+        if self.subscribers == 0 and self.reserved == 0 and not self.done and self.task is not None:
+            # Đánh dấu ngay lúc huỷ: join() không trả flight này cho người đến
+            # sau trong lúc task còn đang dừng
+            self.cancelled = True
+            self.task.cancel()
+
+
+class Subscription:
+    """Async iterator của một subscriber.
+
+    Thân async generator chỉ chạy ở lần __anext__ đầu tiên; nếu lần đó bị huỷ
+    trước khi chạy (wait_for hết hạn ngay), aclose() của generator bỏ qua
+    finally. aclose() ở đây trả lại chỗ giữ của join() trong trường hợp đó.
+    """
+
+    def __init__(self, flight: Flight, reserved: bool):
+        self._flight = flight
+        self._events = None
+        self.reserved = reserved
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self._events.__anext__()
+
+    async def aclose(self):
+        await self._events.aclose()
+        if self.reserved:
+            self.reserved = False
+            self._flight._release_reservation()
+
+
+Producer = Callable[[Flight], Awaitable[None]]
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self.counters = Counter()
+
+    def join(self, key) -> Optional[Flight]:
+        """Flight đang chạy cùng khóa, nếu có"""
+        if key is None:
+            return None
+        flight = self._flights.get(key)
+        if flight is None or flight.done or flight.cancelled:
+            return None
+        flight.reserved += 1
+        self.counters["followers"] += 1
+        return flight
+
+    def start(self, key, producer: Producer) -> Flight:
+        """Chạy producer trong task nền. key=None: flight riêng, không chia sẻ"""
+        flight = Flight(key)
+        if key is not None:
+            self._flights[key] = flight
+            self.counters["leaders"] += 1
+        else:
+            self.counters["private"] += 1
+        flight.task = asyncio.create_task(self._run(flight, producer))
+        return flight
+
+    async def _run(self, flight: Flight, producer: Producer):
+        try:
+            await producer(flight)
+            flight.finish()
+        except asyncio.CancelledError as e:
+            flight.finish(e)
+        except Exception as e:
+            logger.error(f"Single-flight generation failed: {str(e)}")
+            flight.finish(e)
+        finally:
+            if flight.key is not None and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values()),
+            **dict(self.counters)
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,152 @@
+"""
+Ghi sự kiện SSE cho chatbot.
+
+Mỗi frame `data:` tốn một lần encode JSON, một lần ghi socket và chi phí ở proxy,
+nên token của LLM được gộp lại thành frame theo cửa sổ thời gian hoặc theo số
+byte (cấu hình được) thay vì gửi từng token/từng ký tự.
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+try:
+    import orjson
+
+    def _dumps(payload: dict) -> str:
+        return orjson.dumps(payload).decode("utf-8")
+except ImportError:  # pragma: no cover - orjson là tuỳ chọn
+    import json
+
+    def _dumps(payload: dict) -> str:
+        # Không escape tiếng Việt thành \uXXXX: mỗi ký tự có dấu tiết kiệm 3-4 byte
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+SSE_FLUSH_INTERVAL_MS = float(os.getenv("SSE_FLUSH_INTERVAL_MS", "50"))
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "256"))
+# Chu kỳ kiểm tra client còn kết nối hay không (giây)
+DISCONNECT_POLL_SECONDS = float(os.getenv("SSE_DISCONNECT_POLL_SECONDS", "0.5"))
+
+
+@dataclass
+class FlushPolicy:
+    """Gửi frame khi đã gom đủ max_bytes hoặc token đầu tiên trong frame đã chờ quá max_delay"""
+    max_delay: float = SSE_FLUSH_INTERVAL_MS / 1000
+    max_bytes: int = SSE_FLUSH_BYTES
+
+
+DEFAULT_FLUSH_POLICY = FlushPolicy()
+
+
+def encode_event(payload: dict) -> str:
+    """Một frame SSE hoàn chỉnh"""
+    return f"data: {_dumps(payload)}\n\n"
+
+
+def sse_event(event_type: str, **fields) -> str:
+    return encode_event({"type": event_type, **fields})
+
+
+async def coalesce_text(stream: AsyncIterator[str], policy: FlushPolicy = DEFAULT_FLUSH_POLICY):
+    """
+    Gộp các đoạn text từ một async iterator thành các khối lớn hơn.
+
+    Không chờ token kế tiếp quá max_delay: nếu LLM dừng giữa chừng, phần đã gom
+    vẫn được gửi đi đúng hạn.
+    """
+    iterator = stream.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Hết cửa sổ thời gian, gửi phần đã gom; giữ nguyên pending cho vòng sau
+                yield "".join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+                continue
+            try:
+                text = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+            if not text:
+                continue
+            buffer.append(text)
+            buffered_bytes += len(text.encode("utf-8"))
+            if deadline is None:
+                deadline = time.monotonic() + policy.max_delay
+            if buffered_bytes >= policy.max_bytes or policy.max_delay <= 0:
+                yield "".join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+
+
+def split_text(text: str, policy: FlushPolicy = DEFAULT_FLUSH_POLICY):
+    """Chia một đoạn text có sẵn thành các khối khoảng max_bytes (cắt ở khoảng trắng)"""
+    chunk = []
+    size = 0
+    for i, word in enumerate(text.split(" ")):
+        piece = word if i == 0 else " " + word
+        chunk.append(piece)
+        size += len(piece.encode("utf-8"))
+        if size >= policy.max_bytes:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
+
+
+class ClientConnection:
+    """
+    Theo dõi việc client SSE đóng kết nối (đóng tab, hỏi lại...).
+
+    Starlette chỉ phát hiện client đã đi khi ghi frame tiếp theo thất bại; trong
+    lúc chờ hàng đợi hoặc chờ token đầu tiên thì không có gì để ghi, nên kết nối
+    được kiểm tra chủ động bằng request.is_disconnected().
+    """
+
+    def __init__(self, request=None, poll_interval: float = DISCONNECT_POLL_SECONDS):
+        self.request = request
+        self.poll_interval = poll_interval
+        self.disconnected = False
+        self._callbacks = []
+        self._task = None
+
+    def start(self):
+        if self.request is not None and self._task is None:
+            self._task = asyncio.ensure_future(self._watch())
+        return self
+
+    def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def on_disconnect(self, callback):
+        if self.disconnected:
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    async def _watch(self):
+        while not await self.request.is_disconnected():
+            await asyncio.sleep(self.poll_interval)
+        self.disconnected = True
+        for callback in self._callbacks:
+            callback()
+        self._callbacks.clear()
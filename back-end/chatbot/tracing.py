@@ -0,0 +1,104 @@
+"""
+Đo thời gian từng bước của một request chatbot.
+
+Mỗi request có một RequestTrace ghi lại các span (lịch sử Firestore, embedding,
+search Chroma, chờ hàng đợi Ollama, time-to-first-token, sinh câu trả lời,
+save_chat). Kết quả được:
+- đưa vào histogram Prometheus `chatbot_stage_seconds{stage=...}` nếu có cài
+  prometheus_client (endpoint /metrics),
+- gửi về client dưới dạng sự kiện SSE `timing` khi bật cờ debug,
+- ghi log đầy đủ khi tổng thời gian vượt ngưỡng SLOW_REQUEST_SECONDS.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Cho phép client xin sự kiện `timing` qua tham số debug=true
+CHATBOT_DEBUG_TIMING = os.getenv("CHATBOT_DEBUG_TIMING", "0") == "1"
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "10"))
+
+# Thứ tự hiển thị các bước trong log/sự kiện timing
+STAGES = ["history", "fact_lookup", "embedding", "search", "section_lookup", "queue", "ttft", "generation", "save_chat", "total"]
+
+try:
+    from prometheus_client import Counter as PromCounter, Histogram
+
+    STAGE_SECONDS = Histogram(
+        "chatbot_stage_seconds",
+        "Thời gian từng bước xử lý câu hỏi chatbot",
+        ["stage"],
+        buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+    )
+    SLOW_REQUESTS = PromCounter("chatbot_slow_requests_total", "Số request vượt ngưỡng SLOW_REQUEST_SECONDS")
+except ImportError:  # pragma: no cover - prometheus_client là tuỳ chọn
+    STAGE_SECONDS = None
+    SLOW_REQUESTS = None
+
+
+class RequestTrace:
+    def __init__(self, email: str = None, question: str = ""):
+        self.email = email
+        self.question = question
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.tags = {}
+        self.finished = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def record(self, stage: str, seconds: float):
+        # Một bước có thể chạy nhiều lần (ví dụ truy xuất lại): cộng dồn
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def mark(self, stage: str):
+        """Ghi một mốc tính từ lúc bắt đầu request (ví dụ ttft), chỉ lần đầu"""
+        if stage not in self.spans:
+            self.spans[stage] = self.elapsed()
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def breakdown(self) -> dict:
+        ordered = [s for s in STAGES if s in self.spans] + [s for s in self.spans if s not in STAGES]
+        return {stage: round(self.spans[stage] * 1000, 1) for stage in ordered}
+
+    def finish(self) -> dict:
+        """Kết thúc trace (idempotent): xuất histogram và log request chậm"""
+        if self.finished:
+            return self.breakdown()
+        self.finished = True
+        self.record("total", self.elapsed())
+        if STAGE_SECONDS is not None:
+            for stage, seconds in self.spans.items():
+                STAGE_SECONDS.labels(stage=stage).observe(seconds)
+        breakdown = self.breakdown()
+        if self.spans["total"] >= SLOW_REQUEST_SECONDS:
+            if SLOW_REQUESTS is not None:
+                SLOW_REQUESTS.inc()
+            details = ", ".join(f"{stage}={ms:.0f}ms" for stage, ms in breakdown.items())
+            logger.warning(
+                f"Slow chatbot request ({self.spans['total']:.1f}s) for {self.email or 'anonymous'}: "
+                f"{details} | tags={self.tags} | question={self.question[:120]!r}"
+            )
+        return breakdown
+
+
+def metrics_app():
+    """ASGI app cho /metrics, None nếu chưa cài prometheus_client"""
+    try:
+        from prometheus_client import make_asgi_app
+    except ImportError:
+        return None
+    return make_asgi_app()
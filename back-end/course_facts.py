@@ -0,0 +1,375 @@
+"""
+Bảng thông tin cấu trúc của từng môn học (mã, tên, số tín chỉ, bắt buộc/tự chọn,
+trọng số đánh giá, điểm qua môn, giáo trình).
+
+Bảng được trích xuất lúc ingest từ các đề cương và data/mon_tu_chon.json rồi lưu
+ra data/course_facts.json. Câu hỏi dạng "môn X có bao nhiêu tín chỉ", "mã môn",
+"điểm qua môn" hay "môn X bắt buộc hay tự chọn" được trả lời thẳng từ bảng,
+không qua retrieval và LLM. Chỉ trả lời khi khớp chắc chắn cả môn học lẫn loại
+câu hỏi; còn lại để chatbot đi đường RAG như cũ.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import List, Optional
+
+from syllabus_sections import (
+    SUBJECT_CODE_PATTERN, SYLLABUS_SECTIONS, detect_heading, extract_course_info, fold_accents, split_sections,
+)
+
+COURSE_FACTS_PATH = os.getenv("COURSE_FACTS_PATH", "data/course_facts.json")
+ELECTIVES_PATH = os.getenv("ELECTIVES_PATH", "data/mon_tu_chon.json")
+
+REQUIRED = "bắt buộc"
+ELECTIVE = "tự chọn"
+
+# Loại câu hỏi -> từ khóa (đã bỏ dấu) trong câu hỏi
+FACT_INTENTS = [
+    ("code", ["ma mon", "ma hoc phan", "ma so mon"]),
+    ("credits", ["tin chi"]),
+    ("kind", ["bat buoc", "tu chon"]),
+    ("pass_grade", ["diem qua mon", "qua mon", "de qua", "diem dat", "diem toi thieu"]),
+    ("grading", ["trong so", "ty le diem", "ti le diem", "cach tinh diem", "thanh phan diem"]),
+    ("textbooks", ["giao trinh"]),
+]
+
+# Câu hỏi còn hỏi thêm mục khác của đề cương (mục tiêu, nội dung...) thì cần RAG
+FACT_SECTIONS = ("thong_tin_hoc_phan", "danh_gia", "giao_trinh")
+_OTHER_SECTION_KEYWORDS = [
+    kw for key, _, _, keywords in SYLLABUS_SECTIONS if key not in FACT_SECTIONS for kw in keywords
+]
+
+# Câu hỏi dạng liệt kê nhiều môn ("các môn tự chọn", "môn nào có 3 tín chỉ") không phải câu hỏi về một môn
+LIST_MARKERS = ["cac mon", "nhung mon", "mon nao", "danh sach", "liet ke"]
+
+MIN_NAME_LENGTH = 4
+MAX_TEXTBOOKS = 5
+
+_CREDITS_PATTERN = re.compile(r"so tin chi[^0-9\n]{0,20}(\d{1,2})")
+_KIND_PATTERN = re.compile(r"(loai|tinh chat|khoi kien thuc)[^\n:]{0,30}:?\s*(bat buoc|tu chon)")
+_PASS_PATTERN = re.compile(
+    r"(diem (dat|qua mon|toi thieu)|dat hoc phan|qua mon)[^0-9\n]{0,40}(\d{1,2}(?:[.,]\d{1,2})?)\s*(/\s*10|diem)?"
+)
+# "Chuyên cần 10%", "Thi cuối kỳ: 60 %" (tên thành phần đứng trước trọng số)
+_WEIGHT_PATTERN = re.compile(r"([^\n.;:%()0-9]{3,60}?)\s*[:\-(]?\s*(\d{1,3})\s*%")
+_TEXTBOOK_LABEL_PATTERN = re.compile(r"giáo trình( chính)?\s*:\s*([^\n]+)", re.IGNORECASE)
+_TEXTBOOK_ITEM_PATTERN = re.compile(r"^\s*(\[\d{1,2}\]|\d{1,2}[.)])\s+(.{8,})$")
+_ELECTIVE_GROUP_PATTERN = re.compile(r"nhóm môn tự chọn (\w+) \((\d+) tín chỉ\)", re.IGNORECASE)
+_ELECTIVE_ITEM_PATTERN = re.compile(r"\d+\.\s*([^\n(]+?)\s*\((\d+) tín chỉ\)\s*\n\s*-\s*Mã môn học:\s*(\w+)")
+
+
+def _course_key(code: Optional[str], name: Optional[str]) -> Optional[str]:
+    if code:
+        return code.upper()
+    if name:
+        return fold_accents(name).strip()
+    return None
+
+
+def _extract_kind(text: str) -> Optional[str]:
+    """Bắt buộc/tự chọn; đề cương ghi cả hai (bảng đánh dấu ô) mà không rõ nhãn thì bỏ qua"""
+    folded = fold_accents(text)
+    labelled = _KIND_PATTERN.search(folded)
+    if labelled:
+        return REQUIRED if labelled.group(2) == "bat buoc" else ELECTIVE
+    has_required = "bat buoc" in folded
+    has_elective = "tu chon" in folded
+    if has_required != has_elective:
+        return REQUIRED if has_required else ELECTIVE
+    return None
+
+
+def _extract_grading(text: str) -> List[dict]:
+    """Các thành phần đánh giá; chỉ giữ khi tổng trọng số đúng 100%"""
+    components = []
+    for match in _WEIGHT_PATTERN.finditer(text):
+        component = match.group(1).strip(" -–•*,")
+        weight = int(match.group(2))
+        if component and 0 < weight <= 100:
+            components.append({"component": component[0].upper() + component[1:], "weight": weight})
+    if sum(c["weight"] for c in components) != 100:
+        return []
+    return components
+
+
+def _extract_pass_grade(text: str) -> Optional[float]:
+    match = _PASS_PATTERN.search(fold_accents(text))
+    if not match:
+        return None
+    value = float(match.group(3).replace(",", "."))
+    return value if 0 < value <= 10 else None
+
+
+def _extract_textbooks(text: str) -> List[str]:
+    books = []
+    for match in _TEXTBOOK_LABEL_PATTERN.finditer(text):
+        # "Giáo trình chính: A. Tài liệu tham khảo: B" -> chỉ lấy A
+        books.append(re.split(r"\.\s+(?=tài liệu)", match.group(2), flags=re.IGNORECASE)[0].strip(" ."))
+    for line in text.splitlines():
+        match = _TEXTBOOK_ITEM_PATTERN.match(line)
+        if match and not detect_heading(line):
+            books.append(match.group(2).strip())
+    unique = []
+    for book in books:
+        book = book[:200]
+        if book and book not in unique:
+            unique.append(book)
+    return unique[:MAX_TEXTBOOKS]
+
+
+def extract_syllabus_facts(text: str, metadata: dict = None) -> Optional[dict]:
+    """
+    Trích xuất thông tin cấu trúc từ toàn văn một đề cương.
+
+    Returns:
+        dict hoặc None nếu không xác định được mã/tên môn học
+    """
+    metadata = metadata or {}
+    info = extract_course_info(text[:3000])
+    code = info.get("course_code")
+    name = info.get("course_name") or (metadata.get("name") or "").replace("_", " ").strip() or None
+    if not code and not name:
+        return None
+
+    sections = {}
+    for section, segment in split_sections(text):
+        sections[section] = sections.get(section, "") + "\n" + segment
+    header = sections.get(None, "") + sections.get("thong_tin_hoc_phan", "")
+    grading_text = sections.get("danh_gia", "")
+
+    credits_match = _CREDITS_PATTERN.search(fold_accents(header or text[:3000]))
+    return {
+        "code": code,
+        "name": name,
+        "credits": int(credits_match.group(1)) if credits_match else None,
+        "kind": _extract_kind(header),
+        "group": None,
+        "grading": _extract_grading(grading_text),
+        "pass_grade": _extract_pass_grade(grading_text),
+        "textbooks": _extract_textbooks(sections.get("giao_trinh", "")),
+        "source": metadata.get("source", ""),
+    }
+
+
+def extract_elective_facts(path: str = ELECTIVES_PATH) -> List[dict]:
+    """Các môn trong nhóm tự chọn liệt kê ở data/mon_tu_chon.json"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading electives from {path}: {str(e)}")
+        return []
+    facts = []
+    for message in data.get("greeting_messages", []):
+        group_match = _ELECTIVE_GROUP_PATTERN.search(message)
+        group = None
+        if group_match:
+            group = {"code": group_match.group(1), "credits": int(group_match.group(2))}
+        for name, credits, code in _ELECTIVE_ITEM_PATTERN.findall(message):
+            facts.append({
+                "code": code.upper(),
+                "name": name.strip(),
+                "credits": int(credits),
+                "kind": ELECTIVE,
+                "group": group,
+                "grading": [],
+                "pass_grade": None,
+                "textbooks": [],
+                "source": os.path.basename(path),
+            })
+    return facts
+
+
+def _merge(existing: dict, new: dict) -> dict:
+    """Gộp hai bản ghi của cùng một môn, giữ giá trị đã có khi bản mới thiếu"""
+    merged = dict(existing)
+    for field, value in new.items():
+        if value not in (None, "", [], {}):
+            merged[field] = value
+    return merged
+
+
+def build_course_facts(documents, electives_path: str = ELECTIVES_PATH) -> dict:
+    """
+    Dựng bảng thông tin môn học từ tài liệu đã load (mỗi trang một Document).
+
+    Returns:
+        dict: khóa (mã môn hoặc tên đã bỏ dấu) -> bản ghi
+    """
+    # Ghép các trang của cùng một nguồn theo thứ tự để các mục vắt qua trang không bị cắt
+    pages_by_source = {}
+    for doc in documents:
+        source = doc.metadata.get("source", "")
+        entry = pages_by_source.setdefault(source, {"metadata": doc.metadata, "pages": []})
+        entry["pages"].append(doc.page_content)
+
+    facts = {}
+    for fact in extract_elective_facts(electives_path):
+        facts[_course_key(fact["code"], fact["name"])] = fact
+    for entry in pages_by_source.values():
+        fact = extract_syllabus_facts("\n".join(entry["pages"]), entry["metadata"])
+        if fact is None:
+            continue
+        key = _course_key(fact["code"], fact["name"])
+        facts[key] = _merge(facts[key], fact) if key in facts else fact
+    return facts
+
+
+def save_course_facts(facts: dict, path: str = COURSE_FACTS_PATH):
+    """Ghi bảng ra file tạm rồi đổi tên, tiến trình đang đọc không thấy file ghi dở"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(facts, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def update_course_facts(documents, path: str = COURSE_FACTS_PATH) -> int:
+    """Trích xuất từ tài liệu mới và gộp vào bảng đã lưu (dùng khi admin tải thêm đề cương)"""
+    facts = course_fact_table.load_file(path)
+    for key, fact in build_course_facts(documents).items():
+        facts[key] = _merge(facts[key], fact) if key in facts else fact
+    save_course_facts(facts, path)
+    return len(facts)
+
+
+def detect_fact_intents(question: str) -> List[str]:
+    """
+    Các loại thông tin câu hỏi yêu cầu, theo thứ tự trong FACT_INTENTS.
+
+    Rỗng nếu câu hỏi liệt kê nhiều môn hoặc hỏi thêm mục đề cương không có trong bảng.
+    """
+    folded = fold_accents(question)
+    if any(marker in folded for marker in LIST_MARKERS):
+        return []
+    question_lower = question.lower()
+    if any(kw in question_lower for kw in _OTHER_SECTION_KEYWORDS):
+        return []
+    return [intent for intent, keywords in FACT_INTENTS if any(kw in folded for kw in keywords)]
+
+
+def _format_grade(value: float) -> str:
+    return f"{value:g}/10"
+
+
+class CourseFactTable:
+    """Bảng đã lưu, tự đọc lại khi file thay đổi (ingest hoặc admin tải đề cương mới)"""
+
+    def __init__(self, path: str = COURSE_FACTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._facts = {}
+        self._names = []
+
+    @staticmethod
+    def load_file(path: str) -> dict:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.error(f"Error loading course facts: {str(e)}")
+            return {}
+
+    def _refresh(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            self._facts = self.load_file(self.path) if mtime is not None else {}
+            # Tên dài xét trước để "Lập trình Python nâng cao" không bị khớp thành "Lập trình Python"
+            names = [
+                (fold_accents(fact["name"]).strip(), key)
+                for key, fact in self._facts.items()
+                if fact.get("name") and len(fact["name"].strip()) >= MIN_NAME_LENGTH
+            ]
+            self._names = sorted(names, key=lambda item: len(item[0]), reverse=True)
+            self._mtime = mtime
+
+    def match_course(self, text: str) -> Optional[dict]:
+        """Môn học được nhắc trong câu (mã môn hoặc nguyên tên môn), None nếu không chắc chắn"""
+        self._refresh()
+        if not text or not self._facts:
+            return None
+        code_match = SUBJECT_CODE_PATTERN.search(text)
+        if code_match:
+            # Có mã môn mà không có trong bảng: không đoán theo tên
+            return self._facts.get(code_match.group(0).upper())
+        folded = fold_accents(text)
+        for name, key in self._names:
+            if re.search(rf"(?<!\w){re.escape(name)}(?!\w)", folded):
+                return self._facts[key]
+        return None
+
+    def stats(self) -> dict:
+        self._refresh()
+        return {"courses": len(self._facts), "path": self.path}
+
+
+course_fact_table = CourseFactTable()
+
+# Số câu hỏi trả lời từ bảng / phải chuyển sang RAG, theo loại thông tin
+fact_counters = Counter()
+
+
+def record_fact_lookup(intents: List[str], answered: bool):
+    for intent in intents:
+        fact_counters[f"{intent}_{'answered' if answered else 'missed'}"] += 1
+
+
+def fact_stats() -> dict:
+    return {**course_fact_table.stats(), **dict(fact_counters)}
+
+
+def answer_fact(intents: List[str], course: dict) -> Optional[str]:
+    """
+    Câu trả lời ngắn cho các loại thông tin được hỏi; None nếu bảng thiếu bất kỳ
+    thông tin nào trong số đó (để chatbot dùng RAG thay vì trả lời nửa vời).
+    """
+    if not intents or not course:
+        return None
+    label = f"**{course['name']}**" if course.get("name") else f"**{course['code']}**"
+    if course.get("name") and course.get("code"):
+        label += f" ({course['code']})"
+    lines = []
+    for intent in intents:
+        if intent == "code":
+            if not course.get("code"):
+                return None
+            lines.append(f"Mã môn học của môn {label} là **{course['code']}**.")
+        elif intent == "credits":
+            if not course.get("credits"):
+                return None
+            lines.append(f"Môn {label} có **{course['credits']} tín chỉ**.")
+        elif intent == "kind":
+            if not course.get("kind"):
+                return None
+            line = f"Môn {label} là môn **{course['kind']}**"
+            group = course.get("group")
+            if group:
+                line += f", thuộc nhóm tự chọn {group['code']} ({group['credits']} tín chỉ)"
+            lines.append(line + ".")
+        elif intent == "pass_grade":
+            if not course.get("pass_grade"):
+                return None
+            lines.append(f"Để qua môn {label}, bạn cần đạt tối thiểu **{_format_grade(course['pass_grade'])}**.")
+        elif intent == "grading":
+            if not course.get("grading"):
+                return None
+            lines.append(f"Các thành phần đánh giá của môn {label}:")
+            lines.extend(f"- {c['component']}: {c['weight']}%" for c in course["grading"])
+        elif intent == "textbooks":
+            if not course.get("textbooks"):
+                return None
+            lines.append(f"Giáo trình của môn {label}:")
+            lines.extend(f"- {book}" for book in course["textbooks"])
+    if course.get("source"):
+        lines.append(f"\n_Nguồn: {course['source']}_")
+    return "\n".join(lines)
@@ -1,12 +1,19 @@
 from .firebase import initialize_firestore
-from .chat import save_chat, get_chat_history, clear_chat_history, archive_chat, unarchive_chat, get_archived_chats
+from .chat import save_chat, get_chat_history, get_recent_history, load_session_history, reset_chat_session, clear_chat_history, archive_chat, unarchive_chat, get_archived_chats
 from .user import get_user_info, update_user_info, get_user_activities, save_user_activity, clear_user_activities
 from .feedback import save_feedback, get_all_feedbacks, update_feedback_status
+from .user_cache import resolve_user_ref, invalidate_user, user_ref_cache
+from .write_behind import enqueue_chat, chat_write_queue
+from .session_cache import session_cache
+from .bulk_delete import start_user_deletion, get_deletion_status, resume_deletion_jobs
 
 __all__ = [
     'initialize_firestore',
     'save_chat',
     'get_chat_history',
+    'get_recent_history',
+    'load_session_history',
+    'reset_chat_session',
     'clear_chat_history',
     'archive_chat',
     'unarchive_chat',
@@ -19,5 +26,14 @@ __all__ = [
     'save_feedback',
     'get_all_feedbacks',
     'update_feedback_status',
+    'resolve_user_ref',
+    'invalidate_user',
+    'user_ref_cache',
+    'enqueue_chat',
+    'chat_write_queue',
+    'session_cache',
+    'start_user_deletion',
+    'get_deletion_status',
+    'resume_deletion_jobs',
    
 ] 
\ No newline at end of file
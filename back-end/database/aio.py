@@ -0,0 +1,262 @@
+"""
+Lớp truy cập Firestore bất đồng bộ cho các endpoint async.
+
+Các handler `async def` của user/ và admin/ gọi client Firestore đồng bộ ngay
+trên event loop: mỗi round trip Firestore chặn mọi stream khác của worker. Ở đây
+dùng AsyncClient (firebase_admin.firestore_async) với một client dùng chung cho
+cả worker (một kênh gRPC, tạo khi được dùng lần đầu trong event loop), nên các
+endpoint này chỉ await I/O, không chặn loop và không chiếm thread pool.
+
+Firestore giả lập của bộ load-test là client đồng bộ, không áp dụng cho lớp này.
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+from firebase_admin import firestore
+
+from .chat import CHAT_HEADER_FIELDS
+from .firebase import initialize_firestore
+from .pagination import decode_offset_cursor, finish_page, page_list, page_query
+from .session_cache import invalidate_session, new_chat_version
+from .user_cache import user_ref_cache
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = ["role", "content", "timestamp", "sourceDocuments"]
+
+_async_client = None
+_client_lock = asyncio.Lock()
+
+
+async def get_async_firestore():
+    """AsyncClient dùng chung của worker (khởi tạo Firebase Admin nếu chưa có)"""
+    global _async_client
+    if _async_client is not None:
+        return _async_client
+    async with _client_lock:
+        if _async_client is None:
+            from firebase_admin import firestore_async
+
+            # Khởi tạo app Firebase Admin (service account) theo cùng một đường với client đồng bộ
+            initialize_firestore()
+            _async_client = firestore_async.client()
+    return _async_client
+
+
+async def close_async_firestore():
+    """Đóng kênh gRPC của AsyncClient khi worker tắt"""
+    global _async_client
+    client, _async_client = _async_client, None
+    close = getattr(client, "close", None)
+    if close is not None:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+def _with_id(snapshot) -> dict:
+    data = snapshot.to_dict() or {}
+    data["id"] = snapshot.id
+    return data
+
+
+async def _user_chats(uid: str):
+    db = await get_async_firestore()
+    return db.collection("users").document(uid).collection("chats")
+
+
+async def _stream_page(query, order_field: str, limit: int, cursor: str = None, descending: bool = True) -> list:
+    query = page_query(query, order_field, limit, cursor, descending)
+    return [_with_id(snapshot) async for snapshot in query.stream()]
+
+
+async def list_user_chats(uid: str, limit: int = 20, cursor: str = None):
+    """
+    Một trang đầu mục chat của user (mới nhất trước).
+
+    Returns:
+        tuple: (chats, next_cursor)
+    """
+    chats_ref = await _user_chats(uid)
+    chats = await _stream_page(chats_ref.select(CHAT_HEADER_FIELDS), "timestamp", limit, cursor)
+    return finish_page(chats, "timestamp", limit)
+
+
+async def list_archived_chats(uid: str, limit: int = 20, cursor: str = None):
+    """
+    Một trang chat đã lưu trữ của user (mới nhất trước).
+
+    Chat được lưu trữ qua API có archived=True, qua giao diện web có status
+    'archived': hai truy vấn cùng thứ tự (timestamp, id) và cùng cursor được
+    chạy song song rồi trộn lại.
+
+    Returns:
+        tuple: (chats, next_cursor)
+    """
+    chats_ref = (await _user_chats(uid)).select(CHAT_HEADER_FIELDS)
+    pages = await asyncio.gather(
+        _stream_page(chats_ref.where("archived", "==", True), "timestamp", limit, cursor),
+        _stream_page(chats_ref.where("status", "==", "archived"), "timestamp", limit, cursor),
+    )
+    merged = {chat["id"]: chat for page in pages for chat in page}
+    chats = sorted(merged.values(), key=lambda chat: (chat["timestamp"], chat["id"]), reverse=True)
+    has_more = len(chats) > limit or any(len(page) > limit for page in pages)
+    return finish_page(chats, "timestamp", limit, has_more)
+
+
+async def list_chat_messages(uid: str, chat_id: str, limit: int = 50, cursor: str = None):
+    """
+    Một trang tin nhắn của một chat (cũ nhất trước), tải khi người dùng mở chat.
+
+    Chat do API ghi có tin nhắn trong subcollection messages; chat do giao diện
+    web tạo lưu tin nhắn trong mảng messages của chính document chat, khi đó mảng
+    này được cắt trang trong bộ nhớ.
+
+    Returns:
+        tuple: (messages, next_cursor), None nếu không tìm thấy chat
+    """
+    chat_ref = (await _user_chats(uid)).document(chat_id)
+    offset = decode_offset_cursor(cursor) if cursor else None
+    if offset is None:
+        messages_ref = chat_ref.collection("messages").select(MESSAGE_FIELDS)
+        messages = await _stream_page(messages_ref, "timestamp", limit, cursor, descending=False)
+        if messages or cursor is not None:
+            return finish_page(messages, "timestamp", limit)
+        offset = 0
+    chat = await chat_ref.get(field_paths=["messages"])
+    if not chat.exists:
+        return None
+    return page_list((chat.to_dict() or {}).get("messages") or [], offset, limit)
+
+
+async def _reset_chat_session(uid: str, email: str = None):
+    """
+    Lịch sử chat của user vừa thay đổi ngoài lượt hỏi-đáp: bỏ session cache ở
+    worker này và đổi chatVersion để worker khác đọc lại (như reset_chat_session)
+    """
+    email = email or user_ref_cache.email_for_uid(uid)
+    if email:
+        invalidate_session(email)
+    version = new_chat_version()
+    if version:
+        db = await get_async_firestore()
+        await db.collection("users").document(uid).set({"chatVersion": version}, merge=True)
+
+
+async def set_chat_archived(uid: str, chat_id: str, archived: bool, email: str = None) -> bool:
+    """
+    Lưu trữ hoặc bỏ lưu trữ một chat.
+
+    Returns:
+        bool: False nếu không tìm thấy chat
+    """
+    chat_ref = (await _user_chats(uid)).document(chat_id)
+    chat = await chat_ref.get()
+    if not chat.exists:
+        return False
+    if archived:
+        await chat_ref.update({"archived": True})
+    else:
+        await chat_ref.update({
+            "archived": False,
+            "status": "active",
+            "archivedAt": firestore.DELETE_FIELD
+        })
+    await _reset_chat_session(uid, email)
+    return True
+
+
+async def delete_user_chat(uid: str, chat_id: str, email: str = None) -> bool:
+    chat_ref = (await _user_chats(uid)).document(chat_id)
+    chat = await chat_ref.get()
+    if not chat.exists:
+        return False
+    # Xóa subcollection messages trước (BulkWriter chỉ có ở client đồng bộ, chạy
+    # trong thread pool); xóa document chat sau cùng để lỗi giữa chừng còn xóa lại được
+    from .bulk_delete import delete_documents
+    db = initialize_firestore()
+    messages = db.collection("users").document(uid).collection("chats").document(chat_id).collection("messages")
+    await asyncio.get_event_loop().run_in_executor(None, delete_documents, db, messages.recursive())
+    await chat_ref.delete()
+    # Chat đã xóa không còn được đưa vào prompt như lịch sử hội thoại
+    await _reset_chat_session(uid, email)
+    return True
+
+
+async def share_user_chat(uid: str, chat_id: str):
+    """
+    Tạo bản sao của chat trong collection shared_chats.
+
+    Returns:
+        str: ID của bản chia sẻ, None nếu không tìm thấy chat
+    """
+    db = await get_async_firestore()
+    chat = await db.collection("users").document(uid).collection("chats").document(chat_id).get()
+    if not chat.exists:
+        return None
+    chat_data = chat.to_dict()
+    shared_chat_ref = db.collection("shared_chats").document()
+    await shared_chat_ref.set({
+        "original_chat_id": chat_id,
+        "original_user_id": uid,
+        "title": chat_data.get("title", "Untitled Chat"),
+        "messages": chat_data.get("messages", []),
+        "timestamp": datetime.now(),
+        "share_count": 0
+    })
+    return shared_chat_ref.id
+
+
+async def get_shared_chat(share_id: str):
+    """Nội dung một chat được chia sẻ (tăng số lượt xem), None nếu không có"""
+    db = await get_async_firestore()
+    shared_chat_ref = db.collection("shared_chats").document(share_id)
+    shared_chat = await shared_chat_ref.get()
+    if not shared_chat.exists:
+        return None
+    await shared_chat_ref.update({"share_count": firestore.Increment(1)})
+    return shared_chat.to_dict()
+
+
+async def add_feedback(feedback_data: dict) -> str:
+    """Lưu feedback vào collection feedbacks, trả về ID"""
+    db = await get_async_firestore()
+    feedback_ref = db.collection("feedbacks").document()
+    feedback_data["id"] = feedback_ref.id
+    await feedback_ref.set(feedback_data)
+    return feedback_ref.id
+
+
+async def list_feedbacks(user_id: str = None) -> list:
+    """Feedback trong collection feedbacks (của một user nếu có user_id)"""
+    db = await get_async_firestore()
+    query = db.collection("feedbacks")
+    if user_id is not None:
+        query = query.where("user_id", "==", user_id)
+    return [_with_id(feedback) async for feedback in query.stream()]
+
+
+async def list_user_feedback(uid: str) -> list:
+    """Feedback trong subcollection feedback của user"""
+    db = await get_async_firestore()
+    feedback_ref = db.collection("users").document(uid).collection("feedback")
+    return [_with_id(feedback) async for feedback in feedback_ref.stream()]
+
+
+async def update_feedback(feedback_id: str, status: str):
+    db = await get_async_firestore()
+    await db.collection("feedbacks").document(feedback_id).update({
+        "status": status,
+        "updated_at": datetime.now().isoformat()
+    })
+
+
+async def delete_feedback(feedback_id: str) -> bool:
+    db = await get_async_firestore()
+    feedback_ref = db.collection("feedbacks").document(feedback_id)
+    feedback_doc = await feedback_ref.get()
+    if not feedback_doc.exists:
+        return False
+    await feedback_ref.delete()
+    return True
@@ -0,0 +1,290 @@
+"""
+Xóa hàng loạt dữ liệu của một người dùng (/user/delete-data, xóa tài khoản).
+
+Trước đây các chat bị xóa tuần tự từng document một và subcollection messages
+không bao giờ bị xóa: messages mồ côi tích tụ và phantich.collect_user_questions
+vẫn quét chúng. Ở đây mỗi phần dữ liệu (chats gồm cả messages, activities,
+feedback) được đọc theo trang bằng truy vấn recursive() chỉ lấy tên document, rồi
+xóa qua BulkWriter: ghi song song, tự giới hạn tốc độ (tăng dần theo quy tắc
+500/50/5 của Firestore) và tự thử lại lỗi tạm thời.
+
+Tiến độ của mỗi lần xóa được ghi vào document deletion_jobs/{uid} (không gồm
+email), nên worker nào cũng trả lời được trạng thái. Document này ghi worker đang
+chạy job (owner) và heartbeat cập nhật sau mỗi trang. Việc xóa lặp lại được
+(document đã xóa không còn trong trang kế tiếp): job bị gián đoạn (heartbeat quá
+DELETION_JOB_STALE_SECONDS) được chạy tiếp khi gọi lại endpoint hoặc khi worker
+khởi động (resume_deletion_jobs). Worker nhận job bằng lệnh ghi có điều kiện
+(document chưa đổi kể từ lúc đọc), nên chỉ một worker chạy mỗi job.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .firebase import initialize_firestore
+from .chat import reset_chat_session
+from .session_cache import invalidate_session
+from .user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+# Số document đọc và xóa mỗi trang; tiến độ được cập nhật sau mỗi trang
+BULK_DELETE_PAGE_SIZE = int(os.getenv("BULK_DELETE_PAGE_SIZE", "500"))
+BULK_DELETE_INITIAL_OPS = int(os.getenv("BULK_DELETE_INITIAL_OPS", "500"))
+BULK_DELETE_MAX_OPS = int(os.getenv("BULK_DELETE_MAX_OPS", "5000"))
+# Số job xóa chạy đồng thời trong một worker
+BULK_DELETE_WORKERS = int(os.getenv("BULK_DELETE_WORKERS", "2"))
+JOBS_COLLECTION = "deletion_jobs"
+# Job "running" không có heartbeat trong khoảng này được coi là bị gián đoạn
+DELETION_JOB_STALE_SECONDS = float(os.getenv("DELETION_JOB_STALE_SECONDS", "300"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_executor = ThreadPoolExecutor(max_workers=BULK_DELETE_WORKERS, thread_name_prefix="bulk-delete")
+_running = {}
+_running_lock = threading.Lock()
+
+
+def _bulk_writer(db):
+    try:
+        from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+    except ImportError:  # pragma: no cover - client không phải Firestore thật (Firestore giả lập)
+        return db.bulk_writer()
+    return db.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=BULK_DELETE_INITIAL_OPS,
+        max_ops_per_second=BULK_DELETE_MAX_OPS,
+        mode=SendMode.parallel,
+    ))
+
+
+def delete_documents(db, query, on_progress=None, page_size: int = BULK_DELETE_PAGE_SIZE) -> Counter:
+    """
+    Xóa mọi document khớp query theo từng trang qua BulkWriter.
+
+    Args:
+        query: truy vấn cần xóa (collection.recursive() để gồm cả subcollection)
+        on_progress: hàm nhận Counter số document đã xóa theo tên collection, gọi sau mỗi trang
+
+    Returns:
+        Counter: số document đã xóa theo tên collection (chats, messages, ...)
+    """
+    counts = Counter()
+    writer = _bulk_writer(db)
+    previous_page = set()
+    try:
+        while True:
+            # Document đã xóa không còn trong kết quả: luôn đọc trang đầu tiên
+            page = list(query.select(["__name__"]).limit(page_size).get())
+            if not page:
+                break
+            paths = {snapshot.reference.path for snapshot in page}
+            if paths & previous_page:
+                # BulkWriter đã bỏ cuộc với các document này, tránh lặp vô hạn
+                raise RuntimeError(f"Không xóa được {len(paths & previous_page)} document")
+            previous_page = paths
+            for snapshot in page:
+                writer.delete(snapshot.reference)
+                counts[snapshot.reference.parent.id] += 1
+            writer.flush()
+            if on_progress is not None:
+                on_progress(counts)
+    finally:
+        writer.close()
+    return counts
+
+
+def _user_data_queries(db, uid: str):
+    """Dữ liệu của user: chats (gồm messages), activities, feedback và góp ý trong feedbacks"""
+    user_ref = db.collection("users").document(uid)
+    return [
+        user_ref.collection("chats").recursive(),
+        user_ref.collection("activities").recursive(),
+        user_ref.collection("feedback").recursive(),
+        db.collection("feedbacks").where("user_id", "==", uid),
+    ]
+
+
+def clear_user_data(db, uid: str, on_progress=None) -> Counter:
+    """Xóa đồng bộ toàn bộ dữ liệu (không gồm document user) của một user"""
+    total = Counter()
+    for query in _user_data_queries(db, uid):
+        done = Counter(total)
+        counts = delete_documents(
+            db, query, on_progress=None if on_progress is None else lambda c: on_progress(done + c)
+        )
+        total.update(counts)
+    return total
+
+
+class DeletionJob:
+    def __init__(self, uid: str, email: str = None, delete_account: bool = False):
+        self.uid = uid
+        # Chỉ giữ trong bộ nhớ (để bỏ session cache), không ghi vào deletion_jobs
+        self.email = email
+        self.delete_account = delete_account
+        self.status = "running"
+        self.deleted = Counter()
+        self.error = None
+        self.started_at = datetime.now()
+        self.updated_at = self.started_at
+        self.heartbeat = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "uid": self.uid,
+            "delete_account": self.delete_account,
+            "owner": WORKER_ID,
+            "heartbeat": self.heartbeat,
+            "status": self.status,
+            "deleted": dict(self.deleted),
+            "total_deleted": sum(self.deleted.values()),
+            "error": self.error,
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _is_stale(data: dict) -> bool:
+    return time.time() - (data.get("heartbeat") or 0) > DELETION_JOB_STALE_SECONDS
+
+
+def _claim_job(db, job: DeletionJob, snapshot) -> bool:
+    """
+    Nhận job cho worker này. False nếu worker khác đang chạy job (heartbeat còn
+    mới) hoặc vừa nhận job trước (document đã đổi kể từ lúc đọc).
+    """
+    job_ref = db.collection(JOBS_COLLECTION).document(job.uid)
+    try:
+        if not snapshot.exists:
+            job_ref.create(job.to_dict())
+            return True
+        data = snapshot.to_dict()
+        if data.get("status") == "running" and data.get("owner") != WORKER_ID and not _is_stale(data):
+            return False
+        job_ref.update(job.to_dict(), option=db.write_option(last_update_time=snapshot.update_time))
+        return True
+    except Exception as e:
+        logger.info(f"Deletion job {job.uid} claimed by another worker: {str(e)}")
+        return False
+
+
+def _save_job(db, job: DeletionJob):
+    job.updated_at = datetime.now()
+    job.heartbeat = time.time()
+    try:
+        db.collection(JOBS_COLLECTION).document(job.uid).set(job.to_dict())
+    except Exception as e:
+        # Mất bản ghi tiến độ không làm dừng việc xóa
+        logger.warning(f"Error saving deletion job {job.uid}: {str(e)}")
+
+
+def _run_job(job: DeletionJob):
+    db = initialize_firestore()
+    try:
+        if job.email is None:
+            # Job chạy tiếp sau khi worker khởi động lại: email lấy từ document user
+            # (chỉ bị xóa ở bước cuối cùng)
+            user = db.collection("users").document(job.uid).get(field_paths=["email"])
+            job.email = (user.to_dict() or {}).get("email") if user.exists else None
+
+        def progress(counts):
+            job.deleted = Counter(counts)
+            _save_job(db, job)
+
+        job.deleted = clear_user_data(db, job.uid, on_progress=progress)
+        if job.delete_account:
+            db.collection("users").document(job.uid).delete()
+            job.deleted["users"] += 1
+        job.status = "done"
+        logger.info(f"Deleted data of user {job.uid}: {dict(job.deleted)}")
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.error(f"Error deleting data of user {job.uid}: {str(e)}")
+    finally:
+        job.finished_at = datetime.now()
+        _save_job(db, job)
+        if job.delete_account:
+            invalidate_user(email=job.email, uid=job.uid)
+        else:
+            # Session cache của các worker khác đọc lại lịch sử (đã trống)
+            try:
+                reset_chat_session(db.collection("users").document(job.uid), job.email)
+            except Exception as e:
+                logger.warning(f"Error resetting chat session of {job.uid}: {str(e)}")
+        with _running_lock:
+            _running.pop(job.uid, None)
+
+
+def start_user_deletion(uid: str, email: str = None, delete_account: bool = False, snapshot=None) -> dict:
+    """
+    Bắt đầu (hoặc chạy tiếp) việc xóa dữ liệu của user ở luồng nền.
+
+    Args:
+        delete_account: xóa cả document user (khi tài khoản bị xóa)
+        snapshot: document deletion_jobs/{uid} vừa đọc (mặc định: đọc lại)
+
+    Returns:
+        dict: trạng thái job (job đang chạy trong worker này hoặc worker khác thì trả về job đó)
+    """
+    with _running_lock:
+        job = _running.get(uid)
+        if job is not None:
+            job.delete_account = job.delete_account or delete_account
+            return job.to_dict()
+        job = DeletionJob(uid, email, delete_account)
+        _running[uid] = job
+    # Ngừng dùng lịch sử đã nhớ ngay, không chờ xóa xong
+    if email:
+        invalidate_session(email)
+    try:
+        db = initialize_firestore()
+        if snapshot is None:
+            snapshot = db.collection(JOBS_COLLECTION).document(uid).get()
+        if snapshot.exists and (snapshot.to_dict() or {}).get("status") == "running":
+            job.delete_account = job.delete_account or snapshot.to_dict().get("delete_account", False)
+        claimed = _claim_job(db, job, snapshot)
+    except Exception:
+        with _running_lock:
+            _running.pop(uid, None)
+        raise
+    if not claimed:
+        with _running_lock:
+            _running.pop(uid, None)
+        current = db.collection(JOBS_COLLECTION).document(uid).get()
+        return current.to_dict() if current.exists else job.to_dict()
+    _executor.submit(_run_job, job)
+    return job.to_dict()
+
+
+def get_deletion_status(uid: str):
+    """Tiến độ xóa dữ liệu của user (từ worker này hoặc deletion_jobs), None nếu chưa từng xóa"""
+    with _running_lock:
+        job = _running.get(uid)
+        if job is not None:
+            return job.to_dict()
+    snapshot = initialize_firestore().collection(JOBS_COLLECTION).document(uid).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def resume_deletion_jobs() -> int:
+    """Chạy tiếp các job running đã mất heartbeat (worker chạy job tắt giữa chừng)"""
+    db = initialize_firestore()
+    resumed = 0
+    for snapshot in db.collection(JOBS_COLLECTION).where("status", "==", "running").get():
+        data = snapshot.to_dict()
+        if not _is_stale(data):
+            # Worker khác vẫn đang chạy job này
+            continue
+        job = start_user_deletion(snapshot.id, None, data.get("delete_account", False), snapshot=snapshot)
+        if job.get("owner") == WORKER_ID:
+            resumed += 1
+    if resumed:
+        logger.info(f"Resumed {resumed} deletion jobs")
+    return resumed
@@ -1,13 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
+import os
+import secrets
+import string
 from .firebase import initialize_firestore
+from .pagination import finish_page, page_query
+from .user_cache import resolve_user_ref
+from .session_cache import (
+    SESSION_CACHE_ENABLED, VERIFY_VERSION, invalidate_session, new_chat_version, record_chat_turn, session_cache
+)
 from firebase_admin import firestore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def save_chat(email, message, response, source_documents=None):
+# Các trường đầu mục chat cho danh sách chat (không gồm recentMessages)
+CHAT_HEADER_FIELDS = [
+    'firstMessage', 'title', 'hasCustomTitle', 'timestamp', 'createdAt', 'archived', 'status', 'archivedAt',
+    'lastMessage', 'lastMessageTime', 'userId'
+]
+# Các trường của tin nhắn mà lịch sử hội thoại cho chatbot cần (sorted_history, extract_last_subject)
+HISTORY_MESSAGE_FIELDS = ['role', 'content', 'timestamp']
+# Số truy vấn messages chạy song song khi chat cũ chưa có recentMessages
+HISTORY_FETCH_WORKERS = int(os.getenv("HISTORY_FETCH_WORKERS", "8"))
+_history_executor = ThreadPoolExecutor(max_workers=HISTORY_FETCH_WORKERS, thread_name_prefix="chat-history")
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+
+def new_turn_ids():
+    """Id (kiểu auto-id của Firestore) của chat document và hai tin nhắn của một lượt"""
+    return tuple(''.join(secrets.choice(_ID_ALPHABET) for _ in range(20)) for _ in range(3))
+
+def add_chat_turn(batch, user_ref, email, message, response, source_documents=None, timestamp=None, version=None,
+                  ids=None):
+    """
+    Thêm các lệnh ghi của một lượt hỏi-đáp (chat document + 2 tin nhắn) vào WriteBatch.
+
+    Id của document được sinh phía client nên cả lượt nằm gọn trong một batch
+    (ghi nguyên tử, một round trip) thay vì ba lần add tuần tự. version (nếu có)
+    được ghi vào trường chatVersion của document user cho session cache.
+
+    Args:
+        ids: (chat, tin nhắn user, tin nhắn bot) từ new_turn_ids(); người gọi thử
+            lại commit phải dùng lại cùng ids để lần thử lại chỉ ghi đè (set) chính
+            các document đó, không tạo bản sao khi lần trước thực ra đã được ghi
+
+    Returns:
+        str: ID của chat document
+    """
+    timestamp = timestamp or datetime.now()
+    chat_id, user_message_id, bot_message_id = ids or new_turn_ids()
+    chat_ref = user_ref.collection('chats').document(chat_id)
+    batch.set(chat_ref, {
+        'email': email,
+        'firstMessage': message,  # Lưu tin nhắn đầu tiên riêng để dễ phân tích
+        'timestamp': timestamp,
+        'createdAt': timestamp.isoformat(),
+        # Bản sao gọn của hai tin nhắn để đọc lịch sử hội thoại chỉ bằng một truy vấn
+        'recentMessages': [
+            {'role': 'user', 'content': message},
+            {'role': 'assistant', 'content': response},
+        ]
+    })
+    # Tin nhắn của user
+    batch.set(chat_ref.collection('messages').document(user_message_id), {
+        'content': message,
+        'role': 'user',
+        'timestamp': timestamp
+    })
+    # Phản hồi của bot
+    batch.set(chat_ref.collection('messages').document(bot_message_id), {
+        'content': response,
+        'role': 'assistant',
+        'timestamp': timestamp,
+        'sourceDocuments': source_documents or []
+    })
+    if version:
+        batch.set(user_ref, {'chatVersion': version}, merge=True)
+    return chat_ref.id
+
+# Số lệnh ghi tối đa của một lượt hỏi-đáp trong batch (gồm chatVersion)
+WRITES_PER_TURN = 4
+
+def save_chat(email, message, response, source_documents=None, timestamp=None):
     """
     Lưu tin nhắn chat vào database với cấu trúc mới
     
@@ -16,54 +93,29 @@ def save_chat(email, message, response, source_documents=None):
         message (str): Tin nhắn của người dùng
         response (str): Phản hồi từ bot
         source_documents (list): Danh sách tài liệu nguồn
+        timestamp (datetime): Thời điểm của lượt hỏi (mặc định: lúc ghi)
     """
     try:
         db = initialize_firestore()
         logger.info(f"Saving chat for email: {email}")
         
-        # Tạo timestamp chung cho toàn bộ chat
-        timestamp = datetime.now()
-        
-        # Tìm user document dựa trên email
-        users_ref = db.collection('users')
-        user_query = users_ref.where('email', '==', email).limit(1).get()
+        # Tìm user document dựa trên email (qua cache email -> reference)
+        user_ref = resolve_user_ref(db, email)
         
-        if not user_query:
+        if user_ref is None:
             logger.warning(f"No user found for email: {email}")
             return None
             
-        for user_doc in user_query:
-            # Tạo chat document mới
-            chat_data = {
-                'email': email,
-                'firstMessage': message,  # Lưu tin nhắn đầu tiên riêng để dễ phân tích
-                'timestamp': timestamp,
-                'createdAt': timestamp.isoformat()
-            }
-            
-            # Lưu chat document
-            chat_ref = user_doc.reference.collection('chats').add(chat_data)
-            chat_id = chat_ref[1].id
-            
-            # Lưu tin nhắn của user
-            user_message = {
-                'content': message,
-                'role': 'user',
-                'timestamp': timestamp
-            }
-            chat_ref[1].collection('messages').add(user_message)
-            
-            # Lưu phản hồi của bot
-            bot_message = {
-                'content': response,
-                'role': 'assistant',
-                'timestamp': timestamp,
-                'sourceDocuments': source_documents or []
-            }
-            chat_ref[1].collection('messages').add(bot_message)
-            
-            logger.info(f"Saved chat with ID: {chat_id}")
-            return chat_id
+        # Chat document và hai tin nhắn được ghi nguyên tử trong một batch
+        timestamp = timestamp or datetime.now()
+        version = new_chat_version()
+        batch = db.batch()
+        chat_id = add_chat_turn(batch, user_ref, email, message, response, source_documents, timestamp, version)
+        batch.commit()
+        record_chat_turn(email, message, response, timestamp, version)
+        
+        logger.info(f"Saved chat with ID: {chat_id}")
+        return chat_id
         
     except Exception as e:
         logger.error(f"Error saving chat: {str(e)}")
@@ -84,37 +136,27 @@ def get_chat_history(email, limit=200):
         db = initialize_firestore()
         logger.info(f"Getting chat history for email: {email}")
         
-        # Tìm user document dựa trên email
-        users_ref = db.collection('users')
-        user_query = users_ref.where('email', '==', email).limit(1).get()
+        # Tìm user document dựa trên email (qua cache email -> reference)
+        user_ref = resolve_user_ref(db, email)
         
         chat_history = []
         
-        if not user_query:
+        if user_ref is None:
             logger.warning(f"No user found for email: {email}")
             return []
             
-        for user_doc in user_query:
-            # Lấy từ subcollection chats của user
-            chats_ref = user_doc.reference.collection('chats')
-            chats_query = chats_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit).get()
-            
-            for chat in chats_query:
-                chat_data = chat.to_dict()
-                chat_data['id'] = chat.id
-                
-                # Lấy tất cả messages của chat này
-                messages_ref = chat.reference.collection('messages')
-                messages_query = messages_ref.order_by('timestamp').get()
-                
-                messages = []
-                for message in messages_query:
-                    message_data = message.to_dict()
-                    message_data['id'] = message.id
-                    messages.append(message_data)
-                
-                chat_data['messages'] = messages
-                chat_history.append(chat_data)
+        # Lấy từ subcollection chats của user
+        chats_ref = user_ref.collection('chats')
+        chats = list(chats_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit).get())
+        
+        # Messages của các chat được lấy song song thay vì lần lượt từng chat
+        messages_by_chat = _history_executor.map(_get_messages, [chat.reference for chat in chats])
+        for chat, messages in zip(chats, messages_by_chat):
+            chat_data = chat.to_dict()
+            chat_data['id'] = chat.id
+            chat_data.pop('recentMessages', None)
+            chat_data['messages'] = messages
+            chat_history.append(chat_data)
                     
         return chat_history
         
@@ -122,6 +164,110 @@ def get_chat_history(email, limit=200):
         logger.error(f"Error getting chat history: {str(e)}")
         raise
 
+def _get_messages(chat_ref, fields=None):
+    """Tất cả messages của một chat theo thứ tự thời gian"""
+    messages_query = chat_ref.collection('messages')
+    if fields:
+        messages_query = messages_query.select(fields)
+    messages = []
+    for message in messages_query.order_by('timestamp').get():
+        message_data = message.to_dict()
+        message_data['id'] = message.id
+        messages.append(message_data)
+    return messages
+
+def get_recent_history(email, limit=5):
+    """
+    Lịch sử hội thoại gần đây cho chatbot (chỉ role, content, timestamp của tin nhắn).
+
+    Chat được ghi từ khi có trường recentMessages chứa sẵn hai tin nhắn của lượt,
+    nên cả lịch sử chỉ cần một truy vấn chats (cùng truy vấn tìm user, thường
+    đã có trong cache) thay vì thêm một truy vấn messages cho mỗi chat. Chat cũ
+    chưa có trường này thì messages được lấy song song.
+
+    Args:
+        email (str): Email của người dùng
+        limit (int): Số lượt hỏi-đáp gần nhất cần lấy
+
+    Returns:
+        list: Các chat (mới nhất trước), mỗi chat có danh sách 'messages'
+    """
+    try:
+        db = initialize_firestore()
+        user_ref = resolve_user_ref(db, email)
+        if user_ref is None:
+            logger.warning(f"No user found for email: {email}")
+            return []
+
+        chats_query = user_ref.collection('chats').select(['timestamp', 'recentMessages'])
+        chats = list(chats_query.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit).get())
+
+        chat_history = []
+        legacy = []
+        for chat in chats:
+            chat_data = chat.to_dict()
+            chat_data['id'] = chat.id
+            recent_messages = chat_data.pop('recentMessages', None)
+            if recent_messages is None:
+                legacy.append((chat_data, chat.reference))
+            else:
+                chat_data['messages'] = [
+                    {**message, 'timestamp': chat_data.get('timestamp')} for message in recent_messages
+                ]
+            chat_history.append(chat_data)
+
+        if legacy:
+            fetched = _history_executor.map(
+                lambda chat_ref: _get_messages(chat_ref, HISTORY_MESSAGE_FIELDS), [ref for _, ref in legacy]
+            )
+            for (chat_data, _), messages in zip(legacy, fetched):
+                chat_data['messages'] = messages
+        return chat_history
+
+    except Exception as e:
+        logger.error(f"Error getting recent history: {str(e)}")
+        raise
+
+def load_session_history(email, limit=5):
+    """
+    Lịch sử hội thoại cho chatbot qua session cache (xem database/session_cache.py).
+
+    Ở chế độ "version" cache chỉ được dùng khi trường chatVersion của document
+    user khớp với mã worker này đã biết (một lần đọc document thay vì truy vấn
+    lịch sử). Ở chế độ "sticky" người gọi tra session_cache.get trước, không cần
+    executor; hàm này chỉ được gọi khi cache miss.
+    """
+    if not SESSION_CACHE_ENABLED:
+        return get_recent_history(email, limit)
+
+    version = None
+    if VERIFY_VERSION:
+        db = initialize_firestore()
+        user_ref = resolve_user_ref(db, email)
+        if user_ref is None:
+            logger.warning(f"No user found for email: {email}")
+            return []
+        snapshot = user_ref.get(field_paths=['chatVersion'])
+        version = snapshot.get('chatVersion') if snapshot.exists else None
+        cached = session_cache.get(email, limit, version, check_version=True)
+        if cached is not None:
+            return cached
+
+    # Đọc phiên bản trước lịch sử: lượt ghi xen giữa chỉ làm lần sau phải đọc lại
+    chat_history = get_recent_history(email, limit)
+    session_cache.store(email, chat_history, limit, version)
+    return chat_history
+
+def reset_chat_session(user_ref, email):
+    """
+    Lịch sử chat của user vừa bị xóa: bỏ session cache ở worker này và đổi
+    chatVersion để session cache ở các worker khác đọc lại từ Firestore.
+    """
+    invalidate_session(email)
+    version = new_chat_version()
+    if version:
+        user_ref.set({'chatVersion': version}, merge=True)
+
 def clear_chat_history(email):
     """
     Xóa lịch sử chat của người dùng
@@ -129,21 +275,22 @@ def clear_chat_history(email):
     Args:
         email (str): Email của người dùng
     """
+    from .bulk_delete import delete_documents
+
     try:
         db = initialize_firestore()
         
-        # Lấy reference đến collection chats của user
-        user_ref = db.collection('users').document(email)
-        chats_ref = user_ref.collection('chats')
-        
-        # Lấy tất cả documents trong collection chats
-        chats = chats_ref.get()
+        # Document user có id là uid, tìm theo email (qua cache email -> reference)
+        user_ref = resolve_user_ref(db, email)
+        if user_ref is None:
+            logger.warning(f"No user found for email: {email}")
+            return
         
-        # Xóa từng document
-        for chat in chats:
-            chat.reference.delete()
+        # Xóa các chat cùng subcollection messages qua BulkWriter
+        deleted = delete_documents(db, user_ref.collection('chats').recursive())
             
-        logger.info(f"Đã xóa lịch sử chat của user {email}")
+        reset_chat_session(user_ref, email)
+        logger.info(f"Đã xóa lịch sử chat của user {email}: {dict(deleted)}")
         
     except Exception as e:
         logger.error(f"Lỗi khi xóa lịch sử chat: {str(e)}")
@@ -186,16 +333,14 @@ def archive_chat(email, chat_id):
     """
     try:
         db = initialize_firestore()
-        users_ref = db.collection('users')
-        user_query = users_ref.where('email', '==', email).limit(1).get()
-        if not user_query:
+        user_ref = resolve_user_ref(db, email)
+        if user_ref is None:
             logger.warning(f"No user found for email: {email}")
             return False
-        for user_doc in user_query:
-            chat_ref = user_doc.reference.collection('chats').document(chat_id)
-            chat_ref.update({'archived': True, 'archivedAt': datetime.now().isoformat()})
-            logger.info(f"Archived chat {chat_id} for user {email}")
-            return True
+        chat_ref = user_ref.collection('chats').document(chat_id)
+        chat_ref.update({'archived': True, 'archivedAt': datetime.now().isoformat()})
+        logger.info(f"Archived chat {chat_id} for user {email}")
+        return True
     except Exception as e:
         logger.error(f"Error archiving chat: {str(e)}")
         raise
@@ -207,41 +352,39 @@ def unarchive_chat(email, chat_id):
     """
     try:
         db = initialize_firestore()
-        users_ref = db.collection('users')
-        user_query = users_ref.where('email', '==', email).limit(1).get()
-        if not user_query:
+        user_ref = resolve_user_ref(db, email)
+        if user_ref is None:
             logger.warning(f"No user found for email: {email}")
             return False
-        for user_doc in user_query:
-            chat_ref = user_doc.reference.collection('chats').document(chat_id)
-            chat_ref.update({'archived': False, 'archivedAt': firestore.DELETE_FIELD})
-            logger.info(f"Unarchived chat {chat_id} for user {email}")
-            return True
+        chat_ref = user_ref.collection('chats').document(chat_id)
+        chat_ref.update({'archived': False, 'archivedAt': firestore.DELETE_FIELD})
+        logger.info(f"Unarchived chat {chat_id} for user {email}")
+        return True
     except Exception as e:
         logger.error(f"Error unarchiving chat: {str(e)}")
         raise
 
 
-def get_archived_chats(email, limit=100):
+def get_archived_chats(email, limit=20, cursor=None):
     """
-    Lấy danh sách các đoạn chat đã lưu trữ (archived=True)
+    Lấy một trang các đoạn chat đã lưu trữ (archived=True), mới lưu trữ nhất trước
+
+    Returns:
+        tuple: (danh sách chat, cursor của trang sau hoặc None)
     """
     try:
         db = initialize_firestore()
-        users_ref = db.collection('users')
-        user_query = users_ref.where('email', '==', email).limit(1).get()
+        user_ref = resolve_user_ref(db, email)
         archived_chats = []
-        if not user_query:
+        if user_ref is None:
             logger.warning(f"No user found for email: {email}")
-            return []
-        for user_doc in user_query:
-            chats_ref = user_doc.reference.collection('chats')
-            chats_query = chats_ref.where('archived', '==', True).order_by('archivedAt', direction=firestore.Query.DESCENDING).limit(limit).get()
-            for chat in chats_query:
-                chat_data = chat.to_dict()
-                chat_data['id'] = chat.id
-                archived_chats.append(chat_data)
-        return archived_chats
+            return [], None
+        chats_query = user_ref.collection('chats').where('archived', '==', True).select(CHAT_HEADER_FIELDS)
+        for chat in page_query(chats_query, 'archivedAt', limit, cursor).get():
+            chat_data = chat.to_dict()
+            chat_data['id'] = chat.id
+            archived_chats.append(chat_data)
+        return finish_page(archived_chats, 'archivedAt', limit)
     except Exception as e:
         logger.error(f"Error getting archived chats: {str(e)}")
         raise 
\ No newline at end of file
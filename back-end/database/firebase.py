@@ -2,25 +2,58 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 import logging
 import os
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SERVICE_ACCOUNT_PATH = os.getenv(
+    "FIREBASE_SERVICE_ACCOUNT",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serviceAccountKey.json"),
+)
+
+# Client Firestore dùng chung của tiến trình (một pool kết nối gRPC)
+_client = None
+_client_lock = threading.Lock()
+
+# Client thay thế Firebase thật (ví dụ Firestore giả lập của bộ load-test)
+_client_override = None
+
+def use_firestore_client(client):
+    """Cho mọi hàm trong package database dùng client này thay vì Firebase thật"""
+    global _client_override
+    _client_override = client
+
+def initialize_firebase_app():
+    """Khởi tạo Firebase Admin SDK một lần cho cả tiến trình (main, phantich, ...)"""
+    if firebase_admin._apps:
+        return
+    if not os.path.exists(SERVICE_ACCOUNT_PATH):
+        logger.error(f"Không tìm thấy file service account key: {SERVICE_ACCOUNT_PATH}")
+        raise FileNotFoundError("Service account key not found")
+    cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
+    firebase_admin.initialize_app(cred)
+    logger.info("Firebase Admin đã được khởi tạo thành công")
+
 def initialize_firestore():
-    try:
-        current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        service_account_path = os.path.join(current_dir, "serviceAccountKey.json")
-        
-        if not os.path.exists(service_account_path):
-            logger.error(f"Không tìm thấy file service account key: {service_account_path}")
-            raise FileNotFoundError("Service account key not found")
-            
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(service_account_path)
-            firebase_admin.initialize_app(cred)
-        logger.info("Firebase Admin đã được khởi tạo thành công")
-        return firestore.client()
-    except Exception as e:
-        logger.error(f"Lỗi khi khởi tạo Firebase Admin: {str(e)}")
-        raise 
\ No newline at end of file
+    """
+    Client Firestore dùng chung.
+
+    Lần gọi đầu (lifespan của app) khởi tạo Firebase Admin và tạo client; các
+    lần sau trả về ngay client đó, không đọc lại file service account hay ghi log.
+    """
+    global _client
+    if _client_override is not None:
+        return _client_override
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            try:
+                initialize_firebase_app()
+                _client = firestore.client()
+            except Exception as e:
+                logger.error(f"Lỗi khi khởi tạo Firebase Admin: {str(e)}")
+                raise
+    return _client
@@ -0,0 +1,102 @@
+"""
+Phân trang theo cursor cho các danh sách chat và tin nhắn.
+
+Mỗi trang là một truy vấn sắp xếp theo (trường thời gian, id document) và bắt đầu
+sau cursor (start_after), nên trang sau chỉ đọc đúng số document của trang đó
+thay vì đọc lại từ đầu như offset. id được dùng để phân định các document trùng
+thời gian (hai tin nhắn của một lượt có cùng timestamp).
+
+Cursor trả cho client là chuỗi base64 mờ chứa giá trị trường thời gian và id của
+document cuối trang. Danh sách nằm sẵn trong một document (mảng messages của chat
+do giao diện web tạo) được cắt trang trong bộ nhớ, cursor khi đó là vị trí.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import datetime
+
+from firebase_admin import firestore
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+
+
+def clamp_page_size(limit) -> int:
+    if not limit:
+        return PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def _encode(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(payload, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return payload
+
+
+def encode_cursor(value, doc_id: str) -> str:
+    if isinstance(value, datetime):
+        return _encode({"dt": value.isoformat(), "id": doc_id})
+    return _encode({"v": value, "id": doc_id})
+
+
+def decode_cursor(cursor: str, order_field: str) -> dict:
+    """Giá trị start_after ({order_field: ..., "__name__": id}); ValueError nếu cursor hỏng"""
+    payload = _decode(cursor)
+    try:
+        value = datetime.fromisoformat(payload["dt"]) if "dt" in payload else payload["v"]
+        return {order_field: value, "__name__": payload["id"]}
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def decode_offset_cursor(cursor: str):
+    """Vị trí trong cursor của page_list, None nếu là cursor của truy vấn"""
+    offset = _decode(cursor).get("o")
+    if offset is not None and (not isinstance(offset, int) or offset < 0):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return offset
+
+
+def page_query(query, order_field: str, limit: int, cursor: str = None, descending: bool = True):
+    """Truy vấn một trang (lấy thừa một document để biết còn trang sau)"""
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    query = query.order_by(order_field, direction=direction).order_by("__name__", direction=direction)
+    if cursor:
+        query = query.start_after(decode_cursor(cursor, order_field))
+    return query.limit(limit + 1)
+
+
+def page_list(items: list, offset: int, limit: int):
+    """Một trang của danh sách trong bộ nhớ: (items của trang, next_cursor hoặc None)"""
+    end = offset + limit
+    return items[offset:end], _encode({"o": end}) if end < len(items) else None
+
+
+def finish_page(items: list, order_field: str, limit: int, has_more: bool = None):
+    """
+    Cắt trang và tạo cursor cho trang sau.
+
+    Args:
+        items: các document (dict có 'id') theo đúng thứ tự của trang, có thể dư
+        has_more: đã biết còn trang sau hay chưa (mặc định: items dài hơn limit)
+
+    Returns:
+        tuple: (items của trang, next_cursor hoặc None nếu là trang cuối)
+    """
+    if has_more is None:
+        has_more = len(items) > limit
+    items = items[:limit]
+    if not has_more or not items:
+        return items, None
+    last = items[-1]
+    return items, encode_cursor(last.get(order_field), last["id"])
@@ -0,0 +1,172 @@
+"""
+Cache lịch sử hội thoại gần đây của từng người dùng trong tiến trình.
+
+Mỗi câu hỏi ask_stream đọc lại 5 lượt gần nhất của người hỏi từ Firestore,
+dù chính worker này vừa ghi các lượt đó vài giây trước. Ở đây lịch sử được nhớ
+theo email (LRU trên các người dùng đang hoạt động, hết hạn khi không dùng quá
+SESSION_CACHE_IDLE_SECONDS) và được cập nhật ngay khi một lượt được ghi (save_chat
+hoặc lúc vào hàng đợi write-behind), nên Firestore chỉ bị đọc khi cache miss.
+
+Nhất quán khi chạy nhiều worker (SESSION_CACHE_CONSISTENCY):
+- "version" (mặc định): mỗi lượt ghi đặt một mã phiên bản mới vào trường
+  chatVersion của document user (trong cùng batch với lượt chat). Trước khi dùng
+  cache, worker đọc riêng trường này (một lần đọc document, thay vì truy vấn
+  chats và messages); mã không phải do worker này ghi hoặc đã thấy nghĩa là
+  worker khác vừa ghi, khi đó lịch sử được đọc lại.
+- "sticky": tin cache đến khi hết hạn, không đọc Firestore. Chỉ dùng khi load
+  balancer luôn đưa một người dùng về cùng một worker (sticky session theo
+  email/token); nếu không, lượt hỏi ở worker khác có thể vắng trong lịch sử
+  đến khi mục cache hết hạn.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+SESSION_CACHE_ENABLED = os.getenv("SESSION_CACHE_ENABLED", "1") == "1"
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "5000"))
+SESSION_CACHE_IDLE_SECONDS = float(os.getenv("SESSION_CACHE_IDLE_SECONDS", "1800"))
+# Số lượt gần nhất được giữ cho mỗi người dùng (load_chat_history dùng 5)
+SESSION_CACHE_TURNS = int(os.getenv("SESSION_CACHE_TURNS", "5"))
+SESSION_CACHE_CONSISTENCY = os.getenv("SESSION_CACHE_CONSISTENCY", "version")
+VERIFY_VERSION = SESSION_CACHE_CONSISTENCY == "version"
+# Số mã phiên bản do worker này ghi được nhớ cho mỗi người dùng (các lượt còn chờ ghi)
+_KNOWN_VERSIONS = 8
+
+
+def new_chat_version():
+    """Mã phiên bản cho một lượt ghi, None nếu không dùng kiểm tra phiên bản"""
+    return uuid.uuid4().hex[:16] if SESSION_CACHE_ENABLED and VERIFY_VERSION else None
+
+
+class _Session:
+    __slots__ = ("history", "complete", "versions", "last_used")
+
+    def __init__(self, history, complete, version):
+        # Các lượt gần nhất, mới nhất trước (cùng dạng với get_recent_history)
+        self.history = history
+        # Người dùng có ít lượt hơn số lượt được giữ: lịch sử là đầy đủ
+        self.complete = complete
+        # Mã chatVersion lúc đọc và các mã do worker này ghi
+        self.versions = deque([version], maxlen=_KNOWN_VERSIONS)
+        self.last_used = time.monotonic()
+
+
+class SessionCache:
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE, idle_ttl: float = SESSION_CACHE_IDLE_SECONDS,
+                 max_turns: int = SESSION_CACHE_TURNS):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+        self.turns_recorded = 0
+
+    def _live(self, email: str):
+        session = self._sessions.get(email)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_used > self.idle_ttl:
+            del self._sessions[email]
+            self.expired += 1
+            return None
+        return session
+
+    def get(self, email: str, limit: int, version=None, check_version: bool = False):
+        """
+        Lịch sử đã nhớ (limit lượt gần nhất), None nếu cache miss.
+
+        check_version: so mã chatVersion đọc từ Firestore với các mã đã biết
+        """
+        with self._lock:
+            session = self._live(email)
+            if session is None or (len(session.history) < limit and not session.complete):
+                self.misses += 1
+                return None
+            if check_version and version not in session.versions:
+                # Worker khác đã ghi lượt mới
+                del self._sessions[email]
+                self.stale += 1
+                self.misses += 1
+                return None
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(email)
+            self.hits += 1
+            return list(session.history[:limit])
+
+    def store(self, email: str, history: list, limit: int, version=None):
+        """Ghi nhớ lịch sử vừa đọc từ Firestore (limit là số lượt đã yêu cầu)"""
+        with self._lock:
+            self._sessions[email] = _Session(list(history[:self.max_turns]), len(history) < limit, version)
+            self._sessions.move_to_end(email)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def record_turn(self, email: str, message: str, response: str, timestamp, version=None):
+        """Thêm lượt vừa ghi vào lịch sử đã nhớ (người dùng chưa có trong cache thì bỏ qua)"""
+        with self._lock:
+            session = self._live(email)
+            if session is None:
+                return
+            turn = {
+                'timestamp': timestamp,
+                'messages': [
+                    {'role': 'user', 'content': message, 'timestamp': timestamp},
+                    {'role': 'assistant', 'content': response, 'timestamp': timestamp},
+                ],
+            }
+            session.history = [turn] + session.history[:self.max_turns - 1]
+            if len(session.history) >= self.max_turns:
+                session.complete = False
+            session.versions.append(version)
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(email)
+            self.turns_recorded += 1
+
+    def invalidate(self, email: str):
+        with self._lock:
+            self._sessions.pop(email, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": SESSION_CACHE_ENABLED,
+                "consistency": SESSION_CACHE_CONSISTENCY,
+                "size": len(self._sessions),
+                "max_size": self.max_size,
+                "idle_ttl_seconds": self.idle_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stale": self.stale,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "turns_recorded": self.turns_recorded,
+            }
+
+
+session_cache = SessionCache()
+
+
+def record_chat_turn(email, message, response, timestamp, version=None):
+    if SESSION_CACHE_ENABLED:
+        session_cache.record_turn(email, message, response, timestamp, version)
+
+
+def invalidate_session(email: str):
+    session_cache.invalidate(email)
@@ -1,6 +1,8 @@
 from datetime import datetime
 import logging
 from .firebase import initialize_firestore
+from .user_cache import resolve_user_ref, user_ref_cache
+from .bulk_delete import delete_documents
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +31,8 @@ def get_user_info(email):
             return None
             
         for user_doc in user_query:
+            # Cần cả dữ liệu user nên vẫn truy vấn, nhưng nhớ lại reference cho các hàm khác
+            user_ref_cache.remember(email, user_doc.reference)
             user_data = user_doc.to_dict()
             user_data['id'] = user_doc.id
             
@@ -54,18 +58,16 @@ def update_user_info(email, user_data):
         db = initialize_firestore()
         logger.info(f"Updating user info for email: {email}")
         
-        # Tìm user document dựa trên email
-        users_ref = db.collection('users')
-        user_query = users_ref.where('email', '==', email).limit(1).get()
+        # Tìm user document dựa trên email (qua cache email -> reference)
+        user_ref = resolve_user_ref(db, email)
         
-        if not user_query:
+        if user_ref is None:
             logger.warning(f"No user found for email: {email}")
             return None
             
-        for user_doc in user_query:
-            # Cập nhật document
-            user_doc.reference.update(user_data)
-            logger.info(f"Updated user info for email: {email}")
+        # Cập nhật document
+        user_ref.update(user_data)
+        logger.info(f"Updated user info for email: {email}")
             
     except Exception as e:
         logger.error(f"Error updating user info: {str(e)}")
@@ -147,16 +149,9 @@ def clear_user_activities(user_id):
         db = initialize_firestore()
         logger.info(f"Clearing activities for user: {user_id}")
         
-        # Lấy reference đến collection activities của user
+        # Xóa các activity qua BulkWriter
         user_ref = db.collection('users').document(user_id)
-        activities_ref = user_ref.collection('activities')
-        
-        # Lấy tất cả documents trong collection activities
-        activities = activities_ref.get()
-        
-        # Xóa từng document
-        for activity in activities:
-            activity.reference.delete()
+        delete_documents(db, user_ref.collection('activities').recursive())
             
         logger.info(f"Cleared activities for user: {user_id}")
         
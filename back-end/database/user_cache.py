@@ -0,0 +1,145 @@
+"""
+Cache email -> reference của document user.
+
+Các hàm trong database/chat.py và database/user.py nhận email, nên trước mỗi
+thao tác đều phải chạy truy vấn where('email', '==', email).limit(1) để tìm
+document user: thêm một round trip Firestore cho mỗi lượt hỏi. Reference của
+một user không đổi trong suốt vòng đời tài khoản, nên được nhớ lại (LRU, có TTL)
+và chỉ truy vấn lại khi hết hạn hoặc khi tài khoản bị xóa.
+
+Document user có id là uid, nên từ uid dựng thẳng được reference; cache giữ thêm
+chiều uid -> email để xóa đúng mục khi chỉ biết uid (xóa tài khoản). Mỗi worker
+có cache riêng: xóa tài khoản ở worker khác thì mục ở đây chỉ hết hiệu lực khi
+hết TTL.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .session_cache import invalidate_session
+
+logger = logging.getLogger(__name__)
+
+USER_REF_CACHE_TTL_SECONDS = float(os.getenv("USER_REF_CACHE_TTL_SECONDS", "600"))
+USER_REF_CACHE_SIZE = int(os.getenv("USER_REF_CACHE_SIZE", "10000"))
+
+
+class UserRefCache:
+    def __init__(self, ttl: float = USER_REF_CACHE_TTL_SECONDS, max_size: int = USER_REF_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # email -> (reference, hạn dùng)
+        self._entries = OrderedDict()
+        self._email_by_uid = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, email: str):
+        """Reference đã nhớ của email, None nếu chưa có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                self.misses += 1
+                return None
+            reference, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._drop(email)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(email)
+            self.hits += 1
+            return reference
+
+    def remember(self, email: str, reference):
+        if not email or reference is None:
+            return
+        with self._lock:
+            if email in self._entries:
+                self._drop(email)
+            self._entries[email] = (reference, time.monotonic() + self.ttl)
+            self._email_by_uid[reference.id] = email
+            while len(self._entries) > self.max_size:
+                oldest, _ = next(iter(self._entries.items()))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, email: str):
+        reference, _ = self._entries.pop(email)
+        if self._email_by_uid.get(reference.id) == email:
+            del self._email_by_uid[reference.id]
+
+    def invalidate(self, email: str = None, uid: str = None):
+        """Xóa mục của một user (theo email và/hoặc uid), ví dụ khi tài khoản bị xóa"""
+        with self._lock:
+            emails = {email, self._email_by_uid.get(uid)} - {None}
+            for key in emails:
+                if key in self._entries:
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def email_for_uid(self, uid: str):
+        with self._lock:
+            return self._email_by_uid.get(uid)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._email_by_uid.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                # Mỗi lần trúng cache là một truy vấn where(email) không phải gửi tới Firestore
+                "firestore_reads_saved": self.hits,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+user_ref_cache = UserRefCache()
+
+
+def resolve_user_ref(db, email: str):
+    """
+    Reference của document user có email này.
+
+    Returns:
+        DocumentReference hoặc None nếu không có user (không cache kết quả rỗng,
+        để user vừa đăng ký được nhận ngay)
+    """
+    reference = user_ref_cache.get(email)
+    if reference is not None:
+        return reference
+    user_query = db.collection('users').where('email', '==', email).limit(1).get()
+    for user_doc in user_query:
+        user_ref_cache.remember(email, user_doc.reference)
+        return user_doc.reference
+    return None
+
+
+def user_ref_for_uid(db, uid: str):
+    """Document user có id là uid nên không cần truy vấn"""
+    return db.collection('users').document(uid)
+
+
+def invalidate_user(email: str = None, uid: str = None):
+    """Xóa user khỏi cache reference và session cache (tài khoản bị xóa)"""
+    email = email or user_ref_cache.email_for_uid(uid)
+    user_ref_cache.invalidate(email=email, uid=uid)
+    if email:
+        invalidate_session(email)
@@ -0,0 +1,275 @@
+"""
+Ghi lịch sử chat theo kiểu write-behind.
+
+save_chat trước đây chạy trong executor mặc định sau khi stream xong: một truy
+vấn tìm user rồi ba lần ghi tuần tự (chat document và hai messages.add), mỗi lượt
+chiếm một luồng executor suốt các round trip Firestore. Ở đây lượt hỏi-đáp chỉ
+được đưa vào hàng đợi (không chặn event loop); một luồng nền gom các lượt của
+nhiều người dùng thành WriteBatch (mỗi lượt gồm 3 lệnh ghi nằm trọn trong một
+batch nên vẫn nguyên tử), commit theo lô, thử lại với backoff khi lỗi và được
+flush hết khi worker tắt.
+
+Dữ liệu trong hàng đợi chỉ nằm trong bộ nhớ: nếu tiến trình bị kill cứng (không
+qua lifespan) thì các lượt chưa commit bị mất.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+from .firebase import initialize_firestore
+from .chat import WRITES_PER_TURN, add_chat_turn, new_turn_ids
+from .user_cache import resolve_user_ref
+from .session_cache import invalidate_session, new_chat_version, record_chat_turn
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "1") == "1"
+# Firestore giới hạn 500 lệnh ghi mỗi batch, mỗi lượt chiếm WRITES_PER_TURN lệnh
+CHAT_WRITE_BEHIND_MAX_TURNS = min(int(os.getenv("CHAT_WRITE_BEHIND_MAX_TURNS", "100")), 500 // WRITES_PER_TURN)
+# Chờ thêm một chút sau lượt đầu tiên để gom các lượt đến cùng lúc vào một lô
+CHAT_WRITE_BEHIND_LINGER_SECONDS = float(os.getenv("CHAT_WRITE_BEHIND_LINGER_SECONDS", "0.05"))
+# Hàng đợi đầy (Firestore chậm/lỗi kéo dài) thì lượt mới được ghi trực tiếp
+CHAT_WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("CHAT_WRITE_BEHIND_QUEUE_SIZE", "10000"))
+CHAT_WRITE_BEHIND_MAX_RETRIES = int(os.getenv("CHAT_WRITE_BEHIND_MAX_RETRIES", "5"))
+CHAT_WRITE_BEHIND_BACKOFF_SECONDS = float(os.getenv("CHAT_WRITE_BEHIND_BACKOFF_SECONDS", "0.5"))
+CHAT_WRITE_BEHIND_MAX_BACKOFF_SECONDS = float(os.getenv("CHAT_WRITE_BEHIND_MAX_BACKOFF_SECONDS", "30"))
+
+try:
+    from prometheus_client import Gauge
+
+    QUEUE_DEPTH = Gauge("chat_write_behind_queue_depth", "Số lượt chat đang chờ ghi vào Firestore")
+except ImportError:  # pragma: no cover - prometheus_client là tuỳ chọn
+    QUEUE_DEPTH = None
+
+# Đánh dấu dừng luồng ghi
+_STOP = object()
+
+
+class ChatWriteQueue:
+    def __init__(
+        self,
+        max_turns: int = CHAT_WRITE_BEHIND_MAX_TURNS,
+        linger: float = CHAT_WRITE_BEHIND_LINGER_SECONDS,
+        max_size: int = CHAT_WRITE_BEHIND_QUEUE_SIZE,
+        max_retries: int = CHAT_WRITE_BEHIND_MAX_RETRIES,
+    ):
+        self.max_turns = max_turns
+        self.linger = linger
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.enqueued = 0
+        self.rejected = 0
+        self.committed_turns = 0
+        self.commits = 0
+        self.retries = 0
+        self.failed = 0
+        self.skipped_no_user = 0
+        self.last_commit_seconds = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+                self._thread.start()
+
+    def submit(self, email, message, response, source_documents=None) -> bool:
+        """
+        Đưa một lượt hỏi-đáp vào hàng đợi ghi.
+
+        Returns:
+            bool: False nếu hàng đợi đã đóng hoặc đầy (người gọi tự ghi trực tiếp)
+        """
+        if self._closed:
+            return False
+        self._ensure_started()
+        # Thời điểm của lượt là lúc trả lời xong, không phải lúc được ghi
+        timestamp = datetime.now()
+        version = new_chat_version()
+        # Id sinh một lần khi vào hàng đợi: mọi lần thử lại ghi đè cùng các document
+        turn = (email, message, response, source_documents or [], timestamp, version, new_turn_ids())
+        try:
+            self._queue.put_nowait(turn)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        self._update_depth()
+        # Câu hỏi kế tiếp của người dùng thấy ngay lượt này dù chưa commit
+        record_chat_turn(email, message, response, timestamp, version)
+        return True
+
+    def _update_depth(self):
+        if QUEUE_DEPTH is not None:
+            QUEUE_DEPTH.set(self._queue.qsize())
+
+    def _next_group(self):
+        """Chờ lượt đầu tiên rồi gom thêm trong khoảng linger, tối đa max_turns lượt"""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        group = [first]
+        deadline = time.monotonic() + self.linger
+        while len(group) < self.max_turns:
+            try:
+                turn = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if turn is _STOP:
+                return group, True
+            group.append(turn)
+        return group, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            group, stop = self._next_group()
+            if group:
+                self._safe_write(group)
+            self._update_depth()
+        # Lượt vào hàng đợi sau tín hiệu dừng (đang submit dở lúc tắt)
+        leftovers = []
+        while True:
+            try:
+                turn = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if turn is not _STOP:
+                leftovers.append(turn)
+        for start in range(0, len(leftovers), self.max_turns):
+            self._safe_write(leftovers[start:start + self.max_turns])
+        self._update_depth()
+
+    def _safe_write(self, group):
+        try:
+            self._write_group(group)
+        except Exception as e:
+            # Không để luồng ghi chết: các lượt còn lại trong hàng đợi vẫn phải được ghi
+            self.failed += len(group)
+            logger.error(f"Error writing chat group: {str(e)}")
+            self._forget_dropped(turn[0] for turn in group)
+
+    def _forget_dropped(self, emails):
+        """Bỏ phiên trong cache của các lượt không bao giờ được ghi.
+
+        submit() đã ghi lượt vào session cache lúc vào hàng đợi; lượt bị bỏ hẳn
+        thì phiên phải được đọc lại từ Firestore, nếu không lịch sử trong cache
+        còn một lượt mà Firestore không có.
+        """
+        for email in set(emails):
+            invalidate_session(email)
+
+    def _write_group(self, group):
+        db = initialize_firestore()
+        turns = []
+        for email, message, response, source_documents, timestamp, version, ids in group:
+            try:
+                user_ref = resolve_user_ref(db, email)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error resolving user {email} for chat write: {str(e)}")
+                self._forget_dropped([email])
+                continue
+            if user_ref is None:
+                self.skipped_no_user += 1
+                logger.warning(f"No user found for email: {email}")
+                self._forget_dropped([email])
+                continue
+            turns.append([user_ref, email, message, response, source_documents, timestamp, version, ids])
+        if not turns:
+            return
+        # Mỗi document chỉ ghi một lần trong batch: chatVersion của một người dùng
+        # lấy theo lượt cuối cùng của người đó trong lô
+        seen = set()
+        for turn in reversed(turns):
+            if turn[1] in seen:
+                turn[6] = None
+            seen.add(turn[1])
+
+        if self._commit_with_retry(db, turns):
+            return
+        # Cả lô vẫn lỗi sau khi thử lại: ghi từng lượt để một lượt hỏng
+        # (ví dụ document quá lớn) không kéo theo các lượt khác
+        for turn in turns:
+            if not self._commit_with_retry(db, [turn], retries=1):
+                self.failed += 1
+                logger.error(f"Dropped chat turn for {turn[1]} after retries")
+                self._forget_dropped([turn[1]])
+
+    def _commit_with_retry(self, db, turns, retries: int = None) -> bool:
+        retries = self.max_retries if retries is None else retries
+        delay = CHAT_WRITE_BEHIND_BACKOFF_SECONDS
+        for attempt in range(retries + 1):
+            try:
+                started = time.perf_counter()
+                batch = db.batch()
+                for turn in turns:
+                    add_chat_turn(batch, *turn)
+                batch.commit()
+                self.last_commit_seconds = round(time.perf_counter() - started, 4)
+                self.commits += 1
+                self.committed_turns += len(turns)
+                return True
+            except Exception as e:
+                logger.warning(f"Chat batch commit failed ({len(turns)} turns, attempt {attempt + 1}): {str(e)}")
+                if attempt == retries:
+                    return False
+                self.retries += 1
+                # Backoff lũy thừa có jitter, đang tắt thì không chờ lâu
+                time.sleep(random.uniform(0, delay) if self._closed else delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, CHAT_WRITE_BEHIND_MAX_BACKOFF_SECONDS)
+        return False
+
+    def close(self, timeout: float = 30.0) -> bool:
+        """Ngừng nhận lượt mới và chờ ghi hết hàng đợi (gọi khi worker tắt)"""
+        self._closed = True
+        thread = self._thread
+        if thread is None:
+            return True
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        flushed = not thread.is_alive()
+        if not flushed:
+            logger.error(f"Chat write-behind queue not flushed after {timeout}s, {self._queue.qsize()} turns pending")
+        return flushed
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CHAT_WRITE_BEHIND,
+            "depth": self._queue.qsize(),
+            "max_size": self._queue.maxsize,
+            "max_turns_per_batch": self.max_turns,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "committed_turns": self.committed_turns,
+            "commits": self.commits,
+            "turns_per_commit": round(self.committed_turns / self.commits, 2) if self.commits else 0.0,
+            "retries": self.retries,
+            "failed": self.failed,
+            "skipped_no_user": self.skipped_no_user,
+            "last_commit_seconds": self.last_commit_seconds,
+        }
+
+
+chat_write_queue = ChatWriteQueue()
+
+
+def enqueue_chat(email, message, response, source_documents=None) -> bool:
+    """
+    Ghi một lượt chat theo kiểu write-behind.
+
+    Returns:
+        bool: True nếu lượt đã vào hàng đợi; False nếu write-behind tắt hoặc
+        hàng đợi đầy, khi đó người gọi dùng save_chat đồng bộ
+    """
+    if not CHAT_WRITE_BEHIND:
+        return False
+    return chat_write_queue.submit(email, message, response, source_documents)
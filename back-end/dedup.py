@@ -0,0 +1,261 @@
+"""
+Phát hiện đoạn văn gần trùng lặp (MinHash + LSH) giữa các đề cương.
+
+Nhiều đề cương dùng chung phần "boilerplate" (chính sách đánh giá, bảng rubric,
+giới thiệu khoa...). Module này giúp chỉ lưu mỗi đoạn như vậy một lần, ghi lại
+tất cả nguồn chứa nó trong metadata `shared_sources` (và mã/tên học phần của các
+nguồn đó trong `shared_courses`), và gộp các kết quả trùng khi truy xuất để
+context gửi cho LLM chứa thông tin khác nhau.
+
+Chỉ các đoạn có nội dung giống hệt nhau (sau khi chuẩn hoá khoảng trắng) mới được
+gộp: hai đoạn chính sách đánh giá chỉ khác trọng số ("giữa kỳ 20%" và "giữa kỳ
+30%") gần trùng theo MinHash nhưng mang thông tin khác nhau, nên vẫn được giữ cả
+hai. MinHash + LSH chỉ dùng để tìm nhanh ứng viên, hash nội dung quyết định.
+
+Chữ ký MinHash và hash nội dung của mỗi đoạn được lưu cùng metadata (`minhash`,
+`content_hash`) nên khi upload không phải tính lại cho toàn bộ vectorstore.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import random
+import re
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from embedding_cache import normalize_text
+
+NUM_PERM = 64
+COURSE_FIELDS = ("course_code", "course_name")
+# Metadata lưu chữ ký MinHash (base64 của NUM_PERM số 32-bit)
+SIGNATURE_FIELD = "minhash"
+# Metadata lưu hash nội dung đã chuẩn hoá
+CONTENT_HASH_FIELD = "content_hash"
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+# Ngưỡng Jaccard ước lượng để một đoạn là ứng viên trùng (còn phải cùng hash nội dung)
+DUPLICATE_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [
+    (_rng.randint(1, _MERSENNE_PRIME - 1), _rng.randint(0, _MERSENNE_PRIME - 1))
+    for _ in range(NUM_PERM)
+]
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _shingles(text: str) -> set:
+    tokens = _TOKEN_RE.findall(normalize_text(text).lower())
+    if len(tokens) <= SHINGLE_SIZE:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(text: str) -> Tuple[int, ...]:
+    """Chữ ký MinHash của một đoạn văn bản"""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        for s in _shingles(text)
+    ]
+    if not hashes:
+        return tuple([_MAX_HASH] * NUM_PERM)
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def encode_signature(signature: Sequence[int]) -> str:
+    return base64.b64encode(struct.pack(f"<{NUM_PERM}I", *signature)).decode("ascii")
+
+
+def decode_signature(raw) -> Optional[Tuple[int, ...]]:
+    """Chữ ký đã lưu, None nếu không có hoặc không hợp lệ (vd NUM_PERM đã đổi)"""
+    if not isinstance(raw, str) or not raw:
+        return None
+    try:
+        data = base64.b64decode(raw, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if len(data) != 4 * NUM_PERM:
+        return None
+    return struct.unpack(f"<{NUM_PERM}I", data)
+
+
+def content_hash(text: str) -> str:
+    """Hash của nội dung đã chuẩn hoá (NFC, gộp khoảng trắng), giữ nguyên chữ số và ký hiệu"""
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def chunk_content_hash(text: str, metadata: Optional[dict] = None) -> str:
+    """Hash nội dung đã lưu trong metadata của đoạn, nếu chưa có thì tính từ nội dung"""
+    return (metadata or {}).get(CONTENT_HASH_FIELD) or content_hash(text)
+
+
+def estimate_jaccard(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """Chỉ mục LSH trên chữ ký MinHash, xác nhận trùng bằng hash nội dung"""
+
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD, bands: int = LSH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._buckets: List[Dict[Tuple[int, ...], List[str]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[str, Tuple[int, ...]] = {}
+        self._contents: Dict[str, Optional[str]] = {}
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, key: str, signature: Tuple[int, ...], content: Optional[str] = None):
+        self._signatures[key] = signature
+        self._contents[key] = content
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def query(self, signature: Tuple[int, ...], content: Optional[str] = None) -> Optional[str]:
+        """
+        Trả về khóa của đoạn gần trùng nhất (nếu vượt ngưỡng).
+
+        content: hash nội dung; khi có, chỉ trả về đoạn có cùng hash (trùng hoàn toàn)
+        """
+        candidates = set()
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        best_key, best_score = None, self.threshold
+        for key in candidates:
+            if content is not None and self._contents.get(key) != content:
+                continue
+            score = estimate_jaccard(signature, self._signatures[key])
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def __len__(self):
+        return len(self._signatures)
+
+
+def get_shared_sources(metadata: dict) -> List[str]:
+    """Danh sách nguồn chứa đoạn văn (lưu dạng JSON vì Chroma chỉ nhận giá trị đơn)"""
+    raw = metadata.get("shared_sources")
+    if raw:
+        try:
+            sources = json.loads(raw) if isinstance(raw, str) else list(raw)
+            if sources:
+                return sources
+        except (TypeError, ValueError):
+            pass
+    source = metadata.get("source")
+    return [source] if source else []
+
+
+def get_shared_courses(metadata: dict) -> List[dict]:
+    """Mã/tên học phần của các nguồn dùng chung đoạn văn (không gồm nguồn sở hữu)"""
+    raw = metadata.get("shared_courses")
+    if raw:
+        try:
+            courses = json.loads(raw) if isinstance(raw, str) else list(raw)
+            return [course for course in courses if isinstance(course, dict)]
+        except (TypeError, ValueError):
+            pass
+    return []
+
+
+def course_info(metadata: dict) -> dict:
+    return {field: metadata[field] for field in COURSE_FIELDS if metadata.get(field)}
+
+
+def link_source(metadata: dict, source: str, course: Optional[dict] = None) -> bool:
+    """
+    Gắn thêm một nguồn vào đoạn văn dùng chung. Trả về True nếu metadata thay đổi
+
+    Args:
+        course: mã/tên học phần của nguồn, để lấy theo mục của học phần đó vẫn thấy đoạn văn
+    """
+    sources = get_shared_sources(metadata)
+    if not source or source in sources:
+        return False
+    sources.append(source)
+    metadata["shared_sources"] = json.dumps(sources, ensure_ascii=False)
+    metadata["duplicate_count"] = len(sources) - 1
+    if course:
+        courses = get_shared_courses(metadata) + [dict(course, source=source)]
+        metadata["shared_courses"] = json.dumps(courses, ensure_ascii=False)
+    return True
+
+
+def dedup_ratio(total: int, duplicates: int) -> float:
+    return round(duplicates / total, 4) if total else 0.0
+
+
+def deduplicate_chunks(chunks, existing_index: Optional[NearDuplicateIndex] = None, existing_metadata=None):
+    """
+    Loại các chunk trùng nội dung, chỉ giữ bản đầu tiên và liên kết nguồn của các bản trùng.
+
+    Chunk gần trùng nhưng khác nội dung (vd khác trọng số đánh giá) luôn được giữ.
+
+    Args:
+        chunks (list): Danh sách Document sau khi chia
+        existing_index: Chỉ mục các đoạn đã có trong vectorstore (dùng khi upload)
+        existing_metadata (dict): id -> metadata của các đoạn đã có
+
+    Returns:
+        tuple: (chunk giữ lại, {id đoạn cũ: metadata mới} cần cập nhật, thống kê)
+    """
+    index = existing_index or NearDuplicateIndex()
+    existing_metadata = existing_metadata or {}
+    kept = []
+    kept_by_key = {}
+    updated_existing = {}
+    duplicates = 0
+
+    for chunk in chunks:
+        signature = minhash_signature(chunk.page_content)
+        content = content_hash(chunk.page_content)
+        match = index.query(signature, content)
+        source = chunk.metadata.get("source", "")
+        if match is None:
+            key = f"new:{len(kept)}"
+            index.add(key, signature, content)
+            chunk.metadata[SIGNATURE_FIELD] = encode_signature(signature)
+            chunk.metadata[CONTENT_HASH_FIELD] = content
+            kept_by_key[key] = chunk
+            kept.append(chunk)
+            continue
+
+        duplicates += 1
+        course = course_info(chunk.metadata)
+        if match in kept_by_key:
+            link_source(kept_by_key[match].metadata, source, course)
+        elif match in existing_metadata:
+            metadata = updated_existing.get(match, dict(existing_metadata[match]))
+            if link_source(metadata, source, course):
+                updated_existing[match] = metadata
+
+    stats = {
+        "total_chunks": len(chunks),
+        "unique_chunks": len(kept),
+        "duplicate_chunks": duplicates,
+        "dedup_ratio": dedup_ratio(len(chunks), duplicates)
+    }
+    return kept, updated_existing, stats
+
+
+def collapse_duplicates(docs):
+    """Gộp các kết quả truy xuất trùng nội dung, giữ thứ tự và bản xếp hạng cao nhất"""
+    collapsed = []
+    seen = set()
+    for doc in docs:
+        content = chunk_content_hash(doc.page_content, doc.metadata)
+        if content in seen:
+            continue
+        seen.add(content)
+        collapsed.append(doc)
+    return collapsed
@@ -0,0 +1,216 @@
+"""
+Cache embedding trên đĩa, đánh địa chỉ theo nội dung.
+
+Mỗi vector được lưu với khóa sha256(model id + văn bản đã chuẩn hoá), nên khi
+chạy lại ingest.py hoặc upload lại một đề cương chỉ sửa vài đoạn, chỉ những
+đoạn có nội dung thay đổi mới phải gọi model embedding.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Khi vượt giới hạn, xóa bớt các vector ít dùng nhất đến khi còn tỉ lệ này
+EVICTION_TARGET_RATIO = 0.9
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hoá văn bản trước khi hash: NFC unicode, gộp khoảng trắng"""
+    text = unicodedata.normalize("NFC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def cache_key(model_id: str, text: str) -> str:
+    """Khóa nội dung của một đoạn văn bản cho một model cụ thể"""
+    digest = hashlib.sha256()
+    digest.update(model_id.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """Kho vector trên SQLite với eviction theo dung lượng (LRU)"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Lấy các vector đã có trong cache, cập nhật thời điểm sử dụng"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            # SQLite giới hạn số tham số mỗi câu lệnh
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(now, key) for key, _ in rows]
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]):
+        """Lưu các vector mới rồi eviction nếu vượt dung lượng"""
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._evict_locked()
+
+    def _evict_locked(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        to_free = total - target
+        evicted = 0
+        freed = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_used ASC"
+        ).fetchall():
+            if freed >= to_free:
+                break
+            self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            freed += size
+            evicted += 1
+        self._conn.commit()
+        logger.info(f"Embedding cache: đã xóa {evicted} vector ({freed / (1024 * 1024):.2f} MB)")
+
+    def size(self) -> Tuple[int, int]:
+        """Trả về (số vector, tổng số byte) trong cache"""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+        return count, total
+
+
+_cache_instance: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Cache dùng chung cho cả tiến trình"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = EmbeddingCache()
+        return _cache_instance
+
+
+class CachedEmbeddings(Embeddings):
+    """Bọc một model embedding, tra cache trước khi gọi model cho embed_documents"""
+
+    def __init__(self, embeddings: Embeddings, model_id: str, cache: Optional[EmbeddingCache] = None):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache or get_embedding_cache()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [cache_key(self.model_id, text) for text in texts]
+        try:
+            cached = self.cache.get_many(keys)
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc embedding cache: {str(e)}")
+            cached = {}
+
+        # Chỉ embed mỗi nội dung mới một lần, kể cả khi trùng trong cùng batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        missed = sum(1 for key in keys if key not in cached)
+        self.hits += len(keys) - missed
+        self.misses += missed
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            try:
+                self.cache.put_many(computed.items())
+            except Exception as e:
+                logger.error(f"Lỗi khi ghi embedding cache: {str(e)}")
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Câu hỏi người dùng hầu như không lặp lại, không cần ghi xuống đĩa
+        return self.embeddings.embed_query(text)
+
+    def cache_stats(self) -> dict:
+        """Báo cáo hit-rate của lần chạy hiện tại và dung lượng cache"""
+        total = self.hits + self.misses
+        entries, size_bytes = self.cache.size()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": entries,
+            "size_mb": round(size_bytes / (1024 * 1024), 2),
+            "max_size_mb": round(self.cache.max_bytes / (1024 * 1024), 2)
+        }
+
+    def format_report(self) -> str:
+        stats = self.cache_stats()
+        return (
+            f"Embedding cache: {stats['hits']} hit / {stats['misses']} miss "
+            f"(hit-rate {stats['hit_rate'] * 100:.1f}%), "
+            f"{stats['entries']} vector, {stats['size_mb']} MB / {stats['max_size_mb']} MB"
+        )
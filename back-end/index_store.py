@@ -0,0 +1,300 @@
+"""
+Quản lý các phiên bản vectorstore theo kiểu blue/green.
+
+Mỗi lần ingest tạo một thư mục phiên bản mới trong INDEX_ROOT. Chỉ khi build
+xong, con trỏ CURRENT mới được đổi (ghi file tạm rồi os.replace, nguyên tử).
+Các worker đang chạy phát hiện phiên bản mới qua IndexManager: phiên bản mới
+được load trong thread nền và chỉ được đổi sang khi đã sẵn sàng, request vẫn
+dùng phiên bản cũ trong lúc chờ. Request đang stream giữ phiên bản của nó qua
+acquire()/release(); client Chroma cũ chỉ bị đóng khi request cuối cùng dùng
+nó kết thúc. Rollback chỉ là đổi con trỏ về phiên bản trước.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INDEX_ROOT = os.getenv("CHROMA_INDEX_ROOT", "./chroma_indexes")
+CURRENT_POINTER = os.path.join(INDEX_ROOT, "CURRENT")
+# Thư mục cũ trước khi có phiên bản, vẫn được đọc nếu chưa có con trỏ CURRENT
+LEGACY_INDEX_DIR = "./chroma_db"
+# Số phiên bản giữ lại (gồm cả phiên bản hiện tại) để rollback
+KEEP_VERSIONS = int(os.getenv("CHROMA_KEEP_VERSIONS", "3"))
+# Khoảng thời gian tối thiểu giữa hai lần worker kiểm tra con trỏ
+VERSION_CHECK_INTERVAL = float(os.getenv("CHROMA_VERSION_CHECK_INTERVAL", "2"))
+
+
+def new_version() -> str:
+    """Tên phiên bản sắp xếp được theo thời gian"""
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def version_dir(version: str) -> str:
+    return os.path.join(INDEX_ROOT, version)
+
+
+def list_versions() -> List[str]:
+    """Các phiên bản đã build xong, cũ nhất trước"""
+    if not os.path.isdir(INDEX_ROOT):
+        return []
+    return sorted(
+        name for name in os.listdir(INDEX_ROOT)
+        if os.path.isdir(os.path.join(INDEX_ROOT, name)) and not name.startswith(".")
+    )
+
+
+def current_version() -> Optional[str]:
+    try:
+        with open(CURRENT_POINTER, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version if version and os.path.isdir(version_dir(version)) else None
+
+
+def current_index_dir() -> str:
+    """Thư mục vectorstore đang phục vụ"""
+    version = current_version()
+    return version_dir(version) if version else LEGACY_INDEX_DIR
+
+
+def publish_version(version: str):
+    """Đổi con trỏ CURRENT sang phiên bản mới một cách nguyên tử"""
+    if not os.path.isdir(version_dir(version)):
+        raise FileNotFoundError(f"Không tìm thấy phiên bản vectorstore: {version}")
+    tmp_path = f"{CURRENT_POINTER}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CURRENT_POINTER)
+    logger.info(f"Đã chuyển vectorstore sang phiên bản {version}")
+
+
+def prune_versions(keep: int = KEEP_VERSIONS) -> List[str]:
+    """Xóa các phiên bản cũ, luôn giữ phiên bản hiện tại"""
+    current = current_version()
+    versions = [v for v in list_versions() if v != current]
+    # Giữ lại (keep - 1) phiên bản gần nhất ngoài phiên bản hiện tại
+    stale = versions[:max(len(versions) - max(keep - 1, 0), 0)]
+    for version in stale:
+        shutil.rmtree(version_dir(version), ignore_errors=True)
+        logger.info(f"Đã xóa phiên bản vectorstore cũ {version}")
+    return stale
+
+
+def rollback() -> Optional[str]:
+    """Quay con trỏ CURRENT về phiên bản liền trước"""
+    current = current_version()
+    versions = list_versions()
+    older = [v for v in versions if current is None or v < current]
+    if not older:
+        return None
+    previous = older[-1]
+    publish_version(previous)
+    return previous
+
+
+def _close_vectorstore(vectorstore):
+    """Đóng client Chroma của một phiên bản không còn request nào dùng"""
+    client = getattr(vectorstore, "_client", None)
+    system = getattr(client, "_system", None)
+    if system is None:
+        return
+    try:
+        # Bỏ system khỏi cache của chromadb để lần rollback về thư mục này mở lại client mới
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient._identifier_to_system.pop(getattr(client, "_identifier", None), None)
+    except ImportError:
+        pass
+    try:
+        system.stop()
+    except Exception as e:
+        logger.error(f"Lỗi khi đóng vectorstore cũ: {str(e)}")
+
+
+class _Generation:
+    """Một phiên bản vectorstore đã load và số request đang giữ nó"""
+
+    def __init__(self, vectorstore, index_dir: str):
+        self.vectorstore = vectorstore
+        self.index_dir = index_dir
+        self.refs = 0
+        self.retired = False
+
+
+class IndexManager:
+    """Giữ vectorstore của worker và tự đổi khi con trỏ CURRENT thay đổi.
+
+    Chỉ lần load đầu tiên (trong lifespan) chạy đồng bộ. Sau đó, khi con trỏ
+    đổi, phiên bản mới được build trong thread nền; get() không bao giờ chờ việc
+    build này mà trả về phiên bản đang phục vụ cho đến khi phiên bản mới sẵn sàng.
+    """
+
+    def __init__(self, embeddings_factory, check_interval: float = VERSION_CHECK_INTERVAL):
+        self._embeddings_factory = embeddings_factory
+        self._embeddings = None
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._embeddings_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._current: Optional[_Generation] = None
+        # Các phiên bản còn sống (đang phục vụ hoặc đã bị thay nhưng còn request giữ)
+        self._generations: Dict[int, _Generation] = {}
+        self._building: Optional[str] = None
+        self._last_check = 0.0
+
+    @property
+    def index_dir(self) -> Optional[str]:
+        current = self._current
+        return current.index_dir if current is not None else None
+
+    def load_embeddings(self):
+        """Load model embedding của worker (chỉ load một lần)"""
+        if self._embeddings is None:
+            with self._embeddings_lock:
+                if self._embeddings is None:
+                    self._embeddings = self._embeddings_factory()
+        return self._embeddings
+
+    def _build(self, index_dir: str):
+        from langchain_chroma import Chroma
+        return Chroma(
+            persist_directory=index_dir,
+            embedding_function=self.load_embeddings()
+        )
+
+    def _publish(self, vectorstore, index_dir: str):
+        """Đổi sang phiên bản đã build; phiên bản cũ bị đóng khi không còn request giữ"""
+        generation = _Generation(vectorstore, index_dir)
+        with self._lock:
+            old = self._current
+            self._current = generation
+            self._generations[id(vectorstore)] = generation
+            self._building = None
+            stale = None
+            if old is not None:
+                old.retired = True
+                if old.refs == 0:
+                    stale = self._generations.pop(id(old.vectorstore), None)
+        if old is not None:
+            logger.info(f"Worker đã đổi vectorstore {old.index_dir} -> {index_dir}")
+        if stale is not None:
+            _close_vectorstore(stale.vectorstore)
+
+    def _swap(self, index_dir: str):
+        """Build phiên bản mới trong thread nền rồi mới đổi sang"""
+        try:
+            vectorstore = self._build(index_dir)
+        except Exception as e:
+            logger.error(f"Lỗi khi load vectorstore {index_dir}: {str(e)}")
+            with self._lock:
+                self._building = None
+            return
+        self._publish(vectorstore, index_dir)
+
+    def _check_version(self):
+        """Phát hiện con trỏ CURRENT đổi và khởi động việc build nền (không chờ)"""
+        now = time.monotonic()
+        if now - self._last_check < self._check_interval:
+            return
+        with self._lock:
+            if self._building is not None or now - self._last_check < self._check_interval:
+                return
+            self._last_check = now
+            index_dir = current_index_dir()
+            if index_dir == self._current.index_dir or not os.path.exists(index_dir):
+                return
+            self._building = index_dir
+        threading.Thread(target=self._swap, args=(index_dir,), name="index-swap", daemon=True).start()
+
+    def get(self):
+        """Vectorstore hiện tại (ném lỗi nếu chưa có dữ liệu)"""
+        if self._current is None:
+            # Lần load đầu tiên: chưa có gì để phục vụ nên phải chờ
+            with self._load_lock:
+                if self._current is None:
+                    index_dir = current_index_dir()
+                    if not os.path.exists(index_dir):
+                        raise Exception("Chroma database directory not found")
+                    self._publish(self._build(index_dir), index_dir)
+                    self._last_check = time.monotonic()
+        else:
+            self._check_version()
+        return self._current.vectorstore
+
+    def get_or_none(self):
+        try:
+            return self.get()
+        except Exception as e:
+            logging.error(f"Error initializing vectorstore: {str(e)}")
+            return None
+
+    def acquire(self):
+        """Giữ vectorstore hiện tại cho một request, phải gọi release() khi xong"""
+        self.get()
+        with self._lock:
+            generation = self._current
+            generation.refs += 1
+        return generation.vectorstore
+
+    def acquire_or_none(self):
+        try:
+            return self.acquire()
+        except Exception as e:
+            logging.error(f"Error initializing vectorstore: {str(e)}")
+            return None
+
+    def release(self, vectorstore):
+        """Trả vectorstore đã acquire(); đóng phiên bản cũ khi request cuối cùng trả"""
+        with self._lock:
+            generation = self._generations.get(id(vectorstore))
+            if generation is None:
+                return
+            generation.refs -= 1
+            stale = None
+            if generation.retired and generation.refs == 0:
+                stale = self._generations.pop(id(vectorstore))
+        if stale is not None:
+            _close_vectorstore(stale.vectorstore)
+
+    @contextmanager
+    def lease(self):
+        """Context manager quanh acquire()/release()"""
+        vectorstore = self.acquire()
+        try:
+            yield vectorstore
+        finally:
+            self.release(vectorstore)
+
+
+_manager: Optional[IndexManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_index_manager() -> IndexManager:
+    """IndexManager dùng chung trong một worker"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            from ingest import create_embeddings
+            _manager = IndexManager(create_embeddings)
+        return _manager
+
+
+def configure_index_manager(embeddings_factory) -> IndexManager:
+    """Dùng embedding khác cho IndexManager của worker (ví dụ embedder giả lập khi load-test).
+
+    Phải gọi trước khi import các router, vì chúng lấy IndexManager lúc import.
+    """
+    global _manager
+    with _manager_lock:
+        _manager = IndexManager(embeddings_factory)
+        return _manager
@@ -1,21 +1,27 @@
 import os
 import shutil
-import requests
-from bs4 import BeautifulSoup
+import sys
 from urllib.parse import urlparse
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFDirectoryLoader, TextLoader
 from langchain_core.documents import Document
 from datetime import datetime
+from embedding_cache import CachedEmbeddings
+from dedup import deduplicate_chunks
+from syllabus_sections import split_documents_by_section
+from course_facts import COURSE_FACTS_PATH, build_course_facts, save_course_facts
+import index_store
 
 # Đường dẫn
 DOCUMENTS_DIR = "./data"
-CHROMA_DB_DIR = "./chroma_db"
+# Thư mục vectorstore cũ (trước khi có phiên bản), xem index_store
+CHROMA_DB_DIR = index_store.LEGACY_INDEX_DIR
+
+# Model embedding
+EMBEDDING_MODEL_NAME = "dangvantuan/vietnamese-embedding"
 
 def fetch_url_content(url):
     """Lấy nội dung từ URL"""
+    import requests
+    from bs4 import BeautifulSoup
     try:
         # Validate URL
         parsed_url = urlparse(url)
@@ -91,16 +97,22 @@ def create_document_from_url(url, name):
         )
     return None
 
-def create_embeddings():
-    """Khởi tạo model embedding"""
-    return HuggingFaceEmbeddings(
-        model_name="dangvantuan/vietnamese-embedding",
+def create_embeddings(use_cache=True):
+    """Khởi tạo model embedding, mặc định kèm cache embedding trên đĩa"""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embeddings = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
         model_kwargs={'device': 'cpu'},
         encode_kwargs={'normalize_embeddings': True}
     )
+    if not use_cache:
+        return embeddings
+    # Model id gồm cả tuỳ chọn encode vì chúng làm thay đổi vector đầu ra
+    return CachedEmbeddings(embeddings, model_id=f"{EMBEDDING_MODEL_NAME}|normalize=True")
 
 def load_documents(urls=None):
     """Load tài liệu từ thư mục và URLs"""
+    from langchain_community.document_loaders import PyPDFDirectoryLoader, TextLoader
     documents = []
     
     # Load từ URLs nếu có
@@ -187,12 +199,18 @@ def split_documents(documents):
     
     # Cải thiện metadata trước khi chia
     documents = enhance_pdf_metadata(documents)
-        
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=510,
-        chunk_overlap=110
+
+    # Chia theo mục đề cương trước, mỗi chunk mang metadata section
+    chunks = split_documents_by_section(documents, chunk_size=510, chunk_overlap=110)
+    sectioned = sum(1 for chunk in chunks if chunk.metadata.get("section"))
+    print(f"Đã gắn mục đề cương cho {sectioned}/{len(chunks)} đoạn")
+
+    # Boilerplate dùng chung giữa các đề cương chỉ lưu một lần
+    chunks, _, dedup_stats = deduplicate_chunks(chunks)
+    print(
+        f"Loại {dedup_stats['duplicate_chunks']}/{dedup_stats['total_chunks']} đoạn trùng "
+        f"(tỉ lệ dedup {dedup_stats['dedup_ratio'] * 100:.1f}%)"
     )
-    chunks = splitter.split_documents(documents)
     
     # Thêm chunk_id cho mỗi chunk
     for i, chunk in enumerate(chunks):
@@ -204,23 +222,27 @@ def split_documents(documents):
     return chunks
 
 def create_vectorstore(chunks, embeddings):
-    """Tạo vectorstore mới"""
+    """Tạo vectorstore mới trong thư mục phiên bản riêng rồi mới chuyển con trỏ CURRENT"""
+    from langchain_chroma import Chroma
+    version = index_store.new_version()
+    version_dir = index_store.version_dir(version)
     try:
-        # Xóa vectorstore cũ
-        if os.path.exists(CHROMA_DB_DIR):
-            shutil.rmtree(CHROMA_DB_DIR)
-            print("Đã xóa vectorstore cũ")
-
-        # Tạo vectorstore mới
+        # Build vào thư mục mới, server đang chạy vẫn đọc phiên bản cũ
         vectorstore = Chroma.from_documents(
             documents=chunks,
             embedding=embeddings,
-            persist_directory=CHROMA_DB_DIR
+            persist_directory=version_dir
         )
-        print("Đã tạo vectorstore mới")
+        index_store.publish_version(version)
+        print(f"Đã tạo vectorstore mới (phiên bản {version})")
+
+        removed = index_store.prune_versions()
+        if removed:
+            print(f"Đã xóa {len(removed)} phiên bản vectorstore cũ")
         return vectorstore
     except Exception as e:
         print(f"Lỗi khi tạo vectorstore: {e}")
+        shutil.rmtree(version_dir, ignore_errors=True)
         return None
 
 def print_sample_chunks(vectorstore, num_chunks=5):
@@ -254,6 +276,17 @@ def print_sample_chunks(vectorstore, num_chunks=5):
         print(f"Lỗi khi in mẫu: {e}")
 
 if __name__ == "__main__":
+    # python ingest.py --rollback: quay về phiên bản vectorstore trước đó
+    if "--rollback" in sys.argv:
+        previous = index_store.rollback()
+        print(f"Đã rollback về phiên bản {previous}" if previous else "Không có phiên bản cũ để rollback")
+        sys.exit(0)
+    if "--list-versions" in sys.argv:
+        current = index_store.current_version()
+        for version in index_store.list_versions():
+            print(f"{'*' if version == current else ' '} {version}")
+        sys.exit(0)
+
     try:
         # Khởi tạo embeddings
         embeddings = create_embeddings()
@@ -276,6 +309,11 @@ if __name__ == "__main__":
             print("Không có tài liệu nào được load")
             exit()
             
+        # Bảng thông tin môn học cho câu hỏi trả lời nhanh (không qua LLM)
+        course_facts = build_course_facts(documents)
+        save_course_facts(course_facts)
+        print(f"Đã trích xuất thông tin của {len(course_facts)} môn học vào {COURSE_FACTS_PATH}")
+
         # Chia tài liệu
         chunks = split_documents(documents)
         if not chunks:
@@ -286,6 +324,9 @@ if __name__ == "__main__":
         vectorstore = create_vectorstore(chunks, embeddings)
         if vectorstore:
             print_sample_chunks(vectorstore)
+
+        if isinstance(embeddings, CachedEmbeddings):
+            print(embeddings.format_report())
             
     except Exception as e:
         print(f"Lỗi: {e}")
@@ -0,0 +1,9 @@
+"""
+Bộ load-test offline cho /chatbot/ask_stream.
+
+Firestore, Ollama và model embedding được thay bằng bản giả lập chạy cục bộ
+(xem fake_firestore, fake_ollama, hash_embedder) để đo thông lượng, TTFT và độ
+trễ đuôi trên một máy mà không chạm tới Firebase/model thật.
+
+Chạy từ thư mục back-end: python -m loadtest.run --concurrency 1,4,8,16
+"""
@@ -0,0 +1,86 @@
+"""
+Bộ đề cương tổng hợp và câu hỏi mẫu cho load-test.
+
+Đề cương được sinh theo cấu trúc mục chuẩn (SYLLABUS_SECTIONS) nên đi qua đúng
+đường chia chunk/gắn mục của ingest, không cần đọc PDF hay tải URL.
+"""
+import random
+
+from langchain_core.documents import Document
+
+from syllabus_sections import SYLLABUS_SECTIONS
+
+COURSE_NAMES = [
+    "Kiểm thử tự động", "Lập trình Python", "Cơ sở dữ liệu", "Mạng máy tính", "Trí tuệ nhân tạo",
+    "Kỹ thuật phần mềm", "Lập trình Web", "Cấu trúc dữ liệu và giải thuật", "Thiết kế giao diện",
+    "Khoa học dữ liệu", "Lập trình Java", "Phát triển ứng dụng di động",
+]
+
+SECTION_BODIES = {
+    "thong_tin_hoc_phan": "Số tín chỉ: 3 (2 lý thuyết, 1 thực hành). Học phần bắt buộc thuộc khối kiến thức chuyên ngành.",
+    "muc_tieu": "Học phần giúp sinh viên nắm vững kiến thức nền tảng về {name} và vận dụng vào các bài toán thực tế.",
+    "chuan_dau_ra": "Sau khi học xong, sinh viên trình bày được các khái niệm cốt lõi, phân tích và giải quyết vấn đề về {name}.",
+    "mo_ta": "Học phần giới thiệu tổng quan về {name}, các kỹ thuật chính và công cụ hỗ trợ phổ biến.",
+    "phuong_phap": "Giảng viên thuyết giảng kết hợp thảo luận nhóm, bài tập tình huống và thực hành trên máy.",
+    "nhiem_vu": "Sinh viên tham dự tối thiểu 80% số buổi học, hoàn thành bài tập về nhà và đồ án nhóm đúng hạn.",
+    "danh_gia": "Chuyên cần 10%. Bài tập và đồ án nhóm 30%. Thi cuối kỳ 60%, hình thức tự luận 90 phút.",
+    "giao_trinh": "Giáo trình chính: Bài giảng {name}, Khoa Công nghệ Thông tin. Tài liệu tham khảo: các sách chuyên khảo về {name}.",
+    "noi_dung_chi_tiet": "Chương 1: Tổng quan về {name}. Chương 2: Các kỹ thuật cơ bản. Chương 3: Ứng dụng và đồ án.",
+    "yeu_cau": "Sinh viên không sử dụng điện thoại trong giờ học, nộp bài đúng hạn và tuân thủ quy định về đạo văn.",
+    "bien_soan": "Đề cương được biên soạn bởi bộ môn và cập nhật theo chương trình đào tạo mới nhất.",
+    "rubric": "Rubric đánh giá đồ án gồm các tiêu chí: nội dung 40%, trình bày 30%, trả lời câu hỏi 30%.",
+}
+
+QUESTION_TEMPLATES = [
+    "Cách đánh giá môn {code} như thế nào?",
+    "Giáo trình của môn {name} là gì?",
+    "Mục tiêu của học phần {code}?",
+    "Môn {name} có bao nhiêu tín chỉ?",
+    "Chuẩn đầu ra của môn {code} gồm những gì?",
+    "Nhiệm vụ sinh viên khi học môn {name}?",
+    "Nội dung chi tiết môn {code}",
+    "Học {name} cần chuẩn bị gì?",
+]
+
+GENERIC_QUESTIONS = ["xin chào", "giáo trình", "đánh giá", "Khoa có những môn tự chọn nào?"]
+
+
+def course_code(index: int) -> str:
+    return f"71ITSE3{1000 + index:04d}"
+
+
+def course_name(index: int) -> str:
+    name = COURSE_NAMES[index % len(COURSE_NAMES)]
+    if index >= len(COURSE_NAMES):
+        name = f"{name} {index // len(COURSE_NAMES) + 1}"
+    return name
+
+
+def build_corpus(num_courses: int = 12) -> list:
+    """Mỗi môn một tài liệu (một 'trang'), có đầy đủ các mục đề cương"""
+    documents = []
+    for i in range(num_courses):
+        name = course_name(i)
+        lines = ["ĐỀ CƯƠNG HỌC PHẦN", f"Tên học phần: {name}", f"Mã học phần: {course_code(i)}"]
+        for number, (key, title, _, _) in enumerate(SYLLABUS_SECTIONS, 1):
+            lines.append(f"{number}. {title}")
+            lines.append(SECTION_BODIES[key].format(name=name))
+        documents.append(Document(
+            page_content="\n".join(lines),
+            metadata={"source": f"loadtest/{course_code(i)}.pdf", "name": name, "page": 0}
+        ))
+    return documents
+
+
+def build_questions(num_courses: int = 12, seed: int = 7, generic_ratio: float = 0.1) -> list:
+    """Danh sách câu hỏi có trộn câu hỏi chung/chào hỏi, thứ tự cố định theo seed"""
+    rng = random.Random(seed)
+    questions = []
+    for i in range(num_courses):
+        name = course_name(i)
+        for template in QUESTION_TEMPLATES:
+            questions.append(template.format(code=course_code(i), name=name))
+    generic_count = max(1, int(len(questions) * generic_ratio))
+    questions.extend(rng.choice(GENERIC_QUESTIONS) for _ in range(generic_count))
+    rng.shuffle(questions)
+    return questions
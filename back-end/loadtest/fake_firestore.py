@@ -0,0 +1,415 @@
+"""
+Firestore giả lập trong bộ nhớ, tương thích với phần API mà package `database`
+và các router đang dùng: collection/document, where/order_by/limit/start_after/
+select/recursive, get/stream, add/set/update/delete/create, batch(), bulk_writer(),
+recursive_delete() và điều kiện ghi write_option(last_update_time=...).
+
+Mỗi lệnh gọi "mạng" (get, stream, add, set, update, delete, commit) có thể chờ
+thêm latency_ms để mô phỏng độ trễ round-trip tới Firestore thật.
+"""
+import copy
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+    "array_contains_any": lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+
+def _apply_value(data: dict, field: str, value):
+    """Ghi một field, hiểu các sentinel DELETE_FIELD/SERVER_TIMESTAMP/Increment/ArrayUnion"""
+    kind = type(value).__name__
+    if kind == "Sentinel":
+        description = getattr(value, "description", "").lower()
+        if "delete" in description:
+            data.pop(field, None)
+        else:
+            data[field] = datetime.now()
+    elif kind == "Increment":
+        data[field] = (data.get(field) or 0) + value.value
+    elif kind == "ArrayUnion":
+        current = list(data.get(field) or [])
+        data[field] = current + [v for v in value.values if v not in current]
+    elif kind == "ArrayRemove":
+        data[field] = [v for v in data.get(field) or [] if v not in value.values]
+    else:
+        data[field] = copy.deepcopy(value)
+
+
+class FakePreconditionFailed(Exception):
+    """Điều kiện ghi không thỏa (FailedPrecondition/AlreadyExists của Firestore thật)"""
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name):
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def collections(self):
+        self._client._rpc()
+        return [FakeCollectionReference(self._client, path) for path in self._client._subcollections(self.path)]
+
+    def get(self, field_paths=None):
+        self._client._rpc()
+        with self._client._lock:
+            data = self._client._docs.get(self.path)
+            self._client.counters["reads"] += 1
+            if data is not None and field_paths:
+                data = {k: v for k, v in data.items() if k in field_paths}
+            return FakeDocumentSnapshot(self, copy.deepcopy(data), self._client._update_times.get(self.path))
+
+    def set(self, data, merge=False):
+        self._client._rpc()
+        self._client._write_set(self.path, data, merge)
+
+    def create(self, data):
+        self._client._rpc()
+        with self._client._lock:
+            if self.path in self._client._docs:
+                raise FakePreconditionFailed(f"Document already exists: {self.path}")
+            self._client._write_set(self.path, data)
+
+    def update(self, data, option=None):
+        self._client._rpc()
+        with self._client._lock:
+            expected = (option or {}).get("last_update_time")
+            if expected is not None and self._client._update_times.get(self.path) != expected:
+                raise FakePreconditionFailed(f"Document changed since it was read: {self.path}")
+            self._client._write_update(self.path, data)
+
+    def delete(self):
+        self._client._rpc()
+        self._client._write_delete(self.path)
+
+
+class FakeQuery:
+    def __init__(self, client, path, filters=None, orders=None, limit=None, cursor=None, fields=None,
+                 all_descendants=False):
+        self._client = client
+        self._path = path
+        self._filters = filters or []
+        self._orders = orders or []
+        self._limit = limit
+        self._cursor = cursor
+        self._fields = fields
+        self._all_descendants = all_descendants
+
+    def _copy(self, **changes):
+        params = dict(
+            filters=list(self._filters), orders=list(self._orders), limit=self._limit,
+            cursor=self._cursor, fields=self._fields, all_descendants=self._all_descendants
+        )
+        params.update(changes)
+        return FakeQuery(self._client, self._path, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + [(field_path, str(direction).upper().endswith("DESCENDING"))])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def recursive(self):
+        """Gồm cả document trong mọi subcollection lồng bên dưới"""
+        return self._copy(all_descendants=True)
+
+    def _in_scope(self, path):
+        if self._all_descendants:
+            return path.startswith(self._path + "/")
+        return path.rsplit("/", 1)[0] == self._path
+
+    @staticmethod
+    def _value(path, data, field):
+        # "__name__" (FieldPath.document_id()): sắp xếp và cursor theo id document
+        if field == "__name__":
+            return path.rsplit("/", 1)[1]
+        return data.get(field)
+
+    def _cursor_values(self):
+        cursor = self._cursor
+        if isinstance(cursor, FakeDocumentSnapshot):
+            cursor = dict(cursor.to_dict(), __name__=cursor.id)
+        return tuple((cursor or {}).get(field) for field, _ in self._orders)
+
+    def _run(self):
+        with self._client._lock:
+            rows = sorted(
+                (path, data) for path, data in self._client._docs.items() if self._in_scope(path)
+            )
+            rows = [
+                (path, data) for path, data in rows
+                if all(_OPERATORS[op](data.get(field), value) for field, op, value in self._filters)
+            ]
+            for field, descending in reversed(self._orders):
+                rows = [row for row in rows if field == "__name__" or field in row[1]]
+                rows.sort(key=lambda row: self._value(row[0], row[1], field), reverse=descending)
+            if self._cursor is not None and self._orders:
+                cursor = self._cursor_values()
+                rows = [
+                    row for row in rows
+                    if self._after(tuple(self._value(row[0], row[1], field) for field, _ in self._orders), cursor)
+                ]
+            if self._limit is not None:
+                rows = rows[:self._limit]
+            snapshots = []
+            for path, data in rows:
+                data = copy.deepcopy(data)
+                if self._fields is not None:
+                    data = {k: v for k, v in data.items() if k in self._fields}
+                snapshots.append(FakeDocumentSnapshot(FakeDocumentReference(self._client, path), data))
+            # Firestore tính một lượt đọc cho mỗi document trả về (tối thiểu một lượt mỗi query)
+            self._client.counters["reads"] += max(len(snapshots), 1)
+            return snapshots
+
+    def _after(self, values, cursor):
+        for (_, descending), value, bound in zip(self._orders, values, cursor):
+            if value == bound:
+                continue
+            return value < bound if descending else value > bound
+        return False
+
+    def get(self):
+        self._client._rpc()
+        return self._run()
+
+    def stream(self):
+        self._client._rpc()
+        return iter(self._run())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        reference.set(document_data)
+        return datetime.now(), reference
+
+    def list_documents(self):
+        self._client._rpc()
+        with self._client._lock:
+            return [
+                FakeDocumentReference(self._client, path) for path in self._client._docs
+                if path.rsplit("/", 1)[0] == self._path
+            ]
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference.path, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference.path, field_updates, None))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None, None))
+
+    def __len__(self):
+        return len(self._writes)
+
+    def commit(self):
+        self._client._rpc()
+        for op, path, data, merge in self._writes:
+            if op == "set":
+                self._client._write_set(path, data, merge)
+            elif op == "update":
+                self._client._write_update(path, data)
+            else:
+                self._client._write_delete(path)
+        self._client.counters["batch_commits"] += 1
+        self._writes = []
+
+
+class FakeBulkWriter:
+    """BulkWriter giả lập: gom lệnh ghi và commit theo lô 20 lệnh khi flush"""
+
+    def __init__(self, client):
+        self._client = client
+        self._batch = FakeWriteBatch(client)
+
+    def set(self, reference, document_data, merge=False):
+        self._batch.set(reference, document_data, merge)
+
+    def update(self, reference, field_updates):
+        self._batch.update(reference, field_updates)
+
+    def delete(self, reference):
+        self._batch.delete(reference)
+
+    def flush(self):
+        writes, self._batch._writes = self._batch._writes, []
+        for start in range(0, len(writes), 20):
+            batch = FakeWriteBatch(self._client)
+            batch._writes = writes[start:start + 20]
+            batch.commit()
+
+    def close(self):
+        self.flush()
+
+
+class FakeFirestore:
+    """Client Firestore giả lập, an toàn khi dùng từ nhiều thread executor"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self._docs = {}
+        # Thời điểm ghi cuối của từng document (số tăng dần thay cho timestamp)
+        self._update_times = {}
+        self._clock = itertools.count(1)
+        self._lock = threading.RLock()
+        self.counters = {"rpcs": 0, "reads": 0, "writes": 0, "batch_commits": 0}
+
+    def _rpc(self):
+        with self._lock:
+            self.counters["rpcs"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _subcollections(self, path):
+        prefix = path + "/"
+        with self._lock:
+            return sorted({
+                prefix + doc_path[len(prefix):].split("/", 1)[0]
+                for doc_path in self._docs if doc_path.startswith(prefix)
+            })
+
+    def _write_set(self, path, data, merge=False):
+        with self._lock:
+            current = dict(self._docs.get(path) or {}) if merge else {}
+            for field, value in data.items():
+                _apply_value(current, field, value)
+            self._docs[path] = current
+            self._update_times[path] = next(self._clock)
+            self.counters["writes"] += 1
+
+    def _write_update(self, path, data):
+        with self._lock:
+            if path not in self._docs:
+                raise KeyError(f"No document to update: {path}")
+            current = self._docs[path]
+            for field, value in data.items():
+                _apply_value(current, field, value)
+            self._update_times[path] = next(self._clock)
+            self.counters["writes"] += 1
+
+    def _write_delete(self, path):
+        with self._lock:
+            self._docs.pop(path, None)
+            self._update_times.pop(path, None)
+            self.counters["writes"] += 1
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def write_option(self, **kwargs):
+        return kwargs
+
+    def bulk_writer(self, options=None):
+        return FakeBulkWriter(self)
+
+    def recursive_delete(self, reference, bulk_writer=None, chunk_size=5000):
+        """Xoá document/collection cùng toàn bộ subcollection, trả về số document đã xoá"""
+        self._rpc()
+        prefix = getattr(reference, "path", None) or reference._path
+        with self._lock:
+            paths = [path for path in self._docs if path == prefix or path.startswith(prefix + "/")]
+            for path in paths:
+                del self._docs[path]
+                self._update_times.pop(path, None)
+            self.counters["writes"] += len(paths)
+        return len(paths)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "documents": len(self._docs)}
+
+
+def seed_users(db: FakeFirestore, count: int, domain: str = "vanlanguni.vn"):
+    """Tạo sẵn các tài khoản sinh viên loadtest{i}@domain, trả về danh sách email"""
+    emails = []
+    latency, db.latency = db.latency, 0
+    try:
+        for i in range(count):
+            email = f"loadtest{i}@{domain}"
+            db.collection("users").document(f"loadtest-{i}").set({
+                "email": email,
+                "displayName": f"Load test {i}",
+                "role": "user",
+                "createdAt": datetime.now().isoformat(),
+            })
+            emails.append(email)
+    finally:
+        db.latency = latency
+    return emails
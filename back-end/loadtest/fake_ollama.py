@@ -0,0 +1,176 @@
+"""
+Server Ollama giả lập: trả lời /api/chat bằng NDJSON với tốc độ token cấu hình được.
+
+Chạy: python -m loadtest.fake_ollama --port 11435 --tokens-per-second 25 --parallel 2
+
+Mô phỏng các đặc điểm ảnh hưởng tới năng lực phục vụ của Ollama thật:
+- chỉ `parallel` lượt sinh chạy cùng lúc (OLLAMA_NUM_PARALLEL), lượt khác phải chờ,
+- thời gian xử lý prompt tỉ lệ với độ dài prompt (prefill),
+- tốc độ sinh token cố định cho mỗi lượt,
+- chunk cuối có prompt_eval_count/eval_count/... như Ollama thật.
+Client ngắt kết nối thì lượt sinh dừng ngay và trả chỗ.
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ANSWER = (
+    "Theo đề cương, học phần được đánh giá gồm chuyên cần 10%, bài tập và đồ án nhóm 30%, "
+    "thi cuối kỳ 60% theo hình thức tự luận. Giáo trình chính là bài giảng của Khoa Công nghệ "
+    "Thông tin, kèm các tài liệu tham khảo chuyên khảo. Bạn có muốn biết thêm thông tin về mục "
+    "tiêu, chuẩn đầu ra hoặc nội dung chi tiết của môn học này không?"
+)
+
+
+def tokenize(text: str, size: int = 4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeOllama:
+    def __init__(self, tokens_per_second: float = 25, parallel: int = 2, answer_tokens: int = 120,
+                 prefill_ms_per_1k_chars: float = 150, load_ms: float = 0):
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.prefill_ms_per_1k_chars = prefill_ms_per_1k_chars
+        self.load_ms = load_ms
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.tokens = (tokenize(CANNED_ANSWER) * (answer_tokens // len(tokenize(CANNED_ANSWER)) + 1))[:answer_tokens]
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "completed": 0, "disconnected": 0, "tokens": 0}
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+
+def make_handler(ollama: FakeOllama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _write_chunk(self, payload):
+            data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": "llama3.2:latest", "model": "llama3.2:latest"}]})
+            elif self.path == "/api/version":
+                self._send_json({"version": "0.0.0-fake"})
+            elif self.path == "/stats":
+                self._send_json(ollama.stats)
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/api/show":
+                self._send_json({"modelfile": "", "details": {"family": "llama"}})
+                return
+            if self.path != "/api/chat":
+                self._send_json({"error": "not found"}, status=404)
+                return
+            self._chat(request)
+
+        def _chat(self, request):
+            ollama.count("requests")
+            model = request.get("model", "llama3.2")
+            prompt_chars = sum(len(m.get("content", "")) for m in request.get("messages", []))
+            started = time.perf_counter()
+            with ollama.slots:
+                prefill = prompt_chars / 1000 * ollama.prefill_ms_per_1k_chars / 1000
+                time.sleep(ollama.load_ms / 1000 + prefill)
+                prefill_done = time.perf_counter()
+                delay = 1 / ollama.tokens_per_second if ollama.tokens_per_second > 0 else 0
+                if not request.get("stream", True):
+                    time.sleep(delay * len(ollama.tokens))
+                    self._send_json(self._final(model, "".join(ollama.tokens), prompt_chars, started, prefill_done))
+                    ollama.count("completed")
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for token in ollama.tokens:
+                        if delay:
+                            time.sleep(delay)
+                        self._write_chunk({
+                            "model": model,
+                            "created_at": datetime.now(timezone.utc).isoformat(),
+                            "message": {"role": "assistant", "content": token},
+                            "done": False,
+                        })
+                        ollama.count("tokens")
+                    self._write_chunk(self._final(model, "", prompt_chars, started, prefill_done))
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                    ollama.count("completed")
+                except (BrokenPipeError, ConnectionResetError):
+                    ollama.count("disconnected")
+                    self.close_connection = True
+
+        def _final(self, model, content, prompt_chars, started, prefill_done):
+            now = time.perf_counter()
+            return {
+                "model": model,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": content},
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": int((now - started) * 1e9),
+                "load_duration": int(ollama.load_ms * 1e6),
+                "prompt_eval_count": prompt_chars // 4,
+                "prompt_eval_duration": int((prefill_done - started) * 1e9),
+                "eval_count": len(ollama.tokens),
+                "eval_duration": int((now - prefill_done) * 1e9),
+            }
+
+    return Handler
+
+
+def serve(host: str, port: int, ollama: FakeOllama) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(ollama))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server Ollama giả lập cho load-test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens-per-second", type=float, default=25)
+    parser.add_argument("--parallel", type=int, default=2)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--prefill-ms-per-1k-chars", type=float, default=150)
+    args = parser.parse_args()
+
+    ollama = FakeOllama(args.tokens_per_second, args.parallel, args.answer_tokens, args.prefill_ms_per_1k_chars)
+    server = serve(args.host, args.port, ollama)
+    print(f"Fake Ollama đang chạy tại http://{args.host}:{args.port} "
+          f"({args.tokens_per_second} token/s, {args.parallel} lượt song song)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Embedder tất định dựa trên hash, thay cho model HuggingFace khi load-test.
+
+Mỗi từ và cặp từ (đã bỏ dấu) được băm vào một chiều của vector, có dấu +/- theo
+hash, rồi chuẩn hoá độ dài. Cùng một văn bản luôn cho cùng một vector và các văn
+bản có nhiều từ chung thì gần nhau, đủ để Chroma trả về kết quả có nghĩa. Có thể
+thêm độ trễ giả lập chi phí chạy model thật.
+"""
+import hashlib
+import math
+import re
+import time
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from syllabus_sections import fold_accents
+
+# Cùng số chiều với dangvantuan/vietnamese-embedding
+HASH_EMBEDDING_DIM = 768
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashEmbeddings(Embeddings):
+    def __init__(self, dim: int = HASH_EMBEDDING_DIM, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency = latency_ms / 1000
+
+    def _features(self, text: str):
+        words = _WORD_RE.findall(fold_accents(text))
+        yield from words
+        yield from (f"{a} {b}" for a, b in zip(words, words[1:]))
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if (value >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
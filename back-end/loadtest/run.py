@@ -0,0 +1,230 @@
+"""
+Sinh tải cho /chatbot/ask_stream và báo cáo thông lượng, TTFT, độ trễ đuôi.
+
+Chạy từ thư mục back-end:
+    python -m loadtest.run --concurrency 1,4,8,16 --requests-per-user 5
+
+Mặc định script tự khởi động Ollama giả lập (loadtest.fake_ollama) và API với
+Firestore giả lập (loadtest.serve) trong các tiến trình riêng. Dùng --target để
+bắn tải vào một server có sẵn thay vì tự khởi động.
+
+Mỗi mức concurrency chạy N người dùng ảo theo vòng kín: mỗi người gửi câu hỏi,
+đọc hết stream SSE rồi mới gửi câu tiếp theo. Với mỗi request ghi nhận TTFT
+(đến frame `chunk` đầu tiên), tổng thời gian, lỗi, trả lời trích xuất và việc
+request có được gộp single-flight hay không (qua sự kiện `timing`).
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from loadtest.corpus import build_questions  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def wait_ready(client, url, timeout=180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url)
+            if response.status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server chưa sẵn sàng sau {timeout}s: {url}")
+
+
+async def ask(client, target, question, email):
+    """Gửi một câu hỏi, đọc hết stream SSE"""
+    result = {"ttft": None, "latency": None, "error": None, "fallback": None, "coalesced": False, "chars": 0}
+    started = time.perf_counter()
+    try:
+        params = {"question": question, "email": email, "debug": "true"}
+        async with client.stream("GET", f"{target}/chatbot/ask_stream", params=params) as response:
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event["type"] == "chunk":
+                    if result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - started
+                    result["chars"] += len(event.get("text", ""))
+                elif event["type"] == "error":
+                    result["error"] = event.get("reason") or event.get("message", "error")[:60]
+                elif event["type"] == "timing":
+                    tags = event.get("tags", {})
+                    result["fallback"] = tags.get("fallback")
+                    result["coalesced"] = bool(tags.get("coalesced"))
+    except Exception as e:
+        result["error"] = type(e).__name__
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+async def run_level(client, target, concurrency, requests_per_user, questions, emails):
+    results = []
+
+    async def user(index):
+        email = emails[index % len(emails)]
+        for n in range(requests_per_user):
+            question = questions[(index * requests_per_user + n) % len(questions)]
+            results.append(await ask(client, target, question, email))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if not r["error"]]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    latencies = [r["latency"] for r in ok]
+    errors = {}
+    for r in results:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    fallbacks = {}
+    for r in ok:
+        if r["fallback"]:
+            fallbacks[r["fallback"]] = fallbacks.get(r["fallback"], 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "errors": errors,
+        "fallbacks": fallbacks,
+        "coalesced": sum(1 for r in ok if r["coalesced"]),
+        "ttft_p50_s": percentile(ttfts, 0.50),
+        "ttft_p95_s": percentile(ttfts, 0.95),
+        "ttft_p99_s": percentile(ttfts, 0.99),
+        "latency_p50_s": percentile(latencies, 0.50),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "latency_p99_s": percentile(latencies, 0.99),
+    }
+
+
+def format_seconds(value):
+    return "     -" if value is None else f"{value:6.2f}"
+
+
+def print_report(levels):
+    print("\nconc  req   rps   ttft p50  p95    p99  | lat p50  p95    p99  | lỗi  trích xuất  gộp")
+    for level in levels:
+        print(
+            f"{level['concurrency']:4d} {level['requests']:4d} {level['throughput_rps']:5.2f}  "
+            f"{format_seconds(level['ttft_p50_s'])} {format_seconds(level['ttft_p95_s'])} "
+            f"{format_seconds(level['ttft_p99_s'])} | "
+            f"{format_seconds(level['latency_p50_s'])} {format_seconds(level['latency_p95_s'])} "
+            f"{format_seconds(level['latency_p99_s'])} | "
+            f"{sum(level['errors'].values()):4d} {sum(level['fallbacks'].values()):10d} {level['coalesced']:5d}"
+        )
+
+
+def start_process(args, log_path):
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(
+        [sys.executable, "-m", *args], cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+async def main_async(args):
+    import httpx
+
+    processes = []
+    target = args.target
+    try:
+        if not target:
+            # Một hoặc nhiều Ollama giả lập (pool endpoint của model router)
+            ollama_urls = []
+            for i in range(args.ollama_instances):
+                ollama_port = free_port()
+                processes.append(start_process([
+                    "loadtest.fake_ollama", "--port", str(ollama_port),
+                    "--tokens-per-second", str(args.tokens_per_second),
+                    "--parallel", str(args.ollama_parallel),
+                    "--answer-tokens", str(args.answer_tokens),
+                ], os.path.join(args.log_dir, f"fake_ollama_{i}.log")))
+                ollama_urls.append(f"http://127.0.0.1:{ollama_port}")
+            api_port = free_port()
+            processes.append(start_process([
+                "loadtest.serve", "--port", str(api_port),
+                "--ollama-host", ",".join(ollama_urls),
+                "--users", str(max(args.concurrency)),
+                "--courses", str(args.courses),
+                "--firestore-latency-ms", str(args.firestore_latency_ms),
+                "--embed-latency-ms", str(args.embed_latency_ms),
+            ], os.path.join(args.log_dir, "serve.log")))
+            target = f"http://127.0.0.1:{api_port}"
+
+        timeout = httpx.Timeout(args.request_timeout, connect=10)
+        limits = httpx.Limits(max_connections=max(args.concurrency) + 10)
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            await wait_ready(client, f"{target}/chatbot/queue_stats")
+            questions = build_questions(args.courses)
+            emails = [f"loadtest{i}@vanlanguni.vn" for i in range(max(args.concurrency))]
+            levels = []
+            for concurrency in args.concurrency:
+                print(f"Đang chạy concurrency={concurrency}...", flush=True)
+                levels.append(await run_level(client, target, concurrency, args.requests_per_user, questions, emails))
+            server_stats = {
+                "queue": (await client.get(f"{target}/chatbot/queue_stats")).json(),
+                "router": (await client.get(f"{target}/chatbot/router_stats")).json(),
+            }
+
+        print_report(levels)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"config": vars(args), "levels": levels, "server": server_stats}, f, ensure_ascii=False, indent=2)
+            print(f"\nĐã ghi kết quả vào {args.output}")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test offline cho /chatbot/ask_stream")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests-per-user", type=int, default=5)
+    parser.add_argument("--courses", type=int, default=12)
+    parser.add_argument("--tokens-per-second", type=float, default=25)
+    parser.add_argument("--ollama-parallel", type=int, default=2)
+    parser.add_argument("--ollama-instances", type=int, default=1)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--firestore-latency-ms", type=float, default=20)
+    parser.add_argument("--embed-latency-ms", type=float, default=15)
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--target", default=None, help="URL server có sẵn, ví dụ http://127.0.0.1:8000")
+    parser.add_argument("--log-dir", default=".", help="Nơi ghi log của các tiến trình giả lập")
+    parser.add_argument("--output", default=None, help="Ghi kết quả dạng JSON")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
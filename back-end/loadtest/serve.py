@@ -0,0 +1,69 @@
+"""
+Chạy API thật (main.app) với Firestore giả lập, embedder băm và index tổng hợp.
+
+Chạy: python -m loadtest.serve --port 8100 --ollama-host http://127.0.0.1:11435
+
+Thường được loadtest.run khởi động trong tiến trình riêng, để bộ sinh tải không
+tranh GIL với server. Mọi thay thế đều nằm ở đây; mã của ứng dụng không đổi.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API Syllabus-Bot với các dịch vụ giả lập")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ollama-host", default="http://127.0.0.1:11435", help="Một hoặc nhiều endpoint, phân tách bằng dấu phẩy")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--courses", type=int, default=12)
+    parser.add_argument("--firestore-latency-ms", type=float, default=20)
+    parser.add_argument("--embed-latency-ms", type=float, default=15)
+    parser.add_argument("--workdir", default=None, help="Thư mục chứa index tạm (mặc định: thư mục tạm mới)")
+    args = parser.parse_args()
+
+    # Các biến môi trường phải được đặt trước khi import ứng dụng
+    workdir = args.workdir or tempfile.mkdtemp(prefix="syllabus-loadtest-")
+    os.environ["CHROMA_INDEX_ROOT"] = os.path.join(workdir, "chroma_indexes")
+    os.environ["COURSE_FACTS_PATH"] = os.path.join(workdir, "course_facts.json")
+    os.environ["OLLAMA_ENDPOINTS"] = args.ollama_host
+    os.environ["CHATBOT_DEBUG_TIMING"] = "1"
+    os.environ.setdefault("SLOW_REQUEST_SECONDS", "1000000")
+
+    import firebase_admin
+    import uvicorn
+
+    import index_store
+    import ingest
+    from course_facts import build_course_facts, save_course_facts
+    from database.firebase import use_firestore_client
+    from loadtest.corpus import build_corpus
+    from loadtest.fake_firestore import FakeFirestore, seed_users
+    from loadtest.hash_embedder import HashEmbeddings
+
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms)
+    seed_users(db, args.users)
+    use_firestore_client(db)
+    if not firebase_admin._apps:
+        # App không có credential thật; package database dùng client giả lập nên không khởi tạo lại
+        firebase_admin.initialize_app(options={"projectId": "syllabus-loadtest"})
+
+    embeddings = HashEmbeddings(latency_ms=args.embed_latency_ms)
+    corpus = build_corpus(args.courses)
+    save_course_facts(build_course_facts(corpus))
+    chunks = ingest.split_documents(corpus)
+    if ingest.create_vectorstore(chunks, HashEmbeddings()) is None:
+        sys.exit("Không tạo được index cho load-test")
+    index_store.configure_index_manager(lambda: embeddings)
+
+    import main as app_module
+    print(f"API load-test đang chạy tại http://{args.host}:{args.port} (index: {workdir})", flush=True)
+    uvicorn.run(app_module.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
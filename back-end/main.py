@@ -1,6 +1,13 @@
+import time
+
+# Mốc thời gian bắt đầu import, dùng để đo thời gian khởi động worker
+_BOOT_STARTED = time.perf_counter()
+
+import asyncio
 import os
 from pathlib import Path
 import sys
+from contextlib import asynccontextmanager
 
 # Add the parent directory to sys.path
 sys.path.append(str(Path(__file__).parent))
@@ -8,35 +15,16 @@ sys.path.append(str(Path(__file__).parent))
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from langchain_chroma import Chroma
-from database import save_feedback, get_all_feedbacks, update_feedback_status, initialize_firestore
-from ingest import create_embeddings
+from database import save_feedback, get_all_feedbacks, update_feedback_status, initialize_firestore, chat_write_queue, resume_deletion_jobs
+from database.aio import close_async_firestore
+from index_store import get_index_manager
 import logging
-import firebase_admin
-from firebase_admin import credentials
 
 # Import routers
 from user.router import router as user_router
 from admin.router import router as admin_router
 from chatbot.router import router as chatbot_router
-
-# Initialize Firebase Admin SDK
-def initialize_firebase():
-    """Khởi tạo Firebase Admin SDK một lần duy nhất."""
-    try:
-        if not firebase_admin._apps:
-            cred = credentials.Certificate("serviceAccountKey.json")
-            firebase_admin.initialize_app(cred)
-            print("Firebase Admin đã được khởi tạo thành công.")
-    except Exception as e:
-        logging.error(f"Error initializing Firebase Admin SDK: {str(e)}")
-        raise
-
-# Khởi tạo Firebase khi khởi động ứng dụng
-initialize_firebase()
-
-# Định nghĩa đường dẫn vectorstore (cần khớp với ingest.py)
-CHROMA_DB_DIRECTORY = "./chroma_db"
+from chatbot.tracing import metrics_app
 
 # Giới hạn kích thước file upload (ví dụ: 100MB)
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
@@ -44,19 +32,63 @@ MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 # Cấu hình cơ bản
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-app = FastAPI()
-
-# Load vectorstore từ chroma_db
-try:
-    embeddings = create_embeddings()
-    vectorstore = Chroma(
-        persist_directory=CHROMA_DB_DIRECTORY,
-        embedding_function=embeddings
+
+# Thời gian import toàn bộ ứng dụng (chưa gồm Firebase, model embedding, Chroma)
+IMPORT_SECONDS = time.perf_counter() - _BOOT_STARTED
+# Thời gian (giây) từng pha khởi động, startup_profile.py đối chiếu với ngân sách
+STARTUP_PHASES = {"import": IMPORT_SECONDS}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Khởi tạo Firebase, Firestore và vectorstore khi worker bắt đầu phục vụ"""
+    phase_started = time.perf_counter()
+    try:
+        # Khởi tạo Firebase và client Firestore dùng chung khi khởi động ứng dụng;
+        # các hàm database dùng lại client này
+        initialize_firestore()
+        logger.info("Firestore initialized successfully")
+    except Exception as e:
+        logger.error(f"Error during startup: {str(e)}")
+        raise
+    STARTUP_PHASES["firebase"] = time.perf_counter() - phase_started
+
+    # Load model embedding rồi vectorstore của phiên bản index hiện tại
+    # (dùng chung với chatbot router), đo riêng từng bước
+    try:
+        index_manager = get_index_manager()
+        phase_started = time.perf_counter()
+        index_manager.load_embeddings()
+        STARTUP_PHASES["embeddings"] = time.perf_counter() - phase_started
+        phase_started = time.perf_counter()
+        index_manager.get()
+        STARTUP_PHASES["vectorstore"] = time.perf_counter() - phase_started
+        logger.info(f"Vectorstore đã được load thành công từ {index_manager.index_dir}")
+    except Exception as e:
+        logger.error(f"Lỗi khi load vectorstore: {str(e)}")
+        raise
+
+    # Chạy tiếp các job xóa dữ liệu bị gián đoạn khi worker trước tắt
+    try:
+        resume_deletion_jobs()
+    except Exception as e:
+        logger.error(f"Error resuming deletion jobs: {str(e)}")
+
+    STARTUP_PHASES["total"] = time.perf_counter() - _BOOT_STARTED
+    logger.info(
+        "Khởi động xong: "
+        + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in STARTUP_PHASES.items())
     )
-    logger.info("Vectorstore đã được load thành công từ chroma_db")
-except Exception as e:
-    logger.error(f"Lỗi khi load vectorstore: {str(e)}")
-    raise
+    from startup_profile import check_boot_phases
+    for problem in check_boot_phases(STARTUP_PHASES):
+        logger.warning(problem)
+    yield
+
+    # Ghi nốt các lượt chat còn trong hàng đợi write-behind trước khi worker thoát
+    flushed = await asyncio.get_event_loop().run_in_executor(None, chat_write_queue.close)
+    logger.info(f"Chat write-behind queue {'flushed' if flushed else 'NOT flushed'}: {chat_write_queue.stats()}")
+    await close_async_firestore()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -80,21 +112,15 @@ app.include_router(user_router, prefix="/user", tags=["user"])
 app.include_router(admin_router, prefix="/admin", tags=["admin"])
 app.include_router(chatbot_router, prefix="/chatbot", tags=["chatbot"])
 
+# Histogram thời gian từng bước của chatbot (cần prometheus_client)
+prometheus_app = metrics_app()
+if prometheus_app is not None:
+    app.mount("/metrics", prometheus_app)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Syllabus-Bot API"}
 
-@app.on_event("startup")
-async def startup_event():
-    try:
-        # Initialize Firestore
-        initialize_firestore()
-        logger.info("Firestore initialized successfully")
-        
-    except Exception as e:
-        logger.error(f"Error during startup: {str(e)}")
-        raise
-
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,27 +1,9 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 from collections import Counter
 import os
 import time
-import matplotlib.pyplot as plt
-import numpy as np
 
-def initialize_firestore():
-    """Khởi tạo Firebase Admin SDK."""
-    try:
-        if not firebase_admin._apps:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            service_account_path = os.path.join(current_dir, "serviceAccountKey.json")
-
-            if not os.path.exists(service_account_path):
-                raise FileNotFoundError(f"Service account key not found at {service_account_path}")
-
-            cred = credentials.Certificate(service_account_path)
-            firebase_admin.initialize_app(cred)
-        return firestore.client()
-    except Exception as e:
-        print(f"Lỗi khi khởi tạo Firebase Admin: {str(e)}")
-        raise
+# Dùng chung client Firestore của package database (cùng service account key)
+from database import initialize_firestore
 
 def collect_user_questions():
     """Thu thập tất cả câu hỏi của người dùng từ các cuộc trò chuyện dưới mỗi user."""
@@ -109,6 +91,10 @@ def visualize_top_questions(questions, top_n=20):
         print("Không có câu hỏi người dùng nào để phân tích.")
         return
     
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
     question_counter = Counter(questions)
     top_questions = question_counter.most_common(top_n)
     top_questions.reverse()
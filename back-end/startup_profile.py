@@ -0,0 +1,143 @@
+"""
+Đo thời gian khởi động API.
+
+Chạy: python startup_profile.py [--budget-ms 3000] [--top 15] [--boot]
+
+Script import `main` trong một tiến trình mới (cold start) bằng
+`python -X importtime`, in các module tốn thời gian nhất và trả exit code 1 nếu
+tổng thời gian vượt ngân sách hoặc nếu một thư viện nặng (matplotlib, pypdf,
+unstructured, chromadb, model embedding...) bị import ngay lúc khởi động thay
+vì ở lần dùng đầu tiên. Với --boot, script chạy thêm lifespan của app (Firebase,
+model embedding, Chroma) và đối chiếu thời gian từng pha với ngân sách.
+main.py cũng gọi check_boot_phases sau mỗi lần khởi động và ghi cảnh báo khi
+vượt ngân sách; tests/test_startup_profile.py chạy các kiểm tra này trong CI.
+"""
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+
+STARTUP_IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "3000"))
+# Ngân sách (ms) từng pha trong lifespan và tổng thời gian từ lúc import main
+STARTUP_PHASE_BUDGETS_MS = {
+    "firebase": float(os.getenv("STARTUP_FIREBASE_BUDGET_MS", "5000")),
+    "embeddings": float(os.getenv("STARTUP_EMBEDDINGS_BUDGET_MS", "30000")),
+    "vectorstore": float(os.getenv("STARTUP_VECTORSTORE_BUDGET_MS", "10000")),
+    "total": float(os.getenv("STARTUP_TOTAL_BUDGET_MS", "45000")),
+}
+
+# Các thư viện chỉ được import ở lần dùng đầu tiên hoặc trong lifespan
+LAZY_MODULES = [
+    "matplotlib",
+    "numpy",
+    "pypdf",
+    "unstructured",
+    "langchain_ollama",
+    "langchain_chroma",
+    "langchain_huggingface",
+    "langchain_community",
+    "chromadb",
+    "torch",
+    "sentence_transformers",
+    "bs4",
+]
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def run_importtime(module: str = "main"):
+    """Import module trong tiến trình mới, trả về [(module, self_us, cumulative_us, depth)]"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=backend_dir,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import {module} thất bại:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def summarize(entries, top: int = 15):
+    """Tổng thời gian import và các module tốn thời gian nhất"""
+    total_us = sum(cumulative for _, _, cumulative, depth in entries if depth == 0)
+    heaviest = sorted(entries, key=lambda e: e[2], reverse=True)[:top]
+    imported = {name.split(".")[0] for name, _, _, _ in entries}
+    eager_heavy = [name for name in LAZY_MODULES if name in imported]
+    return total_us / 1000, heaviest, eager_heavy
+
+
+def check_import_budget(module: str = "main", budget_ms: float = STARTUP_IMPORT_BUDGET_MS, top: int = 15):
+    """Đo import module; trả về (total_ms, heaviest, các lỗi vượt ngân sách)"""
+    total_ms, heaviest, eager_heavy = summarize(run_importtime(module), top)
+    problems = []
+    if eager_heavy:
+        problems.append(f"Thư viện nặng bị import lúc khởi động: {', '.join(eager_heavy)}")
+    if total_ms > budget_ms:
+        problems.append(f"Vượt ngân sách import: {total_ms:.0f} ms > {budget_ms:.0f} ms")
+    return total_ms, heaviest, problems
+
+
+def check_boot_phases(phases, budgets_ms=None):
+    """Đối chiếu thời gian các pha khởi động (giây) với ngân sách, trả về danh sách lỗi"""
+    budgets_ms = STARTUP_PHASE_BUDGETS_MS if budgets_ms is None else budgets_ms
+    problems = []
+    for phase, budget_ms in budgets_ms.items():
+        seconds = phases.get(phase)
+        if seconds is not None and seconds * 1000 > budget_ms:
+            problems.append(f"Pha khởi động `{phase}` vượt ngân sách: {seconds * 1000:.0f} ms > {budget_ms:.0f} ms")
+    return problems
+
+
+def run_boot(module: str = "main"):
+    """Chạy lifespan của app trong tiến trình hiện tại, trả về thời gian từng pha (giây)"""
+    app_module = __import__(module)
+
+    async def _boot():
+        async with app_module.lifespan(app_module.app):
+            pass
+
+    asyncio.run(_boot())
+    return dict(app_module.STARTUP_PHASES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian khởi động API")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--boot", action="store_true", help="Chạy thêm lifespan và đo từng pha")
+    args = parser.parse_args()
+
+    total_ms, heaviest, problems = check_import_budget(args.module, args.budget_ms, args.top)
+
+    print(f"Tổng thời gian import `{args.module}`: {total_ms:.0f} ms (ngân sách {args.budget_ms:.0f} ms)")
+    print(f"\nTop {len(heaviest)} module theo thời gian tích lũy:")
+    for name, self_us, cumulative_us, _ in heaviest:
+        print(f"  {cumulative_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name}")
+
+    if args.boot:
+        phases = run_boot(args.module)
+        print("\nThời gian từng pha khởi động:")
+        for phase, seconds in phases.items():
+            budget_ms = STARTUP_PHASE_BUDGETS_MS.get(phase)
+            budget = f" (ngân sách {budget_ms:.0f} ms)" if budget_ms is not None else ""
+            print(f"  {phase:12s} {seconds * 1000:8.0f} ms{budget}")
+        problems.extend(check_boot_phases(phases))
+
+    for problem in problems:
+        print(f"\n{problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Chia đề cương theo cấu trúc mục (mục tiêu, chuẩn đầu ra, đánh giá, giáo trình, rubric...).
+
+Mỗi chunk được gắn metadata `section` để chatbot có thể lấy đúng mục sinh viên
+hỏi của môn học đã xác định mà không cần tìm kiếm tương đồng.
+"""
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from dedup import get_shared_courses
+
+# (khóa, tên mục, mẫu tiêu đề, từ khóa trong câu hỏi) theo thứ tự trong đề cương chuẩn
+SYLLABUS_SECTIONS = [
+    ("thong_tin_hoc_phan", "Thông tin về học phần",
+     r"thông tin (chung )?(về |của )?học phần",
+     ["thông tin về học phần", "số tín chỉ", "mã môn"]),
+    ("muc_tieu", "Mục tiêu của học phần",
+     r"mục tiêu (của )?(học phần|môn học)",
+     ["mục tiêu"]),
+    ("chuan_dau_ra", "Chuẩn đầu ra của học phần",
+     r"chuẩn đầu ra",
+     ["chuẩn đầu ra"]),
+    ("mo_ta", "Mô tả vắn tắt nội dung học phần",
+     r"mô tả (vắn tắt |tóm tắt )?(nội dung )?(học phần|môn học)",
+     ["mô tả"]),
+    ("phuong_phap", "Phương pháp giảng dạy và học tập",
+     r"phương pháp (giảng dạy|dạy học|dạy và học)",
+     ["phương pháp giảng dạy"]),
+    ("nhiem_vu", "Nhiệm vụ của sinh viên",
+     r"nhiệm vụ (của )?sinh viên",
+     ["nhiệm vụ sinh viên"]),
+    ("danh_gia", "Đánh giá và cho điểm",
+     r"(đánh giá (và|,) cho điểm|phương (thức|pháp) đánh giá|đánh giá (kết quả )?học phần)",
+     ["phương thức đánh giá", "đánh giá", "cho điểm"]),
+    ("giao_trinh", "Giáo trình và tài liệu học tập",
+     r"(giáo trình|tài liệu (học tập|tham khảo))",
+     ["giáo trình", "tài liệu tham khảo"]),
+    ("noi_dung_chi_tiet", "Nội dung chi tiết của học phần",
+     r"nội dung (chi tiết|giảng dạy)",
+     ["nội dung chi tiết", "nội dung"]),
+    ("yeu_cau", "Yêu cầu của giảng viên đối với học phần",
+     r"yêu cầu (của )?giảng viên",
+     ["yêu cầu"]),
+    ("bien_soan", "Thông tin biên soạn và cập nhật",
+     r"(thông tin )?(biên soạn|cập nhật) (và|đề cương)",
+     ["biên soạn"]),
+    ("rubric", "Rubric đánh giá",
+     r"(rubric|phụ lục)",
+     ["rubric đánh giá", "rubric", "phụ lục"]),
+]
+
+SECTION_TITLES = {key: title for key, title, _, _ in SYLLABUS_SECTIONS}
+SECTION_ORDER = {key: i for i, (key, _, _, _) in enumerate(SYLLABUS_SECTIONS)}
+
+# Đánh số đầu dòng: "1.", "7.2", "II.", "Mục 3:", "Phần B -"
+_NUMBERING = r"^\s*((mục|phần|chương)\s+)?([0-9]{1,2}(\.[0-9]{1,2})*|[ivxlc]{1,5}|[a-h])?\s*[\.\):\-]?\s*"
+_HEADING_PATTERNS = [
+    (key, re.compile(_NUMBERING + pattern, re.IGNORECASE))
+    for key, _, pattern, _ in SYLLABUS_SECTIONS
+]
+# Tiêu đề có định dạng: đánh số ("3.", "7.2", "II.", "b)", "Mục 3") hoặc viết hoa toàn bộ
+_HEADING_MARK = re.compile(
+    r"^\s*((mục|phần|chương)\s+([0-9]{1,2}|[ivxlc]{1,5}|[a-h])\b"
+    r"|[0-9]{1,2}(\.[0-9]{1,2})*\s*[\.\):\-]?\s"
+    r"|([ivxlc]{1,5}|[a-h])\s*[\.\):\-])",
+    re.IGNORECASE
+)
+MAX_HEADING_LENGTH = 120
+
+SUBJECT_CODE_PATTERN = re.compile(r"\b\d{2}[A-Z]{2,}[A-Z0-9]*\d{3,}\b", re.IGNORECASE)
+_COURSE_NAME_PATTERN = re.compile(r"tên (học phần|môn học)[^:\n]*:\s*([^\n]+)", re.IGNORECASE)
+
+
+def _build_fold_table() -> dict:
+    """Bảng str.translate: chữ có dấu (dạng dựng sẵn) -> chữ không dấu, bỏ các dấu kết hợp rời"""
+    table = {ord("đ"): "d"}
+    for code in range(0x00C0, 0x2000):
+        char = chr(code)
+        if unicodedata.category(char) == "Mn":
+            table[code] = None
+            continue
+        base = "".join(c for c in unicodedata.normalize("NFD", char) if unicodedata.category(c) != "Mn")
+        if base != char:
+            table[code] = base
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def fold_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt và chuyển về chữ thường để so khớp"""
+    # NFC trước để chữ gõ dạng tổ hợp (e + dấu) cũng thành một ký tự có trong bảng
+    return unicodedata.normalize("NFC", (text or "").lower()).translate(_FOLD_TABLE)
+
+
+def detect_heading(line: str) -> Optional[str]:
+    """Trả về khóa mục nếu dòng là tiêu đề của một mục đề cương"""
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_LENGTH:
+        return None
+    for key, pattern in _HEADING_PATTERNS:
+        if pattern.match(line):
+            return key
+    return None
+
+
+def is_marked_heading(line: str) -> bool:
+    """Dòng có định dạng của tiêu đề (đánh số hoặc viết hoa), không chỉ chứa tên mục"""
+    line = line.strip()
+    return bool(_HEADING_MARK.match(line)) or (line.isupper() and len(line) > 3)
+
+
+def split_sections(text: str, current_section: Optional[str] = None) -> List[Tuple[Optional[str], str]]:
+    """
+    Chia văn bản thành các đoạn theo tiêu đề mục.
+
+    Args:
+        text (str): Nội dung (một trang hoặc cả tài liệu)
+        current_section (str): Mục đang mở từ trang trước
+
+    Returns:
+        list: [(khóa mục hoặc None, nội dung)]
+    """
+    segments = []
+    buffer = []
+    for line in text.splitlines():
+        key = detect_heading(line)
+        # Dòng chỉ chứa tên mục (tiêu đề cột trong bảng như "Chuẩn đầu ra" trong bảng
+        # đánh giá) không được kéo ngược về mục trước. Tiêu đề có đánh số hoặc viết
+        # hoa thì luôn mở mục, kể cả mục trước: một dòng ngắn như "Tài liệu tham
+        # khảo: ..." ở trang bìa/mục lục nhảy nhầm tới mục sau không nuốt các mục
+        # thật phía sau.
+        if key and key != current_section and (
+            is_marked_heading(line) or SECTION_ORDER[key] > SECTION_ORDER.get(current_section, -1)
+        ):
+            if "".join(buffer).strip():
+                segments.append((current_section, "\n".join(buffer)))
+            buffer = []
+            current_section = key
+        buffer.append(line)
+    if "".join(buffer).strip():
+        segments.append((current_section, "\n".join(buffer)))
+    return segments
+
+
+def extract_course_info(text: str) -> dict:
+    """Lấy mã và tên học phần từ phần đầu đề cương"""
+    info = {}
+    code_match = SUBJECT_CODE_PATTERN.search(text)
+    if code_match:
+        info["course_code"] = code_match.group(0).upper()
+    name_match = _COURSE_NAME_PATTERN.search(text)
+    if name_match:
+        info["course_name"] = name_match.group(2).strip()[:200]
+    return info
+
+
+def split_documents_by_section(documents, chunk_size: int = 510, chunk_overlap: int = 110):
+    """
+    Chia tài liệu theo mục rồi mới chia nhỏ theo độ dài, không để chunk vắt qua hai mục.
+
+    Các trang của cùng một nguồn được xử lý theo thứ tự để mục đang mở ở cuối
+    trang trước được nối sang trang sau.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    current_source = None
+    current_section = None
+    course_info = {}
+    for doc in documents:
+        source = doc.metadata.get("source", "")
+        if source != current_source:
+            current_source = source
+            current_section = None
+            # Mã/tên học phần nằm ở trang đầu của đề cương
+            course_info = extract_course_info(doc.page_content[:3000])
+        for section, segment in split_sections(doc.page_content, current_section):
+            current_section = section
+            metadata = dict(doc.metadata)
+            metadata.update(course_info)
+            if section:
+                metadata["section"] = section
+                metadata["section_title"] = SECTION_TITLES[section]
+            for text in splitter.split_text(segment):
+                if text.strip():
+                    chunks.append(Document(page_content=text, metadata=dict(metadata)))
+    return chunks
+
+
+def detect_section(question: str) -> Optional[str]:
+    """Xác định mục đề cương mà câu hỏi yêu cầu (ưu tiên từ khóa dài nhất)"""
+    question_lower = question.lower()
+    best_key, best_len = None, 0
+    for key, _, _, keywords in SYLLABUS_SECTIONS:
+        for kw in keywords:
+            if kw in question_lower and len(kw) > best_len:
+                best_key, best_len = key, len(kw)
+    return best_key
+
+
+def _matches_course(fields: dict, subject: str) -> bool:
+    if SUBJECT_CODE_PATTERN.fullmatch(subject.strip()):
+        return (fields.get("course_code") or "").upper() == subject.strip().upper()
+    target = fold_accents(subject).strip()
+    for field in ("course_name", "name", "subject", "source"):
+        value = fold_accents(str(fields.get(field) or "")).replace("_", " ")
+        if target and target in value:
+            return True
+    return False
+
+
+def matches_subject(metadata: dict, subject: str) -> bool:
+    """
+    Kiểm tra chunk có thuộc môn học (mã hoặc tên) đã xác định hay không
+
+    Đoạn boilerplate dùng chung chỉ được lưu một lần với mã/tên của học phần đầu
+    tiên; các học phần khác chứa nó được so qua `shared_courses`.
+    """
+    if not subject:
+        return False
+    return _matches_course(metadata, subject) or any(
+        _matches_course(course, subject) for course in get_shared_courses(metadata)
+    )
+
+
+def fetch_section_chunks(vectorstore, section: str, subject: str, limit: int = 8):
+    """Lấy các chunk thuộc một mục của một môn học, theo thứ tự trong tài liệu"""
+    results = vectorstore.get(where={"section": section}, include=["documents", "metadatas"])
+    docs = [
+        Document(page_content=text, metadata=meta or {})
+        for text, meta in zip(results.get("documents", []), results.get("metadatas", []))
+        if matches_subject(meta or {}, subject)
+    ]
+    docs.sort(key=lambda d: (str(d.metadata.get("source", "")), d.metadata.get("chunk_index", 0)))
+    return docs[:limit]
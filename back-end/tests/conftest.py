@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các test import module của back-end theo cùng cách uvicorn chạy `main`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
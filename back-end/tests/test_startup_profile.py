@@ -0,0 +1,54 @@
+"""Kiểm tra ngân sách khởi động: thời gian import `main` và các pha trong lifespan"""
+import asyncio
+
+import pytest
+
+import startup_profile
+
+
+def test_import_budget():
+    pytest.importorskip("fastapi")
+    total_ms, _, problems = startup_profile.check_import_budget("main")
+    assert problems == [], f"import main mất {total_ms:.0f} ms: {problems}"
+
+
+def test_check_boot_phases_flags_slow_phase():
+    budgets = {"firebase": 100, "total": 1000}
+    assert startup_profile.check_boot_phases({"firebase": 0.05, "total": 0.5}, budgets) == []
+    problems = startup_profile.check_boot_phases({"firebase": 0.2, "total": 0.5}, budgets)
+    assert len(problems) == 1 and "firebase" in problems[0]
+
+
+class _FakeIndexManager:
+    index_dir = "fake"
+
+    def load_embeddings(self):
+        return object()
+
+    def get(self):
+        return object()
+
+
+def test_lifespan_records_phases_within_budget(monkeypatch):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("firebase_admin")
+    import main
+
+    async def _noop():
+        return None
+
+    monkeypatch.setattr(main, "initialize_firestore", lambda: None)
+    monkeypatch.setattr(main, "get_index_manager", lambda: _FakeIndexManager())
+    monkeypatch.setattr(main, "resume_deletion_jobs", lambda: None)
+    monkeypatch.setattr(main.chat_write_queue, "close", lambda: True)
+    monkeypatch.setattr(main, "close_async_firestore", _noop)
+
+    async def _boot():
+        async with main.lifespan(main.app):
+            pass
+
+    asyncio.run(_boot())
+    phases = main.STARTUP_PHASES
+    for phase in ("import", "firebase", "embeddings", "vectorstore", "total"):
+        assert phase in phases
+    assert startup_profile.check_boot_phases(phases) == []
@@ -2,11 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Path
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+import asyncio
 import logging
-from firebase_admin import auth, firestore
+from firebase_admin import auth
 from datetime import datetime
 import os
-from database import save_chat, get_chat_history, save_feedback, get_all_feedbacks, update_feedback_status
+from database import save_chat, get_chat_history, save_feedback, get_all_feedbacks, update_feedback_status, invalidate_user
+from database import aio, start_user_deletion, get_deletion_status
+from database.pagination import clamp_page_size
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -35,7 +38,6 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
 async def submit_feedback(feedback: Feedback, token: dict = Depends(verify_token)):
     """Gửi feedback từ người dùng"""
     try:
-        db = firestore.client()
         feedback_dict = feedback.dict()
         feedback_dict["created_at"] = datetime.now()
         feedback_dict["user_id"] = token.get('uid')
@@ -43,75 +45,66 @@ async def submit_feedback(feedback: Feedback, token: dict = Depends(verify_token
         feedback_dict["timestamp"] = datetime.now()
         
         # Lưu feedback vào collection feedbacks
-        feedback_ref = db.collection("feedbacks").document()
-        feedback_dict["id"] = feedback_ref.id
-        feedback_ref.set(feedback_dict)
+        feedback_id = await aio.add_feedback(feedback_dict)
         
-        return {"status": "success", "message": "Feedback submitted successfully", "feedback_id": feedback_ref.id}
+        return {"status": "success", "message": "Feedback submitted successfully", "feedback_id": feedback_id}
     except Exception as e:
         logger.error(f"Error submitting feedback: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/chat-history")
-async def get_user_chat_history(token: dict = Depends(verify_token)):
-    """Lấy lịch sử chat của người dùng"""
+async def get_user_chat_history(limit: int = None, cursor: str = None, token: dict = Depends(verify_token)):
+    """Lấy lịch sử chat của người dùng (một trang đầu mục chat, trang sau theo next_cursor)"""
     try:
         uid = token.get('uid')
-        db = firestore.client()
         
-        # Lấy 50 chat gần nhất
-        chats_ref = db.collection("users").document(uid).collection("chats")
-        chats = chats_ref.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(50).stream()
-        
-        chat_history = []
-        for chat in chats:
-            chat_data = chat.to_dict()
-            chat_data["id"] = chat.id
-            chat_history.append(chat_data)
+        chat_history, next_cursor = await aio.list_user_chats(uid, limit=clamp_page_size(limit), cursor=cursor)
             
-        return {"chats": chat_history}
+        return {"chats": chat_history, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting chat history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/delete-data")
 async def delete_user_data(token: dict = Depends(verify_token)):
-    """Xóa tất cả dữ liệu của người dùng"""
+    """Xóa tất cả dữ liệu của người dùng (chats, messages, activities, feedback) ở luồng nền"""
     try:
         uid = token.get('uid')
-        db = firestore.client()
         
-        # Xóa tất cả chats
-        chats_ref = db.collection("users").document(uid).collection("chats")
-        chats = chats_ref.stream()
-        for chat in chats:
-            chat.reference.delete()
-            
-        # Xóa tất cả activities
-        activities_ref = db.collection("users").document(uid).collection("activities")
-        activities = activities_ref.stream()
-        for activity in activities:
-            activity.reference.delete()
-            
-        return {"status": "success", "message": "All user data deleted successfully"}
+        # Người dùng có hàng nghìn chat: xóa hàng loạt ở luồng nền, theo dõi qua /delete-data/status
+        job = await asyncio.get_event_loop().run_in_executor(None, start_user_deletion, uid, token.get('email'))
+        return {"status": "success", "message": "User data deletion started", "job": job}
     except Exception as e:
         logger.error(f"Error deleting user data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/delete-data/status")
+async def get_delete_data_status(token: dict = Depends(verify_token)):
+    """Tiến độ xóa dữ liệu của người dùng"""
+    try:
+        job = await asyncio.get_event_loop().run_in_executor(None, get_deletion_status, token.get('uid'))
+        if job is None:
+            raise HTTPException(status_code=404, detail="No deletion job found")
+        return {"status": "success", "job": job}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting deletion status: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/feedback")
 async def get_user_feedback(token: dict = Depends(verify_token)):
     """Get user's feedback history"""
     try:
         user_id = token['uid']
-        db = firestore.client()
-        feedback_ref = db.collection('users').document(user_id).collection('feedback')
-        feedback_docs = feedback_ref.stream()
+        feedback_docs = await aio.list_user_feedback(user_id)
         
         feedback_list = []
-        for doc in feedback_docs:
-            feedback_data = doc.to_dict()
+        for feedback_data in feedback_docs:
             feedback_list.append({
-                "id": doc.id,
+                "id": feedback_data["id"],
                 "message": feedback_data.get('message', ''),
                 "status": feedback_data.get('status', 'pending'),
                 "timestamp": feedback_data.get('timestamp', '')
@@ -170,7 +163,13 @@ async def delete_account(token: dict = Depends(verify_token)):
     try:
         uid = token.get('uid')
         auth.delete_user(uid)
-        return {"status": "success", "message": "Account deleted successfully"}
+        # Không dùng lại reference của document user đã xóa
+        invalidate_user(email=token.get('email'), uid=uid)
+        # Xóa dữ liệu Firestore của tài khoản (gồm document user) ở luồng nền
+        job = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: start_user_deletion(uid, token.get('email'), delete_account=True)
+        )
+        return {"status": "success", "message": "Account deleted successfully", "job": job}
     except Exception as e:
         logger.error(f"Error deleting account: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -180,16 +179,12 @@ async def get_user_feedback_history(token: dict = Depends(verify_token)):
     """Get user's feedback history from main feedbacks collection"""
     try:
         user_id = token.get('uid')
-        db = firestore.client()
-        feedbacks_ref = db.collection('feedbacks')
-        query = feedbacks_ref.where('user_id', '==', user_id)
-        feedback_docs = query.stream()
+        feedback_docs = await aio.list_feedbacks(user_id=user_id)
 
         feedback_list = []
-        for doc in feedback_docs:
-            data = doc.to_dict()
+        for data in feedback_docs:
             feedback_list.append({
-                "id": doc.id,
+                "id": data["id"],
                 "message": data.get('message', ''),
                 "status": data.get('status', 'pending'),
                 "created_at": data.get('created_at', '')
@@ -207,44 +202,53 @@ async def archive_chat(
     """Lưu trữ (ẩn) một đoạn chat"""
     try:
         uid = token.get('uid')
-        db = firestore.client()
-        chat_ref = db.collection("users").document(uid).collection("chats").document(chat_id)
-        chat = chat_ref.get()
-        if not chat.exists:
+        if not await aio.set_chat_archived(uid, chat_id, True, token.get('email')):
             raise HTTPException(status_code=404, detail="Chat not found")
-        chat_ref.update({"archived": True})
         return {"status": "success", "message": "Chat archived"}
     except Exception as e:
         logger.error(f"Error archiving chat: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/archived-chats")
-async def get_archived_chats(token: dict = Depends(verify_token)):
-    """Lấy danh sách các đoạn chat đã lưu trữ"""
+async def get_archived_chats(limit: int = None, cursor: str = None, token: dict = Depends(verify_token)):
+    """Lấy danh sách các đoạn chat đã lưu trữ (một trang, trang sau theo next_cursor)"""
     try:
         uid = token.get('uid')
         if not uid:
             raise HTTPException(status_code=401, detail="User ID not found in token")
             
-        db = firestore.client()
-        chats_ref = db.collection("users").document(uid).collection("chats")
-        
-        # Get all chats and filter archived ones
-        chats = chats_ref.order_by("timestamp", direction=firestore.Query.DESCENDING).stream()
-        result = []
-        
-        for chat in chats:
-            chat_data = chat.to_dict()
-            # Check if chat is archived (either explicitly True or has status 'archived')
-            if chat_data.get("archived") == True or chat_data.get("status") == "archived":
-                chat_data["id"] = chat.id
-                result.append(chat_data)
+        # Chat đã lưu trữ: archived=True hoặc status 'archived'
+        result, next_cursor = await aio.list_archived_chats(uid, limit=clamp_page_size(limit), cursor=cursor)
                 
-        return {"chats": result}
+        return {"chats": result, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting archived chats: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get archived chats: {str(e)}")
 
+@router.get("/chats/{chat_id}/messages")
+async def get_chat_messages(
+    chat_id: str = Path(..., description="ID của đoạn chat"),
+    limit: int = 50,
+    cursor: str = None,
+    token: dict = Depends(verify_token)
+):
+    """Lấy tin nhắn của một đoạn chat theo trang (cũ nhất trước), chỉ khi người dùng mở chat"""
+    try:
+        page = await aio.list_chat_messages(token.get('uid'), chat_id, limit=clamp_page_size(limit), cursor=cursor)
+        if page is None:
+            raise HTTPException(status_code=404, detail="Chat not found")
+        messages, next_cursor = page
+        return {"messages": messages, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error getting chat messages: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/unarchive-chat/{chat_id}")
 async def unarchive_chat(
     chat_id: str = Path(..., description="ID của đoạn chat cần bỏ lưu trữ"),
@@ -253,16 +257,8 @@ async def unarchive_chat(
     """Bỏ lưu trữ một đoạn chat"""
     try:
         uid = token.get('uid')
-        db = firestore.client()
-        chat_ref = db.collection("users").document(uid).collection("chats").document(chat_id)
-        chat = chat_ref.get()
-        if not chat.exists:
+        if not await aio.set_chat_archived(uid, chat_id, False, token.get('email')):
             raise HTTPException(status_code=404, detail="Chat not found")
-        chat_ref.update({
-            "archived": False,
-            "status": "active",
-            "archivedAt": firestore.DELETE_FIELD
-        })
         return {"status": "success", "message": "Chat unarchived"}
     except Exception as e:
         logger.error(f"Error unarchiving chat: {str(e)}")
@@ -276,12 +272,8 @@ async def delete_chat(
     """Xóa một đoạn chat"""
     try:
         uid = token.get('uid')
-        db = firestore.client()
-        chat_ref = db.collection("users").document(uid).collection("chats").document(chat_id)
-        chat = chat_ref.get()
-        if not chat.exists:
+        if not await aio.delete_user_chat(uid, chat_id, token.get('email')):
             raise HTTPException(status_code=404, detail="Chat not found")
-        chat_ref.delete()
         return {"status": "success", "message": "Chat deleted"}
     except Exception as e:
         logger.error(f"Error deleting chat: {str(e)}")
@@ -295,31 +287,16 @@ async def share_chat(
     """Chia sẻ một đoạn chat"""
     try:
         uid = token.get('uid')
-        db = firestore.client()
-        chat_ref = db.collection("users").document(uid).collection("chats").document(chat_id)
-        chat = chat_ref.get()
+        # Tạo một bản sao của chat trong collection shared_chats
+        share_id = await aio.share_user_chat(uid, chat_id)
         
-        if not chat.exists:
+        if share_id is None:
             raise HTTPException(status_code=404, detail="Chat not found")
-            
-        chat_data = chat.to_dict()
-        
-        # Tạo một bản sao của chat trong collection shared_chats
-        shared_chat_ref = db.collection("shared_chats").document()
-        shared_chat_data = {
-            "original_chat_id": chat_id,
-            "original_user_id": uid,
-            "title": chat_data.get("title", "Untitled Chat"),
-            "messages": chat_data.get("messages", []),
-            "timestamp": datetime.now(),
-            "share_count": 0
-        }
-        shared_chat_ref.set(shared_chat_data)
         
         return {
             "status": "success", 
             "message": "Chat shared successfully",
-            "share_id": shared_chat_ref.id
+            "share_id": share_id
         }
     except Exception as e:
         logger.error(f"Error sharing chat: {str(e)}")
@@ -332,19 +309,11 @@ async def get_shared_chat(
 ):
     """Lấy thông tin của một đoạn chat được chia sẻ"""
     try:
-        db = firestore.client()
-        shared_chat_ref = db.collection("shared_chats").document(share_id)
-        shared_chat = shared_chat_ref.get()
+        # Lấy chat được chia sẻ và tăng số lượt xem
+        shared_chat_data = await aio.get_shared_chat(share_id)
         
-        if not shared_chat.exists:
+        if shared_chat_data is None:
             raise HTTPException(status_code=404, detail="Shared chat not found")
-            
-        shared_chat_data = shared_chat.to_dict()
-        
-        # Tăng số lượt xem
-        shared_chat_ref.update({
-            "share_count": firestore.Increment(1)
-        })
         
         return {
             "status": "success",
@@ -6,14 +6,19 @@ import API_URL from "../utils/api";
 export default function ArchiveChatsModal({ open, onClose, onSelectChat }) {
   const [archivedChats, setArchivedChats] = useState([]);
   const [selectedChat, setSelectedChat] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loading, setLoading] = useState(false);
   const { user } = useAuth();
 
-  const loadArchivedChats = async () => {
+  const loadArchivedChats = async (cursor = null) => {
     if (!user) return;
     
+    setLoading(true);
     try {
       const token = await user.getIdToken();
-      const response = await fetch(`${API_URL}/user/archived-chats`, {
+      // API trả từng trang; trang sau chỉ tải khi người dùng bấm "Xem thêm"
+      const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${API_URL}/user/archived-chats${params}`, {
         headers: { Authorization: `Bearer ${token}` }
       });
       
@@ -22,9 +27,12 @@ export default function ArchiveChatsModal({ open, onClose, onSelectChat }) {
       }
       
       const data = await response.json();
-      setArchivedChats(data.chats || []);
+      setArchivedChats(prev => cursor ? [...prev, ...(data.chats || [])] : (data.chats || []));
+      setNextCursor(data.next_cursor || null);
     } catch (error) {
       console.error('Error loading archived chats:', error);
+    } finally {
+      setLoading(false);
     }
   };
 
@@ -141,6 +149,14 @@ export default function ArchiveChatsModal({ open, onClose, onSelectChat }) {
             ))}
           </tbody>
         </table>
+        {nextCursor && (
+          <div style={{ textAlign: 'center' }}>
+            <button onClick={() => loadArchivedChats(nextCursor)} disabled={loading}
+              style={{ background: '#333', color: '#fff', border: '1px solid #555', borderRadius: 8, padding: '8px 20px', fontSize: 15, cursor: loading ? 'default' : 'pointer' }}>
+              {loading ? 'Đang tải...' : 'Xem thêm'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -78,6 +78,8 @@ function ChatBot() {
   const [showSources, setShowSources] = useState({});
   const [showArchivedChats, setShowArchivedChats] = useState(false);
   const [archivedChats, setArchivedChats] = useState([]);
+  const [archivedCursor, setArchivedCursor] = useState(null);
+  const [loadingArchived, setLoadingArchived] = useState(false);
   const [showShareModal, setShowShareModal] = useState(false);
   const [shareLink, setShareLink] = useState('');
   const [showWelcomeModal, setShowWelcomeModal] = useState(false);
@@ -494,11 +496,15 @@ function ChatBot() {
     setShowSettingsModal(true);
   };
 
-  const loadArchivedChats = async () => {
+  // Tải một trang chat đã lưu trữ; cursor = null thì tải lại từ trang đầu,
+  // các trang sau chỉ tải khi người dùng bấm "Xem thêm"
+  const loadArchivedChats = async (cursor = null) => {
     if (!user) return;
     
+    setLoadingArchived(true);
     try {
-      const response = await fetch(`${API_URL}/user/archived-chats`, {
+      const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${API_URL}/user/archived-chats${params}`, {
         headers: {
           'Authorization': `Bearer ${await user.getIdToken()}`
         }
@@ -509,9 +515,12 @@ function ChatBot() {
       }
       
       const data = await response.json();
-      setArchivedChats(data.chats || []);
+      setArchivedChats(prev => cursor ? [...prev, ...(data.chats || [])] : (data.chats || []));
+      setArchivedCursor(data.next_cursor || null);
     } catch (error) {
       console.error('Error loading archived chats:', error);
+    } finally {
+      setLoadingArchived(false);
     }
   };
 
@@ -1093,7 +1102,8 @@ function ChatBot() {
             <div className="chat-history">
               {user ? (
                 (showArchivedChats ? archivedChats : state.chatHistory).length > 0 ? (
-                  (showArchivedChats ? archivedChats : state.chatHistory).map((conversation) => (
+                  <>
+                  {(showArchivedChats ? archivedChats : state.chatHistory).map((conversation) => (
                     <div 
                       key={conversation.id}
                       className={`chat-history-item ${state.currentChatId === conversation.id ? 'active' : ''} ${editingChatId === conversation.id ? 'editing' : ''}`}
@@ -1172,7 +1182,17 @@ function ChatBot() {
                         )}
                       </div>
                     </div>
-                  ))
+                  ))}
+                  {showArchivedChats && archivedCursor && (
+                    <button
+                      className="load-more-button"
+                      onClick={() => loadArchivedChats(archivedCursor)}
+                      disabled={loadingArchived}
+                    >
+                      {loadingArchived ? "Đang tải..." : "Xem thêm"}
+                    </button>
+                  )}
+                  </>
                 ) : (
                   <div className="no-chat-history">
                     <p>{showArchivedChats ? "Chưa có chat đã lưu trữ" : "Chưa có lịch sử trò chuyện"}</p>